@@ -1,22 +1,59 @@
-import os,json,re,uuid,logging,asyncio,sqlite3
-from typing import Optional, List, Dict, Any
-from fastapi import FastAPI, Request, BackgroundTasks
+import os,json,re,uuid,time,logging,asyncio
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Optional, List, Dict, Any, AsyncIterator, Awaitable, Callable, Tuple
+from fastapi import FastAPI, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse, FileResponse
+from fastapi.responses import JSONResponse, HTMLResponse, FileResponse, StreamingResponse, Response
 from starlette.middleware.sessions import SessionMiddleware
-from pydantic import BaseModel
-from langchain_ollama import ChatOllama
-from langchain.schema import HumanMessage, AIMessage, SystemMessage
-
-from config import DB_FILE, MAX_FACTS_PER_USER, DEFAULT_INTIMACY, MAX_INTIMACY, MIN_INTIMACY, ALPHA, MAX_MEMORY
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+from config import DB_FILE, DEFAULT_INTIMACY, MAX_INTIMACY, MIN_INTIMACY, ALPHA, MAX_MEMORY
+from config import LLM_BACKEND, LLM_MODEL, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX, PROMPT_METRICS
+from config import FAKE_LLM_LATENCY, FAKE_LLM_TOKENS_PER_SEC, FAKE_LLM_PARALLEL, SERVER_TIMING
+from config import DB_SHARED, DB_CACHE_SIZE, DB_FLUSH_INTERVAL, MEMORY_TOP_K, EMBEDDER, EMBED_MODEL, HISTORY_SUMMARY
+from config import POSTPROCESS_WORKERS, POSTPROCESS_QUEUE_SIZE, POSTPROCESS_DROP_POLICY, POSTPROCESS_PUSH_TIMEOUT, JUDGE_MODE
+from config import POSTPROCESS_DRAIN_TIMEOUT, POSTPROCESS_CHAT_TIMEOUT
+from config import POST_REPLY_TIMEOUTS
+from config import WARMUP, WARMUP_STEPS, WARMUP_TIMEOUT, AUDIO_DIR
+from config import FAST_PATH, FAST_PATH_POOL_SIZE, FAST_PATH_MAX_KEYS
+from config import WS_SEND_QUEUE_SIZE, WS_SEND_TIMEOUT, WS_HEARTBEAT_INTERVAL, WS_HEARTBEAT_TIMEOUT
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_BUDGET_SPLIT, CONTEXT_SUMMARIZE_DROPPED, CONTEXT_SUMMARY_TOKENS
 from utils.regex import extract_emotion_tag, keyword_intimacy_fallback, emotion_weight,extract_facts
-from tts.voicevox import synthesize_with_translation
+from utils.text_analysis import analyze, analyzer, low_info_class
+from utils.reply_pool import ReplyPool
+from utils.jobs import PostTurnPipeline
+from utils.json_parse import parse_json_object
+from llm.backend import lazy_chat_model
+from llm.context import ContextBudget
+from llm.prompts import extract_facts_prompt
+from llm.scheduler import scheduler as llm_scheduler, ScheduledModel, SchedulerBusy, current_user
+from utils.metrics import REGISTRY, CONTENT_TYPE, CACHE_HIT_RATE, CACHE_ENTRIES, ServerTimingMiddleware
+from utils.metrics import span, timed, record_llm_tokens, run_in_thread
+from utils.warmup import Warmup
+from utils.taskgraph import Node, run_graph
+from utils.push import PushConnection, PushClosed, receive_or_disconnect, CLOSE_NO_SESSION, CLOSE_GOING_AWAY
+from memory.store import UserStore
+from memory.retrieval import MemoryRetriever, build_embedder
+from memory.history import ConversationStore
+from tts.voicevox import synthesize_with_translation, synthesize_chunks, tts as voicevox_client, audio_cache, translator
+from tts.voicevox import get_engine_version
+from tts.cache import MemoryAudioCache
 # ------------------ 一般設定 ------------------
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("app")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await _startup()
+    try:
+        yield
+    finally:
+        await _shutdown()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     SessionMiddleware,
     secret_key=os.environ.get("FLASK_SECRET_KEY", "my-dev-secret-key"),
@@ -28,30 +65,68 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+if SERVER_TIMING:
+    app.add_middleware(ServerTimingMiddleware)  # 每個回應附上各階段耗時
 from fastapi.staticfiles import StaticFiles
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.mount("/templates", StaticFiles(directory="templates"), name="templates")
 
-chat_model = ChatOllama(model="gemma3")
-MEMORY_LOCK = asyncio.Lock()
+# 所有呼叫使用相同的 keep_alive / num_ctx，模型常駐且 KV cache 前綴可重用
+# LLM_BACKEND = "fake" 時換成假模型，不需要 Ollama 也能跑完整流程
+_fake = dict(fake_latency=FAKE_LLM_LATENCY, fake_tokens_per_sec=FAKE_LLM_TOKENS_PER_SEC, fake_parallel=FAKE_LLM_PARALLEL)
+# 模型在第一次呼叫（通常是暖機）時才建立，import app 不必載入 langchain_ollama
+_base_model = lazy_chat_model(LLM_BACKEND, LLM_MODEL, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX, **_fake)
+_json_model = lazy_chat_model(LLM_BACKEND, LLM_MODEL, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX,
+                               json_mode=True, **_fake)  # 裁判類呼叫強制輸出 JSON
+
+# 所有呼叫經過同一個排程器：使用者等待中的回覆優先，背景工作排隊太久就改用規則判斷
+chat_model = ScheduledModel(_base_model, llm_scheduler, "interactive")
+summary_model = ScheduledModel(_base_model, llm_scheduler, "background")
+judge_model = ScheduledModel(_json_model, llm_scheduler, "background")
+
+# 記憶抽取與親密度評估在回覆送出後才於背景執行，同一使用者依序處理
+post_turn = PostTurnPipeline(POSTPROCESS_WORKERS, POSTPROCESS_QUEUE_SIZE, POSTPROCESS_DROP_POLICY)
+
+_draining = False  # 關機中，/readyz 回 503 讓負載平衡器停止導流
+_sockets: "set[PushConnection]" = set()  # 目前的 WebSocket 連線，關機時通知用戶端改連其他 worker
+
+async def _startup():
+    """lifespan 啟動：開啟資料庫、啟動背景 worker，暖機在背景進行不阻擋啟動。"""
+    global _draining
+    _draining = False
+    await run_in_thread("startup_db", _open_stores)
+    await post_turn.start()
+    warmup.start()
+
+async def _shutdown():
+    global _draining
+    _draining = True
+    for connection in list(_sockets):
+        await connection.close(CLOSE_GOING_AWAY, "server shutdown")
+    await warmup.stop()
+    await post_turn.stop(POSTPROCESS_DRAIN_TIMEOUT)  # 已排入的記憶/親密度工作先做完
+    await user_store.flush()
+    await voicevox_client.aclose()
+
+def _open_stores() -> None:
+    os.makedirs(AUDIO_DIR, exist_ok=True)
+    user_store.open()
+    history_store.open()
 
 # ------------------ 資料庫初始化 ------------------
 
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS user_memory (
-        user_id TEXT PRIMARY KEY,
-        facts TEXT,
-        intimacy INTEGER
-    )
-    """)
-    conn.commit()
-    conn.close()
+user_store = UserStore(DB_FILE, cache_size=DB_CACHE_SIZE, flush_interval=DB_FLUSH_INTERVAL, shared=DB_SHARED)
+memory_retriever = MemoryRetriever(
+    user_store, build_embedder("hashing" if LLM_BACKEND == "fake" else EMBEDDER, EMBED_MODEL)
+)
+history_store = ConversationStore(DB_FILE, window=MAX_MEMORY)  # session cookie 只存 user_id
+# 每輪放進 prompt 的歷史對話與記憶由 token 預算決定，長訊息不會把 prompt 撐爆
+context_budget = ContextBudget(CONTEXT_TOKEN_BUDGET, CONTEXT_BUDGET_SPLIT, CONTEXT_SUMMARIZE_DROPPED, CONTEXT_SUMMARY_TOKENS)
 
-init_db()
+# 低資訊訊息的回覆池，key 為 (訊息類別, 親密度階段, 上一句情緒)
+reply_pool = ReplyPool(FAST_PATH_POOL_SIZE, FAST_PATH_MAX_KEYS)
 
 # ------------------ 資料模型 ------------------
 
@@ -61,67 +136,54 @@ class ChatPayload(BaseModel):
 class IntimacyUpdatePayload(BaseModel):
     amount: int
 
-# ------------------ 工具：非同步包裝 ------------------
-
-async def _to_thread(func, *args, **kwargs):
-    """把阻塞/CPU 或外部 I/O 的呼叫丟到 thread pool。"""
-    return await asyncio.to_thread(func, *args, **kwargs)
+class JudgeResult(BaseModel):
+    summary: str = ""
+    facts: List[str] = Field(default_factory=list)
+    intimacy_change: int = 0
+    emotion: Optional[str] = None
+
+    @field_validator("facts", mode="before")
+    @classmethod
+    def _facts_as_list(cls, v):
+        if v is None:
+            return []
+        if isinstance(v, str):
+            return [v]
+        return [str(f) for f in v if f]
+
+    @field_validator("intimacy_change", mode="before")
+    @classmethod
+    def _clamp_change(cls, v):
+        try:
+            return max(-2, min(2, int(v)))
+        except (TypeError, ValueError):
+            return 0
+
+    @field_validator("emotion", mode="before")
+    @classmethod
+    def _normalize_emotion(cls, v):
+        return str(v).strip().lower() or None if v else None
 
 # ------------------ 記憶與親密度系統（ SQLite，單一 user_id ） ------------------
 
 async def get_user_data(user_id: str) -> Dict[str, Any]:
-    async with MEMORY_LOCK:
-        def _get():
-            try:
-                conn = sqlite3.connect(DB_FILE)
-                c = conn.cursor()
-                c.execute("SELECT facts, intimacy FROM user_memory WHERE user_id = ?", (user_id,))
-                row = c.fetchone()
-                conn.close()
-                if row:
-                    facts, intimacy = row
-                    return {
-                        "facts": json.loads(facts) if facts else [],
-                        "intimacy": intimacy if intimacy is not None else DEFAULT_INTIMACY
-                    }
-                else:
-                    return {"facts": [], "intimacy": DEFAULT_INTIMACY}
-            except Exception as e:
-                logger.error(f"get_user_data 資料庫異常: {e}")
-                return {"facts": [], "intimacy": DEFAULT_INTIMACY}
-        return await _to_thread(_get)
+    return await user_store.get(user_id)
 
 async def set_user_data(user_id: str, data: Dict[str, Any]) -> None:
-    async with MEMORY_LOCK:
-        def _set():
-            try:
-                conn = sqlite3.connect(DB_FILE)
-                c = conn.cursor()
-                facts_json = json.dumps(data.get("facts", []), ensure_ascii=False)
-                intimacy = data.get("intimacy", DEFAULT_INTIMACY)
-                c.execute("""
-                    INSERT INTO user_memory (user_id, facts, intimacy)
-                    VALUES (?, ?, ?)
-                    ON CONFLICT(user_id) DO UPDATE SET facts=excluded.facts, intimacy=excluded.intimacy
-                """, (user_id, facts_json, intimacy))
-                conn.commit()
-                conn.close()
-            except Exception as e:
-                logger.error(f"set_user_data 資料庫異常: {e}")
-        await _to_thread(_set)
+    await user_store.set(user_id, data)
 
 async def append_memory(user_id: str, new_fact: str) -> None:
-    user_data = await get_user_data(user_id)
-    if new_fact not in user_data["facts"]:
-        user_data["facts"].append(new_fact)
-        if len(user_data["facts"]) > MAX_FACTS_PER_USER:
-            user_data["facts"] = user_data["facts"][-MAX_FACTS_PER_USER:]
-        await set_user_data(user_id, user_data)
+    if await memory_retriever.add_fact(user_id, new_fact):
         logger.info(f"新增記憶給使用者 {user_id}: {new_fact}")
 
-async def get_memory_prompt(user_id: str) -> str:
-    user_data = await get_user_data(user_id)
-    facts: List[str] = user_data.get("facts", [])
+@timed("memory_search")
+async def get_memory_prompt(user_id: str, query: str = "") -> str:
+    """只放入與目前訊息最相關的 MEMORY_TOP_K 筆記憶。"""
+    facts: List[str] = await memory_retriever.top_k(user_id, query, MEMORY_TOP_K)
+    return render_memory_prompt(tuple(context_budget.fit_facts(facts)))
+
+@lru_cache(maxsize=1024)
+def render_memory_prompt(facts: Tuple[str, ...]) -> str:
     if facts:
         mem_lines = "\n".join(f"- {fact}" for fact in facts)
         return (
@@ -132,14 +194,13 @@ async def get_memory_prompt(user_id: str) -> str:
     return ""
 
 async def adjust_intimacy(user_id: str, amount: int) -> int:
-    user_data = await get_user_data(user_id)
-    old_val = user_data["intimacy"]
-    raw_new = old_val + amount
-    smoothed = (1 - ALPHA) * old_val + ALPHA * raw_new
-    new_val = max(MIN_INTIMACY, min(MAX_INTIMACY, round(smoothed)))
-    
-    user_data["intimacy"] = new_val
-    await set_user_data(user_id, user_data)
+    # 平滑後 (1 - ALPHA) * old + ALPHA * (old + amount) = old + ALPHA * amount，
+    # 在資料庫內一次完成，多個 worker 同時調整也不會互相覆蓋
+    try:
+        new_val = await user_store.adjust_intimacy(user_id, ALPHA * amount, MIN_INTIMACY, MAX_INTIMACY)
+    except Exception as e:
+        logger.error(f"adjust_intimacy 資料庫異常: {e}")
+        return (await get_user_data(user_id))["intimacy"]
     logger.info(f"使用者 {user_id} 親密度調整為 {new_val}")
     return new_val
 
@@ -163,17 +224,9 @@ def build_intimacy_tier_prompt(value: int) -> str:
 
 # ------------------ helper functions ------------------
 
-async def generate_system_prompt(user_id: str) -> str:
-    user_data = await get_user_data(user_id)
-    current_intimacy = user_data["intimacy"]
-    intimacy_prompt = (
-        f"\n[親密度：{current_intimacy}({get_intimacy_level_name(current_intimacy)})]\n"
-        f"{build_intimacy_tier_prompt(current_intimacy)}\n"
-    )
-    memory_prompt = await get_memory_prompt(user_id)
-
-    system_content = (
-        """
+# 固定不變的角色設定放在 prompt 最前面，讓 Ollama 可以重用 KV cache 前綴；
+# 親密度數值與記憶這類每輪都會變的內容放到最後（見 build_chat_messages）
+PERSONA_PROMPT = """
 你是虛擬角色「月讀醬」，是一位可愛、溫柔又有點傲嬌的電子女僕少女，擁有撒嬌屬性的語氣，總是以親切、調皮或甜美的方式和使用者互動。
 
 角色設定：
@@ -198,50 +251,122 @@ async def generate_system_prompt(user_id: str) -> str:
 - **請不要主動加上「晚安/早安/午安」或任何時間問候，除非使用者明確提到睡覺或時間相關話題。**
 現在開始，每一次的回答都請你扮演這個角色～請好好和主人聊天吧♥
 """
-        + intimacy_prompt
-        + memory_prompt
-    )
-    return system_content
 
-def build_chat_messages(session_history: list, user_message: str, system_prompt: str) -> list:
+@lru_cache(maxsize=8)
+def render_system_prompt(tier_prompt: str) -> str:
+    return PERSONA_PROMPT + f"\n{tier_prompt}\n"
+
+@lru_cache(maxsize=1024)
+def render_context_prompt(intimacy: int, memory_prompt: str) -> str:
+    return f"[親密度：{intimacy}({get_intimacy_level_name(intimacy)})]\n" + memory_prompt
+
+@timed("system_prompt")
+async def generate_system_prompt(user_id: str, user_message: str = "") -> str:
+    """穩定的 system prompt：角色設定 + 親密度階段，只在換階段時改變。"""
+    user_data = await get_user_data(user_id)
+    return render_system_prompt(build_intimacy_tier_prompt(user_data["intimacy"]))
+
+async def generate_context_prompt(user_id: str, user_message: str = "") -> str:
+    """每輪變動的內容：目前親密度數值與相關記憶。"""
+    user_data = await get_user_data(user_id)
+    memory_prompt = await get_memory_prompt(user_id, user_message)
+    return render_context_prompt(user_data["intimacy"], memory_prompt)
+
+def build_chat_messages(session_history: list, user_message: str, system_prompt: str,
+                        history_summary: Optional[str] = None, context_prompt: Optional[str] = None) -> list:
+    summary_prompt = f"先前對話摘要：{history_summary}" if history_summary else None
+    # 由新到舊放入歷史對話直到用完 token 預算，放不下的壓成一行
+    plan = context_budget.pack(session_history, system_prompt, (summary_prompt, context_prompt, user_message))
     messages = [SystemMessage(content=system_prompt)]
-    for m in session_history[-MAX_MEMORY:]:
+    if summary_prompt:
+        messages.append(SystemMessage(content=summary_prompt))
+    if plan.summary:
+        messages.append(SystemMessage(content=plan.summary))
+    for m in plan.history:
         messages.append(HumanMessage(content=m["user"]))
         messages.append(AIMessage(content=m["bot"]))
+    # 變動內容緊貼在最新訊息前，前面的 system prompt 與歷史對話才能命中前綴快取
+    if context_prompt:
+        messages.append(SystemMessage(content=context_prompt))
     messages.append(HumanMessage(content=user_message))
     return messages
 
-async def call_llm(messages: list) -> str:
+@timed("prompt")
+async def build_turn_messages(user_id: str, user_message: str) -> list:
+    system_prompt = await generate_system_prompt(user_id, user_message)
+    context_prompt = await generate_context_prompt(user_id, user_message)
+    history, summary = await load_history(user_id)
+    return build_chat_messages(history, user_message, system_prompt, summary, context_prompt)
+
+def log_prompt_metrics(metadata: Dict[str, Any], started: float, first_token: Optional[float] = None) -> None:
+    """累計 token 數到 /metrics；PROMPT_METRICS 開啟時另外記錄 prompt-eval 耗時與首字延遲。"""
+    record_llm_tokens(chat_model.model, metadata)
+    if not PROMPT_METRICS:
+        return
+    ns = 1e-9
+    prompt_tokens = metadata.get("prompt_eval_count")
+    prompt_eval = (metadata.get("prompt_eval_duration") or 0) * ns
+    load = (metadata.get("load_duration") or 0) * ns
+    if first_token is None:
+        # 非串流呼叫無法量首字時間，以載入 + prompt-eval 時間估計
+        ttft = load + prompt_eval
+    else:
+        ttft = first_token - started
+    logger.info(
+        f"[prompt] prompt_tokens={prompt_tokens} prompt_eval={prompt_eval * 1000:.0f}ms "
+        f"load={load * 1000:.0f}ms ttft={ttft * 1000:.0f}ms eval_tokens={metadata.get('eval_count')} "
+        f"total={(time.perf_counter() - started) * 1000:.0f}ms"
+    )
+
+@timed("llm")
+async def call_llm(messages: list, model=None) -> str:
     try:
-        response = await _to_thread(chat_model.invoke, messages)
+        started = time.perf_counter()
+        response = await (model or chat_model).ainvoke(messages)
+        log_prompt_metrics(response.response_metadata, started)
         return response.content
     except Exception as e:
         logger.error(f"模型回應失敗: {e}")
         return "好像哪裡...出了一點問題～"
 
-async def call_llm_and_parse_json(prompt: str) -> Optional[dict]:
-    """呼叫 LLM 並嘗試解析回傳內容中的 JSON。"""
+async def stream_llm(messages: list) -> AsyncIterator[str]:
+    """以串流方式呼叫 LLM，逐段 yield 回覆文字。"""
+    emitted = False
+    started = time.perf_counter()
+    first_token = None
+    metadata: Dict[str, Any] = {}
+    try:
+        with span("llm"):
+            async for chunk in chat_model.astream(messages):
+                if chunk.response_metadata:
+                    metadata = chunk.response_metadata
+                if chunk.content:
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                    emitted = True
+                    yield chunk.content
+        log_prompt_metrics(metadata, started, first_token)
+    except Exception as e:
+        logger.error(f"模型串流回應失敗: {e}")
+        if not emitted:
+            yield "好像哪裡...出了一點問題～"
+
+@timed("judge_llm")
+async def call_llm_and_parse_json(prompt: str, model=None) -> Optional[dict]:
+    """呼叫 LLM（JSON 模式）並解析回傳內容中的第一個 JSON 物件；model 預設為 judge_model。"""
+    model = model or judge_model
     try:
-        result = await _to_thread(chat_model.invoke, [HumanMessage(content=prompt)])
-        m = re.search(r"\{.*\}", result.content, re.DOTALL)
-        if m:
-            return json.loads(m.group(0))
+        result = await model.ainvoke([HumanMessage(content=prompt)])
+        record_llm_tokens(model.model, result.response_metadata)
+        return parse_json_object(result.content)
+    except SchedulerBusy as e:
+        logger.warning(f"LLM 佇列忙碌，改用規則判斷：{e}")
     except Exception as e:
         logger.error(f"call_llm_and_parse_json 失敗：{e}")
     return None
 
-async def extract_facts_from_llm(message: str) -> List[str]:
-    prompt = f"""
-你是一個會從使用者對話中提取記憶的助手。請從以下訊息中提取出「摘要」與「記憶事實」。
-只回傳 JSON 結構如下：
-{{
-  "summary": "...",
-  "facts": ["...", "..."]
-}}
-訊息內容：
-「{message}」
-"""
-    data = await call_llm_and_parse_json(prompt)
+async def extract_facts_from_llm(message: str, model=None) -> List[str]:
+    data = await call_llm_and_parse_json(extract_facts_prompt(message), model)
     if data:
         return data.get("facts", []) or []
     return []
@@ -274,16 +399,151 @@ async def evaluate_intimacy_from_llm(user_message: str, bot_reply: str, current_
         return max(-2, min(2, change))
     return 0
 
+@timed("judge")
+async def judge_turn(user_message: str, bot_reply: str, current_intimacy: int) -> JudgeResult:
+    """一次 LLM 呼叫同時取得摘要、記憶事實、親密度變化與情緒；失敗時改用 regex 規則。"""
+    prompt = f"""
+你是對話分析助手，需要同時完成兩件事：
+1. 從使用者訊息中提取「摘要」與值得長期記住的「記憶事實」（以第三人稱「他」描述，沒有就回傳空陣列）。
+2. 擔任「對話親密度影響」的裁判，綜合使用者訊息與機器人回覆，給出 -2 到 +2 的整數。
+
+親密度規則（越高越親密）：
+- 明確讚美、撒嬌、示好、感謝、分享私事或脆弱 → +1 ~ +2
+- 普通閒聊或資訊型問題 → 0
+- 明確拒絕、批評、貶低、嘲諷 → -1 ~ -2
+- 若雙方語氣一致偏甜/親暱，可適度提高；若機器人語氣冷淡、拒絕，則降低。
+- 不要因為單一正向詞就極端加分；請考慮上下文完整語意。
+
+emotion 為機器人回覆的情緒，只能是 joy、sad、angry、neutral、cute、shy 其中之一。
+
+輸入：
+使用者：「{user_message}」
+機器人回覆：「{bot_reply}」
+目前親密度：{current_intimacy}
+
+只回傳 JSON 結構如下：
+{{
+  "summary": "...",
+  "facts": ["...", "..."],
+  "intimacy_change": 0,
+  "emotion": "neutral"
+}}
+"""
+    data = await call_llm_and_parse_json(prompt)
+    result = None
+    if data:
+        try:
+            result = JudgeResult.model_validate(data)
+        except ValidationError as e:
+            logger.warning(f"裁判 JSON 格式不符：{e}")
+    heuristic = analyze(user_message)
+    if result is None:
+        return JudgeResult(facts=list(heuristic.facts), intimacy_change=heuristic.intimacy_change)
+    if not result.facts:
+        result.facts = list(heuristic.facts)
+    if result.intimacy_change == 0:
+        result.intimacy_change = heuristic.intimacy_change
+    return result
+
 # ------------------ 會話工具 ------------------
 
 def ensure_user_id_in_session(session: dict) -> str:
     if "user_id" not in session:
         session["user_id"] = str(uuid.uuid4())
         logger.info(f"分配新使用者ID: {session['user_id']}")
-    if "chat_history" not in session:
-        session["chat_history"] = []
+    # 舊版把整段對話存在 cookie，改為伺服器端保存後直接丟掉
+    session.pop("chat_history", None)
+    current_user.set(session["user_id"])  # LLM 排程器依使用者輪流
     return session["user_id"]
 
+async def load_history(user_id: str):
+    history = await history_store.recent(user_id)
+    summary = await history_store.get_summary(user_id) if HISTORY_SUMMARY else None
+    return history, summary
+
+async def record_turn(user_id: str, user_message: str, bot_reply: str) -> None:
+    overflow = await history_store.append(user_id, user_message, bot_reply)
+    if overflow and HISTORY_SUMMARY:
+        await post_turn.submit(user_id, lambda: update_history_summary(user_id, overflow))
+
+async def update_history_summary(user_id: str, turns: List[Dict[str, str]]) -> None:
+    """把移出視窗的舊對話併入 rolling summary。"""
+    current_user.set(user_id)
+    previous = await history_store.get_summary(user_id) or "（無）"
+    dialog = "\n".join(f"使用者：{t['user']}\n月讀醬：{t['bot']}" for t in turns)
+    prompt = f"""
+請把「既有摘要」與「新的對話」合併成一段不超過 150 字的正體中文摘要，
+保留使用者提到的重要事情、情緒與尚未結束的話題，只輸出摘要本身。
+
+既有摘要：
+{previous}
+
+新的對話：
+{dialog}
+"""
+    # 不經過 call_llm：失敗時它會回傳給使用者看的錯誤訊息，不能存成摘要
+    try:
+        response = await summary_model.ainvoke([HumanMessage(content=prompt)])
+        record_llm_tokens(summary_model.model, response.response_metadata)
+    except SchedulerBusy as e:
+        logger.warning(f"LLM 佇列忙碌，保留原本的對話摘要：{e}")
+        return
+    except Exception as e:
+        logger.error(f"更新對話摘要失敗，保留原本的摘要：{e}")
+        return
+    summary = (response.content or "").strip()
+    if summary:
+        await history_store.set_summary(user_id, summary)
+
+def _ndjson(event: Dict[str, Any]) -> bytes:
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+async def _aiter(items):
+    """list 或 async iterator 都以 async for 逐一取出。"""
+    if isinstance(items, list):
+        for item in items:
+            yield item
+    else:
+        async for item in items:
+            yield item
+
+# ------------------ 低資訊訊息快速路徑 ------------------
+
+async def fast_path_reply(user_id: str, user_message: str) -> Optional[str]:
+    """「嗯」「好」「謝謝」這類訊息直接從回覆池取回覆；其他訊息或產生失敗時回傳 None。"""
+    if not FAST_PATH:
+        return None
+    cls = low_info_class(user_message)
+    if cls is None:
+        return None
+    intimacy = (await get_user_data(user_id))["intimacy"]
+    history = await history_store.recent(user_id)
+    last_emotion = (extract_emotion_tag(history[-1]["bot"]) if history else None) or "none"
+    key = (cls, get_intimacy_level_name(intimacy), last_emotion)
+    with span("fast_path"):
+        return await reply_pool.get(key, lambda background: generate_pooled_reply(user_message, intimacy, background))
+
+async def generate_pooled_reply(user_message: str, intimacy: int, background: bool) -> Optional[str]:
+    """不帶對話紀錄與記憶產生回覆。
+
+    使用者在等（miss）時只產生文字，語音和一般流程一樣在回覆之後合成；
+    背景補充回覆池時才先合成語音，之後命中時音檔已在快取裡。
+    """
+    system_prompt = render_system_prompt(build_intimacy_tier_prompt(intimacy))
+    messages = build_chat_messages([], user_message, system_prompt,
+                                   context_prompt=render_context_prompt(intimacy, ""))
+    model = summary_model if background else chat_model  # 補充回覆池不搶使用者的名額
+    try:
+        response = await model.ainvoke(messages)
+        record_llm_tokens(model.model, response.response_metadata)
+    except Exception as e:
+        logger.warning(f"快速回覆產生失敗，改走一般流程：{e}")
+        return None
+    reply = response.content.strip()
+    if reply and background:
+        await generate_tts(reply)
+    return reply or None
+
 # ------------------ 路由 ------------------
 
 @app.get("/")
@@ -293,50 +553,339 @@ async def index() -> HTMLResponse:
     return FileResponse(index_path)
 
 @app.post("/chat")
-async def chat(req: Request, payload: ChatPayload, background: BackgroundTasks):
+async def chat(req: Request, payload: ChatPayload):
     session = req.session
     user_id = ensure_user_id_in_session(session)
     user_message = (payload.message or "").strip()
     if not user_message:
         return JSONResponse({"error": "No message provided."}, status_code=400)
 
-    system_prompt = await generate_system_prompt(user_id)
-    messages = build_chat_messages(session.get("chat_history", []), user_message, system_prompt)
-
-    bot_reply = await call_llm(messages)
-
-    # 更新短期記憶於 session
-    session.setdefault("chat_history", []).append({"user": user_message, "bot": bot_reply})
-
-    # 更新長期記憶
-    await update_memory(user_id, user_message)
-
-    # 更新親密度
-    intimacy, total_change = await update_intimacy(user_id, user_message, bot_reply)
-
-    # TTS
-    audio_url = await generate_tts(bot_reply)
+    bot_reply = await fast_path_reply(user_id, user_message)
+    fast = bot_reply is not None
+    if not fast:
+        messages = await build_turn_messages(user_id, user_message)
+        bot_reply = await call_llm(messages)
+
+    # 回覆之後的工作只依賴 bot_reply：語音合成與寫入紀錄同時進行
+    # 長期記憶與親密度交給背景佇列；回應前最多等 POSTPROCESS_CHAT_TIMEOUT 秒取得親密度，
+    # 逾時才回傳目前親密度並標示 intimacy_pending，前端之後再呼叫 /get_intimacy
+    results = await run_graph([
+        Node("record", lambda _: record_turn(user_id, user_message, bot_reply)),
+        Node("post_turn", lambda _: post_turn.submit(
+            user_id, lambda: post_process_turn(user_id, user_message, bot_reply, fast)), deps=("record",)),
+        Node("user", lambda _: get_user_data(user_id), fallback=lambda _: {"intimacy": DEFAULT_INTIMACY}),
+        Node("tts", lambda _: generate_tts(bot_reply), timeout=POST_REPLY_TIMEOUTS.get("tts")),
+        Node("intimacy", lambda r: _intimacy_event(r["post_turn"], POSTPROCESS_CHAT_TIMEOUT), deps=("post_turn",)),
+    ])
+    event = results["intimacy"]
+    intimacy = event["intimacy"] if event else results["user"]["intimacy"]
 
     return JSONResponse(
         {
             "reply": bot_reply,
-            "audio_url": audio_url,
+            "audio_url": results["tts"],
             "intimacy": intimacy,
             "intimacy_level": get_intimacy_level_name(intimacy),
-            "intimacy_change": total_change,
+            "intimacy_change": event["intimacy_change"] if event else None,
+            "intimacy_pending": event is None,
         }
     )
 
+@app.post("/chat_stream")
+async def chat_stream(req: Request, payload: ChatPayload):
+    """串流版 /chat：以 NDJSON 逐行推送 token，再推送情緒、親密度與語音事件。"""
+    session = req.session
+    user_id = ensure_user_id_in_session(session)
+    user_message = (payload.message or "").strip()
+    if not user_message:
+        return JSONResponse({"error": "No message provided."}, status_code=400)
+
+    async def events() -> AsyncIterator[bytes]:
+        async for event in chat_turn_events(user_id, user_message):
+            yield _ndjson(event)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+OnEvent = Callable[[Dict[str, Any]], Awaitable[None]]
+_intimacy_pushes: "set[asyncio.Task]" = set()
+
+async def chat_turn_events(user_id: str, user_message: str,
+                           on_intimacy: Optional[OnEvent] = None) -> AsyncIterator[Dict[str, Any]]:
+    """一輪對話的事件：token → emotion → reply → audio_chunk… → audio → intimacy → done。
+
+    /chat_stream 與 /ws 共用。on_intimacy 有值時（WebSocket），親密度在背景工作完成時
+    立即經由它推送，不必等語音合成結束。
+    """
+    fast_reply = await fast_path_reply(user_id, user_message)
+    emotion = None
+    if fast_reply is not None:
+        bot_reply = fast_reply
+        yield {"type": "token", "content": bot_reply}
+    else:
+        messages = await build_turn_messages(user_id, user_message)
+        parts: List[str] = []
+        async for token in stream_llm(messages):
+            parts.append(token)
+            yield {"type": "token", "content": token}
+            if emotion is None and "]" in token:
+                # 情緒標籤一出現就先通知前端切換表情
+                emotion = extract_emotion_tag("".join(parts))
+                if emotion:
+                    yield {"type": "emotion", "emotion": emotion}
+        bot_reply = "".join(parts)
+    if emotion is None:
+        emotion = extract_emotion_tag(bot_reply)
+        if emotion:
+            yield {"type": "emotion", "emotion": emotion}
+
+    await record_turn(user_id, user_message, bot_reply)
+    yield {"type": "reply", "reply": bot_reply, "emotion": emotion}
+
+    job = await post_turn.submit(
+        user_id, lambda: post_process_turn(user_id, user_message, bot_reply, fast_reply is not None)
+    )
+    if on_intimacy is not None:
+        task = asyncio.create_task(_push_intimacy(job, on_intimacy))
+        _intimacy_pushes.add(task)
+        task.add_done_callback(_intimacy_pushes.discard)
+
+    # 分句合成，每句完成就先推送，前端依序播放；回覆池的回覆已預先整句合成過
+    playlist: List[str] = []
+    try:
+        if fast_reply is not None:
+            url = await generate_tts(bot_reply)
+            chunks = [url] if url else []
+        else:
+            chunks = synthesize_chunks(bot_reply)
+        async for url in _aiter(chunks):
+            if url:
+                yield {"type": "audio_chunk", "index": len(playlist), "audio_url": url}
+                playlist.append(url)
+    except Exception as e:
+        logger.error(f"TTS 生成失敗：{e}")
+    yield {"type": "audio", "audio_url": playlist[0] if playlist else None, "audio_urls": playlist}
+
+    if on_intimacy is None:
+        event = await _intimacy_event(job)
+        if event:
+            yield event
+    yield {"type": "done"}
+
+async def _intimacy_event(job: "asyncio.Future", timeout: float = POSTPROCESS_PUSH_TIMEOUT) -> Optional[Dict[str, Any]]:
+    """等待背景工作的親密度結果；被丟棄或逾時就回傳 None，前端可再呼叫 /get_intimacy。"""
+    try:
+        result = await asyncio.wait_for(asyncio.shield(job), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        return None
+    if not result:
+        return None
+    intimacy, total_change = result
+    return {"type": "intimacy", **intimacy_payload(intimacy), "intimacy_change": total_change}
+
+async def _push_intimacy(job: "asyncio.Future", on_intimacy: OnEvent) -> None:
+    event = await _intimacy_event(job)
+    if event:
+        try:
+            await on_intimacy(event)
+        except PushClosed:
+            pass  # 連線已關閉，前端重新連線時會收到 hello 裡的親密度
+
+def intimacy_payload(intimacy: int) -> Dict[str, Any]:
+    return {"intimacy": intimacy, "intimacy_level": get_intimacy_level_name(intimacy)}
+
+# ------------------ WebSocket 推送通道 ------------------
+
+@app.websocket("/ws")
+async def chat_socket(websocket: WebSocket):
+    """聊天、串流 token、情緒、親密度與語音事件都走同一條連線；連不上時前端改走 HTTP 路由。
+
+    用戶端訊息：chat（message, id）、get_intimacy、clear_session、clear_memory、ping、pong。
+    伺服器推送的事件與 /chat_stream 相同，另外附上對應 chat 的 id。
+    """
+    await websocket.accept()
+    user_id = websocket.session.get("user_id")
+    if not user_id or _draining:
+        # WebSocket 無法設定 cookie，需先呼叫任一 HTTP 路由取得 session
+        await websocket.close(CLOSE_GOING_AWAY if _draining else CLOSE_NO_SESSION)
+        return
+    current_user.set(user_id)
+    connection = PushConnection(websocket, WS_SEND_QUEUE_SIZE, WS_SEND_TIMEOUT,
+                                WS_HEARTBEAT_INTERVAL, WS_HEARTBEAT_TIMEOUT)
+    _sockets.add(connection)
+    await connection.start()
+    turn: Optional[asyncio.Task] = None
+    try:
+        await connection.send({"type": "hello", **intimacy_payload((await get_user_data(user_id))["intimacy"])})
+        while (message := await receive_or_disconnect(connection)) is not None:
+            kind = message.get("type")
+            if kind == "chat":
+                if turn is not None and not turn.done():
+                    await connection.send({"type": "error", "code": "busy", "id": message.get("id")})
+                    continue
+                turn = asyncio.create_task(_socket_turn(connection, user_id, message))
+            elif kind == "get_intimacy":
+                await connection.send({"type": "intimacy", **intimacy_payload((await get_user_data(user_id))["intimacy"])})
+            elif kind == "clear_session":
+                await clear_short_term(user_id)
+                await connection.send({"type": "cleared", "scope": "session", "message": CLEAR_SESSION_MESSAGE})
+            elif kind == "clear_memory":
+                await clear_long_term(user_id)
+                await connection.send({"type": "cleared", "scope": "memory", "message": CLEAR_MEMORY_MESSAGE})
+            elif kind == "ping":
+                await connection.send({"type": "pong", "t": message.get("t")})
+            elif kind != "pong":
+                code = "unknown_type" if kind else "bad_message"
+                await connection.send({"type": "error", "code": code, "id": message.get("id")})
+    except PushClosed:
+        pass
+    finally:
+        if turn is not None:
+            turn.cancel()
+        _sockets.discard(connection)
+        await connection.close()
+
+async def _socket_turn(connection: PushConnection, user_id: str, message: Dict[str, Any]) -> None:
+    turn_id = message.get("id")
+    user_message = str(message.get("message") or "").strip()
+
+    async def push(event: Dict[str, Any]) -> None:
+        await connection.send({**event, "id": turn_id})
+
+    current_user.set(user_id)
+    try:
+        if not user_message:
+            await push({"type": "error", "code": "empty"})
+            return
+        async for event in chat_turn_events(user_id, user_message, on_intimacy=push):
+            await push(event)
+    except PushClosed:
+        pass
+    except Exception as e:
+        logger.error(f"WebSocket 對話處理失敗：{e}")
+        try:
+            await push({"type": "error", "code": "internal"})
+        except PushClosed:
+            pass
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """解析單一區段的 Range 標頭（bytes=start-end / bytes=start- / bytes=-suffix）。"""
+    m = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not m or (not m.group(1) and not m.group(2)):
+        return None
+    if m.group(1):
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else size - 1
+    else:
+        start = max(0, size - int(m.group(2)))
+        end = size - 1
+    end = min(end, size - 1)
+    if start > end:
+        return None
+    return start, end
+
+@app.get("/audio/{clip_id}")
+async def get_audio(clip_id: str, req: Request):
+    """AUDIO_BACKEND = "memory" 時從記憶體回傳語音，支援 HTTP Range。"""
+    clip = audio_cache.get(clip_id) if isinstance(audio_cache, MemoryAudioCache) else None
+    if clip is None:
+        return JSONResponse({"error": "audio not found"}, status_code=404)
+    data, media_type = clip
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": "private, max-age=600"}
+    range_header = req.headers.get("range")
+    if range_header:
+        byte_range = _parse_range(range_header, len(data))
+        if byte_range is None:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{len(data)}"})
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        return Response(data[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+    return Response(data, media_type=media_type, headers=headers)
+
+VOICEVOX_IN_FLIGHT = REGISTRY.gauge("voicevox_in_flight", "各 VOICEVOX 引擎進行中的請求數", ("engine",))
+POST_TURN_DROPPED = REGISTRY.gauge("post_turn_dropped", "背景佇列滿而被丟棄的工作數")
+
+def _collect_runtime_stats() -> None:
+    """每次輸出 /metrics 前，把快取命中率與佇列狀態寫進 Gauge。"""
+    audio = audio_cache.stats()
+    CACHE_HIT_RATE.set(audio["hit_rate"], cache="audio")
+    CACHE_ENTRIES.set(audio["files"], cache="audio")
+    translation = translator.stats().get("cache")
+    if translation:
+        CACHE_HIT_RATE.set(translation["hit_rate"], cache="translation")
+        CACHE_ENTRIES.set(translation["entries"], cache="translation")
+    for engine in voicevox_client.stats():
+        VOICEVOX_IN_FLIGHT.set(engine["in_flight"], engine=engine["url"])
+    POST_TURN_DROPPED.set(post_turn.dropped)
+    pool = reply_pool.stats()
+    CACHE_HIT_RATE.set(pool["hit_rate"], cache="fast_path")
+    CACHE_ENTRIES.set(pool["entries"], cache="fast_path")
+
+REGISTRY.add_collector(_collect_runtime_stats)
+
+# ------------------ 暖機與健康檢查 ------------------
+
+async def _warm_chat() -> None:
+    # 用預設親密度的 system prompt 暖機，Ollama 會順便快取這段共用前綴的 KV
+    system_prompt = render_system_prompt(build_intimacy_tier_prompt(DEFAULT_INTIMACY))
+    messages = build_chat_messages([], "你好", system_prompt, context_prompt=render_context_prompt(DEFAULT_INTIMACY, ""))
+    await summary_model.ainvoke(messages)
+
+async def _warm_translate() -> None:
+    await translator.translate("你好", "可愛、撒嬌語氣")
+
+async def _warm_embed() -> None:
+    await run_in_thread("embed", memory_retriever.embedder.embed, ["你好"])
+
+async def _warm_tts() -> None:
+    await get_engine_version()
+    await voicevox_client.synthesize("こんにちは")
+
+async def _warm_fast_path() -> None:
+    # 預先為各類低資訊訊息產生預設親密度下的第一則回覆（含語音）
+    if not FAST_PATH:
+        return
+    for cls, messages in analyzer.low_info_rules.items():
+        message = messages[0]
+        await reply_pool.get((cls, get_intimacy_level_name(DEFAULT_INTIMACY), "none"),
+                             lambda background, m=message: generate_pooled_reply(m, DEFAULT_INTIMACY, True))
+
+async def _warm_caches() -> None:
+    analyze("你好")
+    await run_in_thread("audio_cache_scan", audio_cache.stats)  # disk 模式會在這裡掃描音檔目錄
+
+_WARMUP_STEPS = {
+    "chat": _warm_chat,
+    "translate": _warm_translate,
+    "embed": _warm_embed,
+    "tts": _warm_tts,
+    "caches": _warm_caches,
+    "fast_path": _warm_fast_path,
+}
+warmup = Warmup({name: _WARMUP_STEPS[name] for name in WARMUP_STEPS} if WARMUP else {}, WARMUP_TIMEOUT)
+
+@app.get("/healthz")
+async def healthz():
+    """行程還活著就回 200。"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """暖機完成且不在關機中才回 200；負載平衡器以此決定是否導流。"""
+    status = warmup.status()
+    if _draining or not warmup.done:
+        return JSONResponse({"status": "draining" if _draining else "warming_up", "warmup": status}, status_code=503)
+    return {"status": "ready", "warmup": status}
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    """Prometheus 文字格式的效能指標。"""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
 @app.get("/get_intimacy")
 async def get_intimacy(req: Request):
     user_id = ensure_user_id_in_session(req.session)
     data = await get_user_data(user_id)
-    return JSONResponse(
-        {
-            "intimacy": data["intimacy"],
-            "intimacy_level": get_intimacy_level_name(data["intimacy"]),
-        }
-    )
+    return JSONResponse(intimacy_payload(data["intimacy"]))
 
 @app.post("/update_intimacy")
 async def update_intimacy(req: Request, payload: IntimacyUpdatePayload):
@@ -346,35 +895,99 @@ async def update_intimacy(req: Request, payload: IntimacyUpdatePayload):
         {"intimacy": intimacy, "intimacy_level": get_intimacy_level_name(intimacy)}
     )
 
+CLEAR_SESSION_MESSAGE = "已清除對話記憶（短期記憶）"
+CLEAR_MEMORY_MESSAGE = "已清除使用者的所有記憶（長期 + 短期 )"
+
+async def clear_short_term(user_id: str) -> None:
+    await history_store.clear(user_id)
+
+async def clear_long_term(user_id: str) -> None:
+    await history_store.clear(user_id)
+    async with user_store.lock(user_id):
+        await user_store.delete(user_id)
+        memory_retriever.forget(user_id)
+        logger.info(f"已刪除使用者 {user_id} 的長期記憶")
+
 @app.post("/clear_session")
 async def clear_session(req: Request):
-    req.session.pop("chat_history", None)
-    return JSONResponse({"message": "已清除對話記憶（短期記憶）"})
+    user_id = ensure_user_id_in_session(req.session)
+    await clear_short_term(user_id)
+    return JSONResponse({"message": CLEAR_SESSION_MESSAGE})
 
 @app.post("/clear_memory")
 async def clear_memory(req: Request):
     req.session.pop("chat_history", None)
     user_id = req.session.get("user_id")
     if user_id:
-        async with MEMORY_LOCK:
-            def _delete():
-                conn = sqlite3.connect(DB_FILE)
-                c = conn.cursor()
-                c.execute("DELETE FROM user_memory WHERE user_id = ?", (user_id,))
-                conn.commit()
-                conn.close()
-            await _to_thread(_delete)
-            logger.info(f"已刪除使用者 {user_id} 的長期記憶")
-    return JSONResponse({"message": "已清除使用者的所有記憶（長期 + 短期 )"})
+        await clear_long_term(user_id)
+    return JSONResponse({"message": CLEAR_MEMORY_MESSAGE})
+
+@timed("post_turn")
+async def post_process_turn(user_id: str, user_message: str, bot_reply: str, fast: bool = False):
+    """回覆送出後的背景工作，回傳 (親密度, 變化量)。
+
+    記憶與親密度是兩條獨立的分支，以依賴圖同時執行，各自逾時後改用規則判斷：
+    - combined：judge → (facts ‖ intimacy)，裁判逾時則兩條分支都用規則結果
+    - separate：(memory ‖ intimacy)，各自一次 LLM 呼叫
+    """
+    current_user.set(user_id)
+    if fast:
+        # 低資訊訊息沒有記憶可抽，親密度直接用規則判斷，不呼叫裁判 LLM
+        return await apply_intimacy_change(user_id, analyze(user_message).intimacy_change, bot_reply)
+
+    def heuristic_intimacy(_: Dict[str, Any]):
+        return apply_intimacy_change(user_id, keyword_intimacy_fallback(user_message), bot_reply)
+
+    if JUDGE_MODE == "combined":
+        async def judge(_: Dict[str, Any]) -> JudgeResult:
+            current_intimacy = (await get_user_data(user_id))["intimacy"]
+            return await judge_turn(user_message, bot_reply, current_intimacy)
+
+        def heuristic_judge(_: Dict[str, Any]) -> JudgeResult:
+            heuristic = analyze(user_message)
+            return JudgeResult(facts=list(heuristic.facts), intimacy_change=heuristic.intimacy_change)
+
+        results = await run_graph([
+            Node("judge", judge, timeout=POST_REPLY_TIMEOUTS.get("judge"), fallback=heuristic_judge),
+            Node("facts", lambda r: store_facts(user_id, r["judge"].facts), deps=("judge",)),
+            Node("intimacy", lambda r: apply_intimacy_change(
+                user_id, r["judge"].intimacy_change, bot_reply, r["judge"].emotion), deps=("judge",),
+                fallback=heuristic_intimacy),
+        ])
+        return results["intimacy"]
+
+    results = await run_graph([
+        Node("memory", lambda _: update_memory(user_id, user_message), timeout=POST_REPLY_TIMEOUTS.get("memory"),
+             fallback=lambda _: store_facts(user_id, extract_facts(user_message))),
+        Node("intimacy", lambda _: update_intimacy(user_id, user_message, bot_reply),
+             timeout=POST_REPLY_TIMEOUTS.get("intimacy"), fallback=heuristic_intimacy),
+    ])
+    return results["intimacy"]
+
+@timed("memory_write")
+async def store_facts(user_id: str, facts: List[str]) -> None:
+    for fact in facts:
+        if len(fact.strip()) >= 4:
+            await append_memory(user_id, fact)
 
+@timed("memory")
 async def update_memory(user_id: str, user_message: str):
     facts = await extract_facts_from_llm(user_message)
     if not facts:
         facts = extract_facts(user_message)
-    for fact in facts:
-        if len(fact.strip()) >= 4:
-            await append_memory(user_id, fact)
+    await store_facts(user_id, facts)
 
+@timed("intimacy_write")
+async def apply_intimacy_change(user_id: str, change_by_llm: int, bot_reply: str, emotion: Optional[str] = None):
+    # 回覆中的情緒標籤優先，沒有才用裁判判斷的情緒
+    emo = extract_emotion_tag(bot_reply) or emotion
+    change_by_emotion = emotion_weight(emo)
+
+    total_change = max(-2, min(2, change_by_llm + change_by_emotion))
+    intimacy = await adjust_intimacy(user_id, total_change)
+    return intimacy, total_change
+
+@timed("intimacy")
 async def update_intimacy(user_id: str, user_message: str, bot_reply: str) -> int:
     user_data = await get_user_data(user_id)
     current_intimacy = user_data["intimacy"]
@@ -383,14 +996,10 @@ async def update_intimacy(user_id: str, user_message: str, bot_reply: str) -> in
     if change_by_llm == 0:
         change_by_llm = keyword_intimacy_fallback(user_message)
 
-    emo = extract_emotion_tag(bot_reply)
-    change_by_emotion = emotion_weight(emo)
-
-    total_change = max(-2, min(2, change_by_llm + change_by_emotion))
-    intimacy = await adjust_intimacy(user_id, total_change)
-    return intimacy, total_change
+    return await apply_intimacy_change(user_id, change_by_llm, bot_reply)
 
 
+@timed("tts")
 async def generate_tts(bot_reply: str) -> str | None:
     try:
         return await synthesize_with_translation(bot_reply)
@@ -1,12 +1,82 @@
 import os
 
+HOST = os.environ.get("HOST", "127.0.0.1")
+PORT = int(os.environ.get("PORT", 5000))
+# worker 行程數；run.py --prod 會設定 WORKERS，直接用 uvicorn --workers 時請設定 WEB_CONCURRENCY
+WORKERS = int(os.environ.get("WORKERS") or os.environ.get("WEB_CONCURRENCY") or 1)
 DB_FILE = "memory.db"
+DB_SHARED = WORKERS > 1           # 多個行程共用資料庫：使用者資料每次讀取都向資料庫確認
 AUDIO_DIR = "static/audio"
-MAX_MEMORY = 8
-MAX_FACTS_PER_USER = 20
+MAX_MEMORY = 24                   # 伺服器端保留的最近對話輪數；實際放進 prompt 的輪數由 CONTEXT_TOKEN_BUDGET 決定
+HISTORY_SUMMARY = False           # 超出 MAX_MEMORY 的舊對話是否濃縮成摘要放進 prompt
+CONTEXT_TOKEN_BUDGET = 2560       # 每輪 prompt 的估計 token 上限（不含回覆），需小於 OLLAMA_NUM_CTX
+CONTEXT_BUDGET_SPLIT = {"persona": 0.25, "memory": 0.15}  # 角色設定與記憶的上限比例，其餘都給歷史對話
+CONTEXT_SUMMARIZE_DROPPED = True  # 預算內放不下的舊對話壓成一行摘要（不呼叫 LLM）
+CONTEXT_SUMMARY_TOKENS = 96       # 上述摘要的 token 上限
+MAX_FACTS_PER_USER = 2000
+MEMORY_TOP_K = 8                  # 每輪放進 system prompt 的相關記憶筆數
+EMBEDDER = "ollama"               # ollama：Ollama embedding 模型；hashing：本地字元雜湊（不需模型）
+EMBED_MODEL = "nomic-embed-text"
 DEFAULT_INTIMACY = 50
 MAX_INTIMACY = 100
 MIN_INTIMACY = 0
 ALPHA = 0.3
 TRANSLATE = True
-os.makedirs(AUDIO_DIR, exist_ok=True)
\ No newline at end of file
+VOICEVOX_URL = "http://localhost:50021"
+VOICEVOX_URLS = [VOICEVOX_URL]    # 多個 VOICEVOX 容器時全部列出，會分派給最閒的一台
+VOICEVOX_TIMEOUT = 30             # 單次請求讀取逾時（秒）
+VOICEVOX_CONNECT_TIMEOUT = 3      # 連線逾時（秒）
+VOICEVOX_RETRIES = 2              # 失敗重試次數
+VOICEVOX_ENGINE_CONCURRENCY = 2   # 每台引擎同時處理的合成數
+TTS_SPEAKER_ID = 58               # 猫使ビィ・人見知り
+TTS_PARALLEL = 2                  # 分句合成時同時送往 VOICEVOX 的請求數
+AUDIO_CACHE_MAX_BYTES = 200 * 1024 * 1024  # 語音快取總容量上限
+AUDIO_CACHE_MAX_FILES = 2000      # 語音快取檔案數上限
+AUDIO_CACHE_SHARED = WORKERS > 1  # 多個 worker 共用 static/audio：淘汰時以檔案鎖協調並重新掃描目錄
+AUDIO_CACHE_GRACE = 300           # disk 模式下這段時間內寫入或讀取過的音檔不淘汰（秒），留給用戶端播放
+TRANSLATION_CACHE_SIZE = 4096     # 翻譯結果快取筆數
+TRANSLATE_MODEL = "gemma3:1b"     # 翻譯專用的小模型；設成 LLM_MODEL 則與聊天共用同一個已載入的模型
+TRANSLATE_KEEP_ALIVE = "30m"
+TRANSLATE_NUM_CTX = 2048          # 翻譯 prompt 很短；若 TRANSLATE_MODEL 與 LLM_MODEL 相同，需與 OLLAMA_NUM_CTX 一致
+TRANSLATE_BATCH_WINDOW = 0.03     # 這段時間內的翻譯請求合併成一次 LLM 呼叫（秒）
+TRANSLATE_MAX_BATCH = 8           # 每次合併的句數上限
+TRANSLATE_PASSTHROUGH_RATIO = 0.3 # 假名比例達到此值視為已是日文，不翻譯；0 表示關閉
+# memory：音檔只放記憶體，由 /audio/<id> 提供；disk：寫入 static/audio
+# 多個 worker 時 /audio/<id> 可能被分到別的行程，預設改用 disk
+AUDIO_BACKEND = os.environ.get("AUDIO_BACKEND", "disk" if WORKERS > 1 else "memory")
+AUDIO_MEMORY_MAX_BYTES = 64 * 1024 * 1024  # memory 模式的容量上限
+AUDIO_MEMORY_TTL = 600            # memory 模式下音檔未被讀取多久後移除（秒）
+AUDIO_FORMAT = "wav"              # wav 或 ogg（Opus，需要 ffmpeg，遠端使用者可大幅減少傳輸量）
+POSTPROCESS_WORKERS = 4           # 背景記憶/親密度 worker 數
+POSTPROCESS_QUEUE_SIZE = 100      # 每個 worker 佇列上限
+POSTPROCESS_DROP_POLICY = "drop_oldest"  # drop_oldest / drop_newest / block
+POSTPROCESS_PUSH_TIMEOUT = 30     # /chat_stream 與 /ws 等待親密度結果的秒數
+POSTPROCESS_CHAT_TIMEOUT = 3      # /chat 回應前等待親密度結果的秒數，逾時回傳目前親密度並標示 intimacy_pending
+POSTPROCESS_DRAIN_TIMEOUT = 20    # 關機時等待已排入的背景工作做完的秒數，逾時才取消
+WS_SEND_QUEUE_SIZE = 256          # 每條 WebSocket 連線待送出的訊息上限
+WS_SEND_TIMEOUT = 10              # 送出佇列滿時最多等待的秒數，超過視為用戶端太慢並斷線
+WS_HEARTBEAT_INTERVAL = 20        # 伺服器送出 ping 的間隔（秒）
+WS_HEARTBEAT_TIMEOUT = 60         # 超過此秒數沒收到用戶端任何訊息就斷線
+DB_CACHE_SIZE = 1024              # 使用者資料 LRU 快取筆數
+DB_FLUSH_INTERVAL = 0.05          # write-behind 合併寫入的延遲秒數
+LLM_BACKEND = os.environ.get("LLM_BACKEND", "ollama")  # ollama；fake：固定延遲的假模型，壓測與 CI 不需要 GPU
+LLM_MODEL = "gemma3"
+FAKE_LLM_LATENCY = 0.2            # fake 模式的首字延遲（秒）
+FAKE_LLM_TOKENS_PER_SEC = 50      # fake 模式的輸出速度
+FAKE_LLM_PARALLEL = 1             # fake 模式同時處理的請求數（對應 OLLAMA_NUM_PARALLEL）
+OLLAMA_KEEP_ALIVE = "30m"         # 讓模型常駐，避免冷啟動重新載入
+OLLAMA_NUM_CTX = 8192             # 所有呼叫使用相同 num_ctx，參數不同會讓 Ollama 重新載入模型
+PROMPT_METRICS = False            # 記錄每輪 prompt-eval token 數與首字延遲
+LLM_PARALLEL = 1                  # 同時送往 Ollama 的請求數，與 OLLAMA_NUM_PARALLEL 一致，其餘排隊
+LLM_QUEUE_DEADLINES = {"interactive": None, "translate": 30, "background": 15}  # 各類別最長排隊秒數，超過就放棄或降級
+LLM_QUEUE_LIMITS = {"interactive": None, "translate": None, "background": 8}    # 背景佇列上限，滿了直接改用規則判斷
+SERVER_TIMING = False             # 回應附上 Server-Timing 標頭（各階段耗時），/metrics 不受影響
+TEXT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils", "text_rules.json")  # LLM 裁判失敗或被降級時的規則表
+FAST_PATH = True                  # 「嗯」「好」「謝謝」等低資訊訊息（text_rules.json 的 low_info）改用回覆池與規則判斷
+FAST_PATH_POOL_SIZE = 3           # 每組 (訊息類別, 親密度階段, 上一句情緒) 累積幾種回覆輪流使用
+FAST_PATH_MAX_KEYS = 256          # 回覆池保留的組數（LRU）
+JUDGE_MODE = "combined"           # combined：一次 LLM 呼叫取得記憶與親密度；separate：分開兩次
+POST_REPLY_TIMEOUTS = {"tts": 60, "judge": 30, "memory": 30, "intimacy": 30}  # 回覆後各分支的逾時秒數，逾時改走降級路徑（規則判斷／不附語音）
+WARMUP = True                     # 啟動後在背景預熱模型與 VOICEVOX，完成前 /readyz 回 503
+WARMUP_STEPS = ["chat", "translate", "embed", "tts", "caches", "fast_path"]  # 要執行的暖機步驟
+WARMUP_TIMEOUT = 120              # 暖機最長秒數，逾時也視為完成（未完成的步驟記為失敗）
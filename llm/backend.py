@@ -0,0 +1,152 @@
+import re
+import json
+import asyncio
+import hashlib
+import weakref
+from typing import Any, AsyncIterator, Callable, List, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+
+FAKE_REPLIES = [
+    "嗯嗯～我有在聽喔，主人再多說一點嘛！[emotion:joy]",
+    "欸嘿嘿，被你這樣說有點害羞呢……[emotion:shy]",
+    "好～今天也辛苦了，要記得休息喔。我會一直陪著你的！[emotion:cute]",
+    "哼，才、才不是在等你呢！不過你來了我還是很開心啦。[emotion:angry]",
+]
+FAKE_EMOTIONS = ["joy", "shy", "cute", "neutral"]
+BATCH_ITEM = re.compile(r"^<(\d+)>\s*(.*)$", re.M)
+QUOTED = re.compile(r"「(.*)」", re.S)
+
+# 所有假模型共用同一組排隊名額，模擬聊天、裁判、翻譯都打到同一台 Ollama
+_gates: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def _gate(parallel: int) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if loop not in _gates:
+        _gates[loop] = asyncio.Semaphore(parallel)
+    return _gates[loop]
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:4], "big")
+
+
+def default_fake_reply(messages: List[BaseMessage], json_mode: bool) -> str:
+    """依最後一則訊息決定固定的回覆，同樣的輸入永遠得到同樣的輸出。"""
+    prompt = str(messages[-1].content) if messages else ""
+    seed = _seed(prompt)
+    if json_mode:
+        return json.dumps({
+            "summary": "使用者分享了近況",
+            "facts": [f"使用者提過第{seed % 97}件事"] if seed % 3 == 0 else [],
+            "intimacy_change": seed % 3 - 1,
+            "emotion": FAKE_EMOTIONS[seed % len(FAKE_EMOTIONS)],
+        }, ensure_ascii=False)
+    items = BATCH_ITEM.findall(prompt)
+    if items:
+        return "\n".join(f"<{i}> {text}です" for i, text in items)
+    if "翻譯成日文" in prompt:
+        m = QUOTED.search(prompt)
+        return f"{m.group(1) if m else prompt}です"
+    return FAKE_REPLIES[seed % len(FAKE_REPLIES)]
+
+
+class FakeChatModel:
+    """不需要 GPU 的假模型，介面與 ChatOllama 相同（ainvoke / astream / invoke）。
+
+    latency 為首字延遲（prompt-eval），之後以 tokens_per_sec 的速度輸出；
+    parallel 模擬 Ollama 同時處理的請求數（所有假模型共用），超過就排隊。
+    """
+
+    def __init__(self, latency: float = 0.2, tokens_per_sec: float = 50.0, parallel: int = 1,
+                 json_mode: bool = False,
+                 reply_fn: Optional[Callable[[List[BaseMessage], bool], str]] = None):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.parallel = max(1, parallel)
+        self.json_mode = json_mode
+        self.reply_fn = reply_fn or default_fake_reply
+        self.model = "fake"
+        self.calls = 0
+
+    @staticmethod
+    def _tokens(text: str) -> List[str]:
+        # 約兩個字一個 token
+        return [text[i:i + 2] for i in range(0, len(text), 2)]
+
+    def _metadata(self, messages: List[BaseMessage], tokens: int) -> dict:
+        prompt_chars = sum(len(str(m.content)) for m in messages)
+        return {
+            "prompt_eval_count": prompt_chars // 2,
+            "prompt_eval_duration": int(self.latency * 1e9),
+            "load_duration": 0,
+            "eval_count": tokens,
+        }
+
+    async def astream(self, messages: List[BaseMessage], **kwargs) -> AsyncIterator[AIMessageChunk]:
+        text = self.reply_fn(messages, self.json_mode)
+        tokens = self._tokens(text)
+        async with _gate(self.parallel):
+            self.calls += 1
+            await asyncio.sleep(self.latency)
+            for token in tokens:
+                yield AIMessageChunk(content=token)
+                await asyncio.sleep(1 / self.tokens_per_sec)
+        yield AIMessageChunk(content="", response_metadata=self._metadata(messages, len(tokens)))
+
+    async def ainvoke(self, messages: List[BaseMessage], **kwargs) -> AIMessage:
+        parts: List[str] = []
+        metadata: dict = {}
+        async for chunk in self.astream(messages):
+            parts.append(chunk.content)
+            metadata = chunk.response_metadata or metadata
+        return AIMessage(content="".join(parts), response_metadata=metadata)
+
+    def invoke(self, messages: List[BaseMessage], **kwargs) -> AIMessage:
+        return asyncio.run(self.ainvoke(messages))
+
+
+def build_chat_model(backend: str, model: str, keep_alive: str, num_ctx: int, json_mode: bool = False,
+                     fake_latency: float = 0.2, fake_tokens_per_sec: float = 50.0, fake_parallel: int = 1):
+    """依 backend 建立聊天模型：ollama 為實際模型，fake 為壓測/CI 用的假模型。"""
+    if backend == "fake":
+        return FakeChatModel(fake_latency, fake_tokens_per_sec, fake_parallel, json_mode=json_mode)
+    from langchain_ollama import ChatOllama  # import 約需 0.6 秒，只在真的要用時載入
+    kwargs = {"format": "json"} if json_mode else {}
+    return ChatOllama(model=model, keep_alive=keep_alive, num_ctx=num_ctx, **kwargs)
+
+
+class LazyChatModel:
+    """第一次呼叫時才建立模型，讓 import app 不必載入 langchain_ollama。"""
+
+    def __init__(self, factory: Callable[[], Any], model: str = ""):
+        self._factory = factory
+        self._model = model
+        self._inner = None
+
+    def get(self):
+        """建立（或取得已建立的）模型；重複呼叫只會建立一次。"""
+        if self._inner is None:
+            self._inner = self._factory()
+        return self._inner
+
+    @property
+    def model(self) -> str:
+        return getattr(self._inner, "model", "") if self._inner is not None else self._model
+
+    async def ainvoke(self, messages, **kwargs):
+        return await self.get().ainvoke(messages, **kwargs)
+
+    async def astream(self, messages, **kwargs):
+        async for chunk in self.get().astream(messages, **kwargs):
+            yield chunk
+
+    def invoke(self, messages, **kwargs):
+        return self.get().invoke(messages, **kwargs)
+
+
+def lazy_chat_model(backend: str, model: str, *args, **kwargs) -> LazyChatModel:
+    """與 build_chat_model 參數相同，延後到第一次使用時才建立。"""
+    return LazyChatModel(lambda: build_chat_model(backend, model, *args, **kwargs),
+                         "fake" if backend == "fake" else model)
@@ -0,0 +1,120 @@
+import logging
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger("app")
+
+MESSAGE_OVERHEAD = 4      # 每則訊息的角色標記等額外 token
+SNIPPET_CHARS = 24        # 摘要中每輪使用者訊息保留的字數
+SUMMARY_PREFIX = "更早之前使用者提過："
+
+PROMPT_TOKENS = REGISTRY.histogram(
+    "chat_prompt_tokens_estimated", "每輪 prompt 的估計 token 數", (),
+    buckets=(256, 512, 1024, 2048, 3072, 4096, 6144, 8192, 16384),
+)
+TURNS_DROPPED = REGISTRY.counter("chat_history_turns_dropped_total", "因 token 預算不足未放進 prompt 的對話輪數")
+
+
+@lru_cache(maxsize=8192)
+def estimate_tokens(text: str) -> int:
+    """不載入 tokenizer 的 token 估算：中日文約一字一 token，其餘約 4 個字元一 token。
+
+    非 ASCII 字元數由 UTF-8 位元組數推算，整段在 C 層完成；依文字快取，
+    歷史訊息每輪重算時直接命中。
+    """
+    n = len(text)
+    wide = (len(text.encode("utf-8")) - n) // 2
+    return wide + (n - wide + 3) // 4
+
+
+def message_tokens(text: Optional[str]) -> int:
+    return estimate_tokens(text) + MESSAGE_OVERHEAD if text else 0
+
+
+def summarize_turns(turns: Sequence[Dict[str, str]], max_tokens: int) -> Optional[str]:
+    """不呼叫 LLM，把放不下的舊對話壓成一行：取每輪使用者訊息的開頭，越新的越優先。"""
+    pieces: List[str] = []
+    used = estimate_tokens(SUMMARY_PREFIX)
+    for turn in reversed(turns):
+        text = " ".join(turn["user"].split())
+        snippet = text[:SNIPPET_CHARS] + ("…" if len(text) > SNIPPET_CHARS else "")
+        cost = estimate_tokens(snippet) + 1
+        if used + cost > max_tokens:
+            break
+        pieces.append(snippet)
+        used += cost
+    if not pieces:
+        return None
+    return SUMMARY_PREFIX + "／".join(reversed(pieces))
+
+
+class ContextPlan(NamedTuple):
+    history: List[Dict[str, str]]   # 放進 prompt 的對話（依時間順序）
+    dropped: int                    # 放不下的舊對話輪數
+    summary: Optional[str]          # 放不下的對話壓成的一行摘要
+    tokens: int                     # 整個 prompt 的估計 token 數
+
+
+class ContextBudget:
+    """依 token 預算決定每輪 prompt 放多少歷史對話，取代固定輪數。
+
+    - split 為角色設定（persona）與記憶（memory）各自的上限比例，
+      剩下的預算（含前兩者沒用完的部分）都給歷史對話
+    - 歷史對話由新到舊逐輪放入，放不下就停止；被擠掉的舊對話可壓成一行摘要
+    """
+
+    def __init__(self, total: int, split: Dict[str, float], summarize_dropped: bool = True,
+                 summary_tokens: int = 96):
+        self.total = total
+        self.split = split
+        self.summarize_dropped = summarize_dropped
+        self.summary_tokens = summary_tokens
+        self._persona_warned = False
+
+    def limit(self, part: str) -> int:
+        return int(self.total * self.split.get(part, 0))
+
+    def fit_facts(self, facts: Sequence[str]) -> List[str]:
+        """記憶超過 memory 預算時，保留較新的幾筆（維持原本順序）。"""
+        budget = self.limit("memory")
+        used, start = 0, len(facts)
+        while start > 0:
+            cost = estimate_tokens(facts[start - 1]) + 2  # 「- 」與換行
+            if used + cost > budget:
+                break
+            used += cost
+            start -= 1
+        return list(facts[start:])
+
+    def pack(self, history: Sequence[Dict[str, str]], system_prompt: str,
+             fixed: Sequence[Optional[str]] = ()) -> ContextPlan:
+        """fixed 為一定要放的其他訊息（摘要、親密度與記憶、目前的使用者訊息）。"""
+        persona = message_tokens(system_prompt)
+        if persona > self.limit("persona") and not self._persona_warned:
+            self._persona_warned = True
+            logger.warning(f"角色設定約 {persona} tokens，超過 persona 預算 {self.limit('persona')}")
+        used = persona + sum(message_tokens(text) for text in fixed)
+        remaining = self.total - used
+
+        costs = [message_tokens(t["user"]) + message_tokens(t["bot"]) for t in history]
+        if sum(costs) > remaining and self.summarize_dropped:
+            remaining -= self.summary_tokens + MESSAGE_OVERHEAD  # 預留摘要的位置
+        kept = 0
+        for cost in reversed(costs):
+            if cost > remaining:
+                break
+            remaining -= cost
+            used += cost
+            kept += 1
+
+        dropped = len(history) - kept
+        summary = None
+        if dropped and self.summarize_dropped:
+            summary = summarize_turns(history[:dropped], self.summary_tokens)
+            used += message_tokens(summary)
+        if dropped:
+            TURNS_DROPPED.inc(dropped)
+        PROMPT_TOKENS.observe(used)
+        return ContextPlan(list(history[dropped:]), dropped, summary, used)
@@ -0,0 +1,13 @@
+# 伺服器與離線維護（manage.py reextract）共用的 prompt，兩邊抽出的記憶才一致
+
+def extract_facts_prompt(message: str) -> str:
+    return f"""
+你是一個會從使用者對話中提取記憶的助手。請從以下訊息中提取出「摘要」與「記憶事實」。
+只回傳 JSON 結構如下：
+{{
+  "summary": "...",
+  "facts": ["...", "..."]
+}}
+訊息內容：
+「{message}」
+"""
@@ -0,0 +1,162 @@
+import time
+import asyncio
+import logging
+import contextvars
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from config import LLM_PARALLEL, LLM_QUEUE_DEADLINES, LLM_QUEUE_LIMITS
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger("app")
+
+# 數字越小越優先：使用者正在等的回覆 > TTS 翻譯 > 背景記憶/親密度/摘要
+PRIORITIES = {"interactive": 0, "translate": 1, "background": 2}
+
+# 目前這次呼叫屬於哪位使用者，用於同一優先級內的輪流排隊
+current_user: contextvars.ContextVar[str] = contextvars.ContextVar("llm_current_user", default="")
+
+QUEUE_WAIT = REGISTRY.histogram("llm_queue_wait_seconds", "LLM 請求排隊時間（秒）", ("priority",))
+QUEUE_DEPTH = REGISTRY.gauge("llm_queue_depth", "LLM 排隊中的請求數", ("priority",))
+SHED = REGISTRY.counter("llm_shed_total", "因佇列過長或逾時而放棄的 LLM 請求數", ("priority",))
+
+
+class SchedulerBusy(RuntimeError):
+    """排隊超過期限或佇列已滿；呼叫端應改用規則判斷等降級方式。"""
+
+
+class _Waiter:
+    __slots__ = ("future", "priority")
+
+    def __init__(self, future: asyncio.Future, priority: str):
+        self.future = future
+        self.priority = priority
+
+
+class LLMScheduler:
+    """所有 LLM 呼叫共用的排程器。
+
+    - 同時執行數上限為 parallel（對應 Ollama 的 OLLAMA_NUM_PARALLEL），其餘排隊
+    - 有空位時先服務優先級高的類別；同一類別內各使用者輪流，避免單一使用者塞滿佇列
+    - deadlines[類別] 為最長排隊秒數，max_queue[類別] 為佇列上限，超過就丟出 SchedulerBusy
+    """
+
+    def __init__(self, parallel: int = 1, deadlines: Optional[Dict[str, Optional[float]]] = None,
+                 max_queue: Optional[Dict[str, Optional[int]]] = None):
+        self.parallel = max(1, parallel)
+        self.deadlines = deadlines or {}
+        self.max_queue = max_queue or {}
+        self._running = 0
+        self._queues: Dict[str, "OrderedDict[str, Deque[_Waiter]]"] = {p: OrderedDict() for p in PRIORITIES}
+        REGISTRY.add_collector(self._collect)
+
+    def depth(self, priority: Optional[str] = None) -> int:
+        names = [priority] if priority else list(PRIORITIES)
+        return sum(len(q) for name in names for q in self._queues[name].values())
+
+    def _collect(self) -> None:
+        for name in PRIORITIES:
+            QUEUE_DEPTH.set(self.depth(name), priority=name)
+
+    @asynccontextmanager
+    async def slot(self, priority: str, user_id: str = "") -> AsyncIterator[None]:
+        await self._acquire(priority, user_id)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, priority: str, user_id: str) -> None:
+        if priority not in PRIORITIES:
+            raise ValueError(f"未知的優先級：{priority}")
+        started = time.perf_counter()
+        if self._running < self.parallel and not self.depth():
+            self._running += 1
+            QUEUE_WAIT.observe(0.0, priority=priority)
+            return
+
+        limit = self.max_queue.get(priority)
+        if limit is not None and self.depth(priority) >= limit:
+            SHED.inc(priority=priority)
+            raise SchedulerBusy(f"LLM 佇列已滿（{priority}）")
+
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), priority)
+        self._queues[priority].setdefault(user_id, deque()).append(waiter)
+        deadline = self.deadlines.get(priority)
+        try:
+            await asyncio.wait_for(waiter.future, deadline)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 剛好在逾時/取消的同時拿到名額，要把名額讓給下一位
+                self._release()
+            else:
+                self._discard(waiter, user_id)
+            if isinstance(e, asyncio.TimeoutError):
+                SHED.inc(priority=priority)
+                raise SchedulerBusy(f"LLM 排隊超過 {deadline}s（{priority}）") from None
+            raise
+        finally:
+            QUEUE_WAIT.observe(time.perf_counter() - started, priority=priority)
+
+    def _discard(self, waiter: _Waiter, user_id: str) -> None:
+        queue = self._queues[waiter.priority]
+        pending = queue.get(user_id)
+        if pending is None:
+            return
+        try:
+            pending.remove(waiter)
+        except ValueError:
+            pass
+        if not pending:
+            del queue[user_id]
+
+    def _release(self) -> None:
+        self._running -= 1
+        while self._running < self.parallel:
+            waiter = self._next()
+            if waiter is None:
+                return
+            if waiter.future.done():
+                continue
+            self._running += 1
+            waiter.future.set_result(None)
+
+    def _next(self) -> Optional[_Waiter]:
+        for name in PRIORITIES:
+            queue = self._queues[name]
+            if not queue:
+                continue
+            user_id, pending = next(iter(queue.items()))
+            waiter = pending.popleft()
+            if pending:
+                queue.move_to_end(user_id)  # 這位使用者排到同優先級的最後面
+            else:
+                del queue[user_id]
+            return waiter
+        return None
+
+
+class ScheduledModel:
+    """包住 ChatOllama / FakeChatModel，每次 ainvoke / astream 都先向排程器取得名額。"""
+
+    def __init__(self, model, scheduler: LLMScheduler, priority: str):
+        self.inner = model
+        self.scheduler = scheduler
+        self.priority = priority
+
+    @property
+    def model(self) -> str:
+        return getattr(self.inner, "model", "")
+
+    async def ainvoke(self, messages, **kwargs):
+        async with self.scheduler.slot(self.priority, current_user.get()):
+            return await self.inner.ainvoke(messages, **kwargs)
+
+    async def astream(self, messages, **kwargs):
+        async with self.scheduler.slot(self.priority, current_user.get()):
+            async for chunk in self.inner.astream(messages, **kwargs):
+                yield chunk
+
+
+scheduler = LLMScheduler(LLM_PARALLEL, LLM_QUEUE_DEADLINES, LLM_QUEUE_LIMITS)
@@ -0,0 +1,109 @@
+import os, sys, json, asyncio, logging, argparse
+sys.path.append(os.path.dirname(__file__))
+
+from config import DB_FILE, LLM_BACKEND, EMBEDDER, EMBED_MODEL, MAX_FACTS_PER_USER
+from config import LLM_MODEL, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX
+from config import FAKE_LLM_LATENCY, FAKE_LLM_TOKENS_PER_SEC, FAKE_LLM_PARALLEL
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("app")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="記憶資料庫的離線維護（建議在伺服器停止時執行）")
+    parser.add_argument("--db", default=DB_FILE, help="資料庫檔案")
+    parser.add_argument("--chunk-size", type=int, default=200, help="每批處理的使用者數（import 時為行數）")
+    parser.add_argument("--concurrency", type=int, default=4, help="每批內同時處理的使用者數（同時送往 LLM 的請求數）")
+    parser.add_argument("--checkpoint-dir", default=None, help="檢查點存放目錄，預設與資料庫相同")
+    parser.add_argument("--resume", action="store_true", help="從上次中斷的檢查點接續")
+    parser.add_argument("--dry-run", action="store_true", help="只統計，不寫入資料庫")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("stats", help="使用者、記憶、對話筆數與檔案大小")
+
+    dedup = commands.add_parser("dedup", help="刪除近似重複的記憶，裁掉超過上限的舊記憶")
+    dedup.add_argument("--similarity", type=float, default=0.0,
+                       help="另以向量餘弦相似度判斷重複的門檻（例如 0.97）；0 表示只用文字規則")
+    dedup.add_argument("--min-ratio", type=float, default=0.8,
+                       help="開頭相同時，較短的記憶至少要是較長者的多少比例才視為重複")
+    dedup.add_argument("--exact", action="store_true", help="只刪除正規化後完全相同的記憶（等同 --min-ratio 1.0）")
+
+    reextract = commands.add_parser("reextract", help="以目前的抽取 prompt 從保留的對話紀錄重新抽取記憶")
+    reextract.add_argument("--replace", action="store_true",
+                           help="先刪除既有記憶（只剩從保留中的對話抽得出的記憶）")
+
+    reembed = commands.add_parser("reembed", help="重新計算記憶向量（更換 embedding 模型後）")
+    reembed.add_argument("--missing-only", action="store_true", help="只補上沒有向量的記憶")
+
+    export = commands.add_parser("export", help="匯出成 JSONL，每位使用者一行")
+    export.add_argument("path")
+    export.add_argument("--with-history", action="store_true", help="一併匯出對話紀錄與摘要")
+
+    import_ = commands.add_parser("import", help="匯入 export 產生的 JSONL")
+    import_.add_argument("path")
+    import_.add_argument("--replace", action="store_true", help="先刪除該使用者既有的記憶與對話紀錄")
+
+    commands.add_parser("vacuum", help="合併 WAL 並重建資料庫檔案以回收空間")
+    return parser
+
+
+def build_extract():
+    """重新抽取使用與伺服器相同的 prompt 與模型設定；直接呼叫 JSON 模型，不載入伺服器也不經過排程器。"""
+    from langchain_core.messages import HumanMessage
+    from llm.backend import lazy_chat_model
+    from llm.prompts import extract_facts_prompt
+    from utils.json_parse import parse_json_object
+    from utils.regex import extract_facts
+
+    model = lazy_chat_model(LLM_BACKEND, LLM_MODEL, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX, json_mode=True,
+                            fake_latency=FAKE_LLM_LATENCY, fake_tokens_per_sec=FAKE_LLM_TOKENS_PER_SEC,
+                            fake_parallel=FAKE_LLM_PARALLEL)
+
+    async def extract(message: str):
+        data = None
+        try:
+            result = await model.ainvoke([HumanMessage(content=extract_facts_prompt(message))])
+            data = parse_json_object(result.content)
+        except Exception as e:
+            logger.error(f"重新抽取記憶失敗，改用規則抽取：{e}")
+        return (data or {}).get("facts") or extract_facts(message)
+    return extract
+
+
+async def main(args) -> dict:
+    from memory.maintenance import Maintenance
+    from memory.retrieval import build_embedder
+
+    embedder = None
+    if args.command in ("reextract", "reembed"):
+        embedder = build_embedder("hashing" if LLM_BACKEND == "fake" else EMBEDDER, EMBED_MODEL)
+    maintenance = Maintenance(args.db, args.chunk_size, args.concurrency, args.checkpoint_dir,
+                              args.resume, args.dry_run, embedder, MAX_FACTS_PER_USER)
+    try:
+        if args.command == "stats":
+            return await maintenance.stats()
+        if args.command == "dedup":
+            return await maintenance.dedup(args.similarity, 1.0 if args.exact else args.min_ratio)
+        if args.command == "reextract":
+            return await maintenance.reextract(build_extract(), args.replace)
+        if args.command == "reembed":
+            return await maintenance.reembed(args.missing_only)
+        if args.command == "export":
+            return await maintenance.export(args.path, args.with_history)
+        if args.command == "import":
+            return await maintenance.import_(args.path, args.replace)
+        if args.command == "vacuum":
+            return await maintenance.vacuum()
+    finally:
+        await maintenance.close()
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    if args.command != "import" and not os.path.exists(args.db):
+        sys.exit(f"找不到資料庫 {args.db}")
+    try:
+        result = asyncio.run(main(args))
+    except KeyboardInterrupt:
+        sys.exit("已中斷；加上 --resume 重新執行即可從上一個檢查點接續")
+    print(json.dumps(result, ensure_ascii=False))
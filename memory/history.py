@@ -0,0 +1,129 @@
+import time
+import logging
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from utils.metrics import run_in_thread
+
+logger = logging.getLogger("app")
+
+
+class ConversationStore:
+    """伺服器端的短期對話紀錄，取代存在 session cookie 裡的 chat_history。
+
+    每位使用者只保留最近 window 輪；超出的舊對話會被刪除並回傳給呼叫端，
+    可以選擇把它們濃縮進 rolling summary，讓 prompt 大小維持固定。
+    """
+
+    def __init__(self, db_file: str, window: int = 8):
+        self.db_file = db_file
+        self.window = window
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    def open(self) -> None:
+        """連線並建立資料表；可重複呼叫。沒有事先呼叫時第一次查詢會自動開啟。"""
+        with self._lock:
+            if self._connection is not None:
+                return
+            self._connection = sqlite3.connect(self.db_file, check_same_thread=False)
+            c = self._conn.cursor()
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS chat_turns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                user_message TEXT NOT NULL,
+                bot_reply TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """)
+            c.execute("CREATE INDEX IF NOT EXISTS idx_chat_turns_user ON chat_turns (user_id, id)")
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS chat_summary (
+                user_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL
+            )
+            """)
+            self._conn.commit()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.open()
+        return self._connection
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    async def recent(self, user_id: str) -> List[Dict[str, str]]:
+        """依時間順序回傳最近 window 輪 {"user", "bot"}。"""
+        def _read():
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT user_message, bot_reply FROM chat_turns WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+                    (user_id, self.window),
+                ).fetchall()
+            return [{"user": u, "bot": b} for u, b in reversed(rows)]
+        try:
+            return await run_in_thread("sqlite_history_read", _read)
+        except Exception as e:
+            logger.error(f"讀取對話紀錄失敗：{e}")
+            return []
+
+    async def append(self, user_id: str, user_message: str, bot_reply: str) -> List[Dict[str, str]]:
+        """新增一輪對話，回傳因超出 window 而被移除的舊對話。"""
+        def _write():
+            with self._lock:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT INTO chat_turns (user_id, user_message, bot_reply, created_at) VALUES (?, ?, ?, ?)",
+                        (user_id, user_message, bot_reply, time.time()),
+                    )
+                    overflow = self._conn.execute(
+                        "SELECT id, user_message, bot_reply FROM chat_turns WHERE user_id = ? ORDER BY id DESC LIMIT -1 OFFSET ?",
+                        (user_id, self.window),
+                    ).fetchall()
+                    if overflow:
+                        self._conn.execute(
+                            "DELETE FROM chat_turns WHERE user_id = ? AND id <= ?", (user_id, overflow[0][0])
+                        )
+            return [{"user": u, "bot": b} for _, u, b in reversed(overflow)]
+        try:
+            return await run_in_thread("sqlite_history_write", _write)
+        except Exception as e:
+            logger.error(f"寫入對話紀錄失敗：{e}")
+            return []
+
+    async def get_summary(self, user_id: str) -> Optional[str]:
+        def _read():
+            with self._lock:
+                row = self._conn.execute("SELECT summary FROM chat_summary WHERE user_id = ?", (user_id,)).fetchone()
+            return row[0] if row else None
+        try:
+            return await run_in_thread("sqlite_summary_read", _read)
+        except Exception as e:
+            logger.error(f"讀取對話摘要失敗：{e}")
+            return None
+
+    async def set_summary(self, user_id: str, summary: str) -> None:
+        def _write():
+            with self._lock:
+                with self._conn:
+                    self._conn.execute("""
+                        INSERT INTO chat_summary (user_id, summary) VALUES (?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET summary=excluded.summary
+                    """, (user_id, summary))
+        await run_in_thread("sqlite_summary_write", _write)
+
+    async def clear(self, user_id: str) -> None:
+        def _delete():
+            with self._lock:
+                with self._conn:
+                    self._conn.execute("DELETE FROM chat_turns WHERE user_id = ?", (user_id,))
+                    self._conn.execute("DELETE FROM chat_summary WHERE user_id = ?", (user_id,))
+        await run_in_thread("sqlite_history_clear", _delete)
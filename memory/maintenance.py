@@ -0,0 +1,485 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+import numpy as np
+
+from config import DEFAULT_INTIMACY, MAX_FACTS_PER_USER
+from memory.store import UserStore, TRIM_FACTS_SQL, fact_hash, normalize_fact
+from memory.history import ConversationStore
+from memory.retrieval import Embedder, MemoryRetriever, _normalize
+from utils.metrics import run_in_thread
+
+logger = logging.getLogger("app")
+
+Extract = Callable[[str], Awaitable[List[str]]]
+
+# 列出使用者的來源資料表；各自依 user_id 走索引分頁後合併
+USER_TABLES = ("user_memory", "user_facts", "chat_turns")
+
+
+# ------------------ 檢查點與進度 ------------------
+
+class Checkpoint:
+    """批次工作的檢查點（JSON 檔）。每處理完一批寫一次，先寫暫存檔再 os.replace，中斷也不會留下半個檔案。"""
+
+    def __init__(self, path: str, job: str, params: Dict[str, Any]):
+        self.path = path
+        self.job = job
+        self.params = params
+        self.state: Dict[str, Any] = {}
+
+    def load(self) -> bool:
+        """讀取既有檢查點；工作或參數不同時拒絕接續，避免混到別次執行的進度。"""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        if data.get("job") != self.job or data.get("params") != self.params:
+            raise ValueError(f"檢查點 {self.path} 屬於其他工作或參數不同，請刪除後重新執行")
+        self.state = data.get("state", {})
+        return True
+
+    def save(self, **state) -> None:
+        self.state.update(state)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"job": self.job, "params": self.params, "state": self.state, "saved_at": time.time()},
+                      f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def clear(self) -> None:
+        for path in (self.path, self.path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class Progress:
+    """每隔 interval 秒記錄一次進度、速度與預估剩餘時間。"""
+
+    def __init__(self, label: str, total: int, done: int = 0, interval: float = 5.0):
+        self.label = label
+        self.total = total
+        self.done = done
+        self.interval = interval
+        self._start_done = done
+        self._started = self._last = time.perf_counter()
+
+    def update(self, n: int) -> None:
+        self.done += n
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            self._log(now)
+
+    def _log(self, now: float) -> None:
+        rate = (self.done - self._start_done) / max(now - self._started, 1e-9)
+        remaining = max(self.total - self.done, 0)
+        eta = f"，預估剩餘 {remaining / rate:.0f}s" if rate > 0 and remaining else ""
+        pct = self.done / self.total * 100 if self.total else 100.0
+        logger.info(f"{self.label}：{self.done}/{self.total}（{pct:.1f}%），{rate:.1f} 筆/s{eta}")
+
+    def finish(self) -> None:
+        self._log(time.perf_counter())
+
+
+# ------------------ 去重 ------------------
+
+def _dedup_text(fact: str) -> str:
+    return "".join(normalize_fact(fact).split())
+
+
+def near_duplicates(rows: Sequence[Tuple[int, str, Optional[bytes]]], similarity: float = 0.0,
+                    min_ratio: float = 0.8) -> List[int]:
+    """回傳應刪除的記憶 id。rows 為 (id, 記憶, 向量 BLOB)。
+
+    - 文字規則：正規化後 A 是 B 的開頭，且 A 至少是 B 長度的 min_ratio，刪除較短的 A。
+      預設 0.8：「他喜歡貓」與「他喜歡貓咪」視為重複，「他喜歡貓」與「他喜歡貓頭鷹」則是不同的事；
+      min_ratio=1.0 只刪除正規化後完全相同的記憶。只看開頭不看包含，「喜歡貓」不會被當成「不喜歡貓」的重複
+    - similarity > 0 時另外以向量餘弦相似度判斷，達到門檻的兩筆保留較長（同長則較新）的一筆
+    """
+    texts = {row_id: _dedup_text(fact) for row_id, fact, _ in rows}
+    drop = set()
+    ordered = sorted(texts.items(), key=lambda item: item[1])
+    for (row_id, text), (_, following) in zip(ordered, ordered[1:]):
+        # 依字典順序排序後，以 text 開頭的字串緊接在它後面
+        if text and following.startswith(text) and len(text) >= len(following) * min_ratio:
+            drop.add(row_id)
+
+    if similarity > 0:
+        candidates = [(row_id, blob) for row_id, _, blob in rows if blob is not None and row_id not in drop]
+        if candidates:
+            dim = np.frombuffer(candidates[-1][1], dtype=np.float32).shape[0]
+            candidates = [(row_id, blob) for row_id, blob in candidates if len(blob) == dim * 4]
+            # 優先保留較長、較新的記憶
+            candidates.sort(key=lambda c: (len(texts[c[0]]), c[0]), reverse=True)
+            matrix = _normalize(np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob in candidates]))
+            scores = matrix @ matrix.T
+            kept: List[int] = []
+            for i, (row_id, _) in enumerate(candidates):
+                if kept and scores[i, kept].max() >= similarity:
+                    drop.add(row_id)
+                else:
+                    kept.append(i)
+    return sorted(drop)
+
+
+# ------------------ 批次維護 ------------------
+
+class Maintenance:
+    """離線維護整個記憶資料庫（去重、重新抽取、重新向量化、JSONL 匯出匯入、VACUUM）。
+
+    - 使用者依 user_id 排序、以 chunk_size 為一批分頁讀取，不會一次載入所有資料
+    - 每批內最多 concurrency 位使用者同時處理（重新抽取時即為同時送往 LLM 的請求數）
+    - 整批完成後寫入檢查點，中斷後以 resume=True 從下一批接續
+    - 建議在伺服器停止時執行；伺服器以多 worker 模式執行時，記憶的變動會在下次讀取時被偵測到
+    """
+
+    def __init__(self, db_file: str, chunk_size: int = 200, concurrency: int = 4,
+                 checkpoint_dir: Optional[str] = None, resume: bool = False, dry_run: bool = False,
+                 embedder: Optional[Embedder] = None, max_facts: int = MAX_FACTS_PER_USER):
+        self.db_file = db_file
+        self.chunk_size = max(1, chunk_size)
+        self.concurrency = max(1, concurrency)
+        self.checkpoint_dir = checkpoint_dir or os.path.dirname(os.path.abspath(db_file))
+        self.resume = resume
+        self.dry_run = dry_run
+        self.max_facts = max_facts
+        # 重新抽取的記憶經由與伺服器相同的寫入路徑（去重、向量化、上限裁切）
+        self.store = UserStore(db_file, cache_size=self.chunk_size * 2, max_facts=max_facts, shared=True)
+        self.history = ConversationStore(db_file)
+        self.embedder = embedder
+        self.retriever = MemoryRetriever(self.store, embedder, cache_size=0) if embedder is not None else None
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    # ------------------ 連線 ------------------
+
+    def open(self) -> None:
+        """建立（或升級）資料表後另開一條連線給批次查詢使用。"""
+        with self._lock:
+            if self._connection is None:
+                self.store.open()
+                self.history.open()
+                self._connection = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.open()
+        return self._connection
+
+    async def close(self) -> None:
+        await self.store.flush()
+        self.store.close()
+        self.history.close()
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _query(self, sql: str, params: Sequence = ()) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _write(self, sql: str, rows: Sequence[Sequence]) -> None:
+        if self.dry_run or not rows:
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(sql, rows)
+
+    # ------------------ 逐批走訪使用者 ------------------
+
+    def _next_users(self, after: str, limit: int, tables: Sequence[str]) -> List[str]:
+        """user_id 大於 after 的前 limit 位使用者（多個資料表的聯集）。"""
+        users = set()
+        for table in tables:
+            users.update(row[0] for row in self._query(
+                f"SELECT DISTINCT user_id FROM {table} WHERE user_id > ? ORDER BY user_id LIMIT ?", (after, limit)
+            ))
+        return sorted(users)[:limit]
+
+    def _count_users(self, tables: Sequence[str]) -> int:
+        union = " UNION ".join(f"SELECT user_id FROM {table}" for table in tables)
+        return self._query(f"SELECT count(DISTINCT user_id) FROM ({union})")[0][0]
+
+    def _checkpoint(self, job: str, params: Dict[str, Any]) -> Checkpoint:
+        name = os.path.basename(self.db_file)
+        checkpoint = Checkpoint(os.path.join(self.checkpoint_dir, f"{name}.{job}.checkpoint.json"), job, params)
+        if not self.resume:
+            checkpoint.clear()
+        elif checkpoint.load():
+            logger.info(f"從檢查點接續 {job}：已處理 {checkpoint.state.get('processed', 0)} 位使用者")
+        return checkpoint
+
+    async def for_each_user(self, job: str, handle: Callable[[str], Awaitable[Dict[str, int]]],
+                            params: Dict[str, Any], tables: Sequence[str] = USER_TABLES,
+                            on_chunk: Optional[Callable[[], Dict[str, Any]]] = None) -> Dict[str, int]:
+        """對每位使用者執行 handle，回傳各項計數的總和。on_chunk 回傳的內容會一併寫入檢查點。"""
+        checkpoint = self._checkpoint(job, params)
+        totals = Counter(checkpoint.state.get("totals", {}))
+        if checkpoint.state.get("finished"):
+            logger.info(f"{job} 已在先前完成；要重新執行請不要加 --resume")
+            return dict(totals)
+        after = checkpoint.state.get("after", "")
+        total = await run_in_thread("maintenance_count", self._count_users, tables)
+        progress = Progress(job, total, checkpoint.state.get("processed", 0))
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(user_id: str) -> Dict[str, int]:
+            async with semaphore:
+                try:
+                    return await handle(user_id)
+                except Exception as e:
+                    logger.error(f"{job} 處理使用者 {user_id} 失敗：{e}")
+                    return {"failed": 1}
+
+        while True:
+            users = await run_in_thread("maintenance_users", self._next_users, after, self.chunk_size, tables)
+            if not users:
+                break
+            for result in await asyncio.gather(*(run(u) for u in users)):
+                totals.update(result)
+            await self.store.flush()
+            after = users[-1]
+            progress.update(len(users))
+            extra = on_chunk() if on_chunk else {}
+            checkpoint.save(after=after, processed=progress.done, totals=dict(totals), **extra)
+        checkpoint.save(finished=True)
+        progress.finish()
+        return dict(totals)
+
+    # ------------------ 各項工作 ------------------
+
+    def _fact_rows(self, user_id: str) -> List[Tuple[int, str, Optional[bytes]]]:
+        return self._query("SELECT id, fact, embedding FROM user_facts WHERE user_id = ? ORDER BY id", (user_id,))
+
+    async def dedup(self, similarity: float = 0.0, min_ratio: float = 0.8) -> Dict[str, int]:
+        """刪除近似重複的記憶，並把超過上限的舊記憶裁掉。"""
+        async def handle(user_id: str) -> Dict[str, int]:
+            rows = await run_in_thread("maintenance_read", self._fact_rows, user_id)
+            drop = near_duplicates(rows, similarity, min_ratio)
+            dropped = set(drop)
+            remaining = [row for row in rows if row[0] not in dropped]
+            trimmed = [row[0] for row in remaining[:max(0, len(remaining) - self.max_facts)]]
+            if drop:
+                sample = [fact for row_id, fact, _ in rows if row_id in dropped][:3]
+                logger.info(f"使用者 {user_id}：刪除 {len(drop)} 筆重複記憶，例如 {sample}")
+            await run_in_thread("maintenance_write", self._write, "DELETE FROM user_facts WHERE id = ?",
+                                [(row_id,) for row_id in drop + trimmed])
+            return {"users": 1, "facts": len(rows), "duplicates": len(drop), "trimmed": len(trimmed)}
+
+        return await self.for_each_user("dedup", handle, {"similarity": similarity, "min_ratio": min_ratio},
+                                        tables=("user_facts",))
+
+    async def reextract(self, extract: Extract, replace: bool = False) -> Dict[str, int]:
+        """以目前的抽取 prompt 重新從伺服器保留的對話紀錄抽取記憶。
+
+        只有最近 MAX_MEMORY 輪對話留在資料庫裡；replace=True 會先刪除既有記憶，
+        更早的對話抽出的記憶將無法還原（抽不出任何記憶的使用者則保留原本的記憶）。
+        """
+        if self.retriever is None:
+            raise ValueError("reextract 需要 embedder")
+
+        async def handle(user_id: str) -> Dict[str, int]:
+            turns = await run_in_thread("maintenance_read", self._query,
+                                        "SELECT user_message FROM chat_turns WHERE user_id = ? ORDER BY id", (user_id,))
+            facts = []
+            for (message,) in turns:
+                facts += [f for f in await extract(message) if len(f.strip()) >= 4]
+            if self.dry_run:
+                return {"users": 1, "turns": len(turns), "extracted": len(facts)}
+            removed = 0
+            if replace and facts:
+                removed = len(await run_in_thread("maintenance_read", self._fact_rows, user_id))
+                self.retriever.forget(user_id)
+                await self.store.set(user_id, {"facts": [], "intimacy": (await self.store.get(user_id))["intimacy"]})
+                await self.store.flush()
+            added = 0
+            for fact in facts:
+                added += await self.retriever.add_fact(user_id, fact)
+            return {"users": 1, "turns": len(turns), "extracted": len(facts), "added": added, "removed": removed}
+
+        return await self.for_each_user("reextract", handle, {"replace": replace}, tables=("chat_turns",))
+
+    async def reembed(self, missing_only: bool = False, batch: int = 64) -> Dict[str, int]:
+        """重新計算記憶向量（更換 embedding 模型後），missing_only 時只補上沒有向量的記憶。"""
+        if self.embedder is None:
+            raise ValueError("reembed 需要 embedder")
+
+        async def handle(user_id: str) -> Dict[str, int]:
+            sql = "SELECT id, fact FROM user_facts WHERE user_id = ?" + (" AND embedding IS NULL" if missing_only else "")
+            rows = await run_in_thread("maintenance_read", self._query, sql + " ORDER BY id", (user_id,))
+            for start in range(0, len(rows), batch):
+                part = rows[start:start + batch]
+                vectors = _normalize(await run_in_thread("embed", self.embedder.embed, [fact for _, fact in part]))
+                await run_in_thread("maintenance_write", self._write, "UPDATE user_facts SET embedding = ? WHERE id = ?",
+                                    [(v.astype(np.float32).tobytes(), row_id) for (row_id, _), v in zip(part, vectors)])
+            return {"users": 1, "embedded": len(rows)}
+
+        return await self.for_each_user("reembed", handle, {"missing_only": missing_only}, tables=("user_facts",))
+
+    def _export_record(self, user_id: str, with_history: bool) -> Dict[str, Any]:
+        intimacy = self._query("SELECT intimacy FROM user_memory WHERE user_id = ?", (user_id,))
+        facts = self._query("SELECT fact, created_at FROM user_facts WHERE user_id = ? ORDER BY id", (user_id,))
+        record = {
+            "user_id": user_id,
+            "intimacy": intimacy[0][0] if intimacy and intimacy[0][0] is not None else DEFAULT_INTIMACY,
+            "facts": [{"fact": f, "created_at": ts} for f, ts in facts],
+        }
+        if with_history:
+            turns = self._query(
+                "SELECT user_message, bot_reply, created_at FROM chat_turns WHERE user_id = ? ORDER BY id", (user_id,)
+            )
+            summary = self._query("SELECT summary FROM chat_summary WHERE user_id = ?", (user_id,))
+            record["turns"] = [{"user": u, "bot": b, "created_at": ts} for u, b, ts in turns]
+            record["summary"] = summary[0][0] if summary else None
+        return record
+
+    async def export(self, path: str, with_history: bool = False) -> Dict[str, int]:
+        """每位使用者一行 JSON（親密度、記憶，可選對話紀錄）。向量不匯出，匯入後會自動補算。"""
+        params = {"path": os.path.abspath(path), "with_history": with_history}
+        checkpoint = self._checkpoint("export", params)
+        offset = checkpoint.state.get("offset", 0)
+        with open(path, "r+" if offset else "w", encoding="utf-8") as out:
+            # 接續時截掉上次檢查點之後寫到一半的內容
+            out.seek(offset)
+            out.truncate()
+
+            async def handle(user_id: str) -> Dict[str, int]:
+                record = await run_in_thread("maintenance_read", self._export_record, user_id, with_history)
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                return {"users": 1, "facts": len(record["facts"]), "turns": len(record.get("turns", ()))}
+
+            def on_chunk() -> Dict[str, Any]:
+                out.flush()
+                return {"offset": out.tell()}
+
+            return await self.for_each_user("export", handle, params, on_chunk=on_chunk)
+
+    def _import_batch(self, records: List[Dict[str, Any]], replace: bool) -> Counter:
+        counts = Counter()
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                c = self._conn.cursor()
+                for record in records:
+                    user_id = record["user_id"]
+                    if replace:
+                        c.execute("DELETE FROM user_facts WHERE user_id = ?", (user_id,))
+                    if record.get("intimacy") is not None:
+                        c.execute("""
+                            INSERT INTO user_memory (user_id, intimacy) VALUES (?, ?)
+                            ON CONFLICT(user_id) DO UPDATE SET intimacy=excluded.intimacy
+                        """, (user_id, int(record["intimacy"])))
+                    facts = [f if isinstance(f, dict) else {"fact": f} for f in record.get("facts", [])]
+                    c.executemany(
+                        "INSERT OR IGNORE INTO user_facts (user_id, fact, fact_hash, created_at) VALUES (?, ?, ?, ?)",
+                        [(user_id, f["fact"], fact_hash(f["fact"]), f.get("created_at") or now + i * 1e-6)
+                         for i, f in enumerate(facts)],
+                    )
+                    counts["facts"] += c.rowcount if c.rowcount > 0 else 0
+                    c.execute(TRIM_FACTS_SQL, (user_id, user_id, self.max_facts))
+                    if "turns" in record:
+                        if replace:
+                            c.execute("DELETE FROM chat_turns WHERE user_id = ?", (user_id,))
+                        c.executemany(
+                            "INSERT INTO chat_turns (user_id, user_message, bot_reply, created_at) VALUES (?, ?, ?, ?)",
+                            [(user_id, t["user"], t["bot"], t.get("created_at") or now) for t in record["turns"]],
+                        )
+                        counts["turns"] += len(record["turns"])
+                    if record.get("summary"):
+                        c.execute("""
+                            INSERT INTO chat_summary (user_id, summary) VALUES (?, ?)
+                            ON CONFLICT(user_id) DO UPDATE SET summary=excluded.summary
+                        """, (user_id, record["summary"]))
+                    counts["users"] += 1
+                if self.dry_run:
+                    self._conn.rollback()
+        return counts
+
+    async def import_(self, path: str, replace: bool = False) -> Dict[str, int]:
+        """匯入 export 產生的 JSONL；一批 chunk_size 行一個 transaction，檢查點記錄已匯入的行數。"""
+        checkpoint = self._checkpoint("import", {"path": os.path.abspath(path), "replace": replace})
+        totals = Counter(checkpoint.state.get("totals", {}))
+        if checkpoint.state.get("finished"):
+            logger.info("import 已在先前完成；要重新執行請不要加 --resume")
+            return dict(totals)
+        done = checkpoint.state.get("lines", 0)
+        with open(path, encoding="utf-8") as f:
+            total = sum(1 for _ in f)
+        progress = Progress("import", total, done)
+        with open(path, encoding="utf-8") as f:
+            for lines in _chunks(f, self.chunk_size, skip=done):
+                records = []
+                for line in lines:
+                    try:
+                        record = json.loads(line) if line.strip() else None
+                    except ValueError as e:
+                        logger.error(f"第 {done + len(records) + 1} 行不是合法 JSON，略過：{e}")
+                        totals["failed"] += 1
+                        continue
+                    if record is not None:
+                        records.append(record)
+                totals.update(await run_in_thread("maintenance_write", self._import_batch, records, replace))
+                done += len(lines)
+                progress.update(len(lines))
+                checkpoint.save(lines=done, totals=dict(totals))
+        checkpoint.save(finished=True)
+        progress.finish()
+        return dict(totals)
+
+    def _vacuum(self) -> Dict[str, int]:
+        before = _db_bytes(self.db_file)
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.execute("VACUUM")
+            self._conn.execute("PRAGMA optimize")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return {"bytes_before": before, "bytes_after": _db_bytes(self.db_file)}
+
+    async def vacuum(self) -> Dict[str, int]:
+        """合併 WAL、重建資料庫檔案以回收刪除後的空間。"""
+        if self.dry_run:
+            return {}
+        await self.store.flush()
+        return await run_in_thread("maintenance_vacuum", self._vacuum)
+
+    def _stats(self) -> Dict[str, int]:
+        one = lambda sql: self._query(sql)[0][0]
+        return {
+            "users": self._count_users(USER_TABLES),
+            "facts": one("SELECT count(*) FROM user_facts"),
+            "facts_without_embedding": one("SELECT count(*) FROM user_facts WHERE embedding IS NULL"),
+            "turns": one("SELECT count(*) FROM chat_turns"),
+            "bytes": _db_bytes(self.db_file),
+        }
+
+    async def stats(self) -> Dict[str, int]:
+        return await run_in_thread("maintenance_stats", self._stats)
+
+
+def _db_bytes(db_file: str) -> int:
+    """資料庫檔案加上 WAL 的大小。"""
+    return sum(os.path.getsize(p) for p in (db_file, db_file + "-wal") if os.path.exists(p))
+
+
+def _chunks(lines: TextIO, size: int, skip: int = 0) -> Iterator[List[str]]:
+    chunk: List[str] = []
+    for i, line in enumerate(lines):
+        if i < skip:
+            continue
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
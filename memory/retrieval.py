@@ -0,0 +1,258 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from memory.store import UserStore
+from utils.metrics import run_in_thread
+
+logger = logging.getLogger("app")
+
+
+# ------------------ 向量化 ------------------
+
+class Embedder:
+    """把文字轉成向量的介面；embed 為同步呼叫，由呼叫端丟到 thread pool。"""
+
+    dim: int = 0
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+class HashingEmbedder(Embedder):
+    """不需模型的本地向量化：字元 1~2-gram 雜湊到固定維度。結果固定，可用於測試。"""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _bucket(self, gram: str) -> int:
+        return int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=4).digest(), "little") % self.dim
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            chars = [c for c in text if not c.isspace()]
+            for i, c in enumerate(chars):
+                out[row, self._bucket(c)] += 1.0
+                if i + 1 < len(chars):
+                    out[row, self._bucket(c + chars[i + 1])] += 1.0
+        return out
+
+
+class OllamaEmbedder(Embedder):
+    """透過 Ollama 的 embedding 模型向量化。"""
+
+    def __init__(self, model: str = "nomic-embed-text"):
+        self.model = model
+        self._client = None
+        self.dim = 0
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        if self._client is None:
+            # 第一次向量化時才載入 langchain_ollama，不拖慢啟動
+            from langchain_ollama import OllamaEmbeddings
+            self._client = OllamaEmbeddings(model=self.model)
+        vectors = np.asarray(self._client.embed_documents(list(texts)), dtype=np.float32)
+        self.dim = vectors.shape[1]
+        return vectors
+
+
+def build_embedder(kind: str, model: str) -> Embedder:
+    if kind == "ollama":
+        return OllamaEmbedder(model)
+    return HashingEmbedder()
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# ------------------ 每位使用者的向量索引 ------------------
+
+class FactIndex:
+    """單一使用者的記憶向量（已正規化），依新增順序排列，容量不足時倍增。"""
+
+    def __init__(self, dim: int, capacity: int = 64):
+        self.dim = dim
+        self.facts: List[str] = []
+        self.version = 0  # 已載入的 user_facts 最大 id
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.facts)
+
+    def add(self, fact: str, vector: np.ndarray) -> None:
+        n = len(self.facts)
+        if n == self._matrix.shape[0]:
+            grown = np.zeros((n * 2, self.dim), dtype=np.float32)
+            grown[:n] = self._matrix
+            self._matrix = grown
+        self._matrix[n] = vector
+        self.facts.append(fact)
+
+    def trim(self, max_facts: int) -> None:
+        """與 UserStore 相同，只保留最新 max_facts 筆。"""
+        extra = len(self.facts) - max_facts
+        if extra > 0:
+            n = len(self.facts)
+            self._matrix[: n - extra] = self._matrix[extra:n]
+            del self.facts[:extra]
+
+    def search(self, query: np.ndarray, k: int) -> List[str]:
+        n = len(self.facts)
+        if n == 0:
+            return []
+        scores = self._matrix[:n] @ query
+        if k < n:
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(n)
+        # 依原本的時間順序輸出，讓 prompt 內容穩定
+        return [self.facts[i] for i in sorted(top)]
+
+
+class MemoryRetriever:
+    """記憶寫入時順便向量化，產生 prompt 時只取與當前訊息最相關的 top-k 筆。
+
+    向量以 float32 BLOB 存在 user_facts.embedding；索引在第一次查詢時載入，
+    並以 LRU 保留 cache_size 位使用者。store.shared 時每次查詢先比對記憶的最大 id，
+    只補讀其他 worker 新增的記憶；記憶被刪除（最大 id 變小）則整份重建。
+    沒有任何記憶的使用者也記下來（shared 時連同最大 id），不必每輪重新查詢資料庫。
+    """
+
+    def __init__(self, store: UserStore, embedder: Embedder, cache_size: int = 256):
+        self.store = store
+        self.embedder = embedder
+        self.cache_size = cache_size
+        self._indexes: "OrderedDict[str, FactIndex]" = OrderedDict()
+        self._empty: "OrderedDict[str, int]" = OrderedDict()  # 沒有記憶的使用者 → 當時的最大 id
+
+    async def _embed(self, texts: Sequence[str]) -> Optional[np.ndarray]:
+        try:
+            vectors = await run_in_thread("embed", self.embedder.embed, texts)
+            return _normalize(vectors)
+        except Exception as e:
+            logger.error(f"記憶向量化失敗：{e}")
+            return None
+
+    async def add_fact(self, user_id: str, fact: str) -> bool:
+        if await self.store.has_fact(user_id, fact):
+            return False  # 重複的記憶不必向量化
+        vectors = await self._embed([fact])
+        vector = vectors[0] if vectors is not None else None
+        added = await self.store.add_fact(
+            user_id, fact, embedding=vector.tobytes() if vector is not None else None
+        )
+        if added:
+            self._empty.pop(user_id, None)
+        index = self._indexes.get(user_id)
+        if added and index is not None:
+            if vector is None:
+                # 沒有向量就無法加入索引，下次查詢時重建
+                self.forget(user_id)
+            else:
+                index.add(fact, vector)
+                index.trim(self.store.max_facts)
+        return added
+
+    def forget(self, user_id: str) -> None:
+        self._indexes.pop(user_id, None)
+        self._empty.pop(user_id, None)
+
+    async def _known_empty(self, user_id: str) -> bool:
+        version = self._empty.get(user_id)
+        if version is None:
+            return False
+        # 單一行程時新增記憶都經過 add_fact，shared 時要確認其他 worker 沒有寫入
+        if not self.store.shared or await self.store.fact_version(user_id) == version:
+            self._empty.move_to_end(user_id)
+            return True
+        del self._empty[user_id]
+        return False
+
+    async def _vectors(self, user_id: str, rows: List[Tuple[int, str, Optional[bytes]]]) -> Optional[List[np.ndarray]]:
+        missing = [fact for _, fact, blob in rows if blob is None]
+        backfill = {}
+        if missing:
+            # 舊資料（例如從 JSON 搬移過來的）補算向量並寫回
+            vectors = await self._embed(missing)
+            if vectors is None:
+                return None
+            backfill = dict(zip(missing, vectors))
+            await self.store.set_fact_vectors(user_id, [(f, v.tobytes()) for f, v in backfill.items()])
+        return [backfill[fact] if blob is None else np.frombuffer(blob, dtype=np.float32) for _, fact, blob in rows]
+
+    def _extend(self, user_id: str, index: Optional[FactIndex], rows, vectors, skip_known: bool) -> Optional[FactIndex]:
+        for (row_id, fact, _), vector in zip(rows, vectors):
+            if index is None:
+                index = FactIndex(vector.shape[0], capacity=max(64, len(rows)))
+            index.version = row_id
+            if vector.shape[0] != index.dim:
+                logger.warning(f"使用者 {user_id} 的記憶向量維度不一致，略過：{fact}")
+                continue
+            if skip_known and fact in index.facts:
+                continue  # 本行程 add_fact 時已經加入
+            index.add(fact, vector)
+        return index
+
+    async def _sync(self, user_id: str, index: FactIndex) -> Optional[FactIndex]:
+        """shared 模式：補上其他 worker 寫入的記憶。"""
+        latest = await self.store.fact_version(user_id)
+        if latest == index.version:
+            return index
+        if latest < index.version:
+            self.forget(user_id)
+            return await self._index(user_id)
+        rows = await self.store.load_fact_vectors(user_id, after_id=index.version)
+        vectors = await self._vectors(user_id, rows)
+        if vectors is None:
+            return index
+        self._extend(user_id, index, rows, vectors, skip_known=True)
+        index.trim(self.store.max_facts)
+        return index
+
+    async def _index(self, user_id: str) -> Optional[FactIndex]:
+        index = self._indexes.get(user_id)
+        if index is not None:
+            self._indexes.move_to_end(user_id)
+            if self.store.shared:
+                return await self._sync(user_id, index)
+            return index
+        if await self._known_empty(user_id):
+            return None
+
+        # 先取得最大 id 再讀取：讀取途中其他 worker 新增的記憶，下次比對時就會發現
+        version = await self.store.fact_version(user_id) if self.store.shared else 0
+        rows = await self.store.load_fact_vectors(user_id)
+        if not rows:
+            self._empty[user_id] = version
+            while len(self._empty) > self.cache_size:
+                self._empty.popitem(last=False)
+            return None
+        vectors = await self._vectors(user_id, rows)
+        if vectors is None:
+            return None
+        index = self._extend(user_id, None, rows, vectors, skip_known=False)
+        if index is None:
+            return None
+
+        self._indexes[user_id] = index
+        while len(self._indexes) > self.cache_size:
+            self._indexes.popitem(last=False)
+        return index
+
+    async def top_k(self, user_id: str, query: str, k: int) -> List[str]:
+        """回傳與 query 最相關的 k 筆記憶；向量化失敗時退回最新的 k 筆。"""
+        index = await self._index(user_id)
+        if index is not None and len(index) <= k:
+            return list(index.facts)
+        query_vec = await self._embed([query]) if index is not None else None
+        if query_vec is None or query_vec.shape[1] != index.dim:
+            facts = (await self.store.get(user_id))["facts"]
+            return facts[-k:]
+        return index.search(query_vec[0], k)
@@ -0,0 +1,431 @@
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+import weakref
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import DEFAULT_INTIMACY, MAX_FACTS_PER_USER
+from utils.metrics import run_in_thread
+
+logger = logging.getLogger("app")
+
+SCHEMA_VERSION = 2
+
+# 親密度 = clamp(round(目前值 + step))，在同一個 SQL 敘述內完成，不會被其他行程插隊
+ADJUST_INTIMACY_SQL = """
+    INSERT INTO user_memory (user_id, intimacy)
+    VALUES (:user_id, max(:low, min(:high, CAST(round(:default + :step) AS INTEGER))))
+    ON CONFLICT(user_id) DO UPDATE SET
+        intimacy = max(:low, min(:high, CAST(round(coalesce(intimacy, :default) + :step) AS INTEGER)))
+    RETURNING intimacy
+"""
+
+# 只保留這位使用者最新的 N 筆記憶，參數為 (user_id, user_id, N)
+TRIM_FACTS_SQL = """
+    DELETE FROM user_facts WHERE user_id = ? AND id <= (
+        SELECT id FROM user_facts WHERE user_id = ?
+        ORDER BY id DESC LIMIT 1 OFFSET ?
+    )
+"""
+
+
+def normalize_fact(fact: str) -> str:
+    """正規化記憶文字，用來判斷重複（全半形、大小寫、空白、句尾標點）。"""
+    text = unicodedata.normalize("NFKC", fact).lower()
+    text = " ".join(text.split())
+    return text.rstrip("。.!！~～ ")
+
+
+def fact_hash(fact: str) -> str:
+    return hashlib.sha1(normalize_fact(fact).encode("utf-8")).hexdigest()
+
+
+class _UserRecord:
+    __slots__ = ("facts", "hashes", "intimacy", "version")
+
+    def __init__(self, facts: List[str], intimacy: int, version: int = 0):
+        self.facts = deque(facts)
+        self.hashes = {fact_hash(f) for f in facts}
+        self.intimacy = intimacy
+        self.version = version  # 讀取時 user_facts 的最大 id，用來判斷其他行程是否改過記憶
+
+
+class _Pending:
+    __slots__ = ("replace", "new_facts", "intimacy")
+
+    def __init__(self):
+        self.replace = False
+        self.new_facts: List[tuple] = []
+        self.intimacy: Optional[int] = None  # 只有 set() 整筆覆蓋時才寫入
+
+    def absorb(self, newer: "_Pending") -> None:
+        """把較新的變更併進寫入失敗、要重試的這一批。"""
+        if newer.replace:
+            self.replace = True
+            self.new_facts = list(newer.new_facts)
+        else:
+            self.new_facts.extend(newer.new_facts)
+        if newer.intimacy is not None:
+            self.intimacy = newer.intimacy
+
+
+class UserStore:
+    """使用者長期記憶與親密度的 SQLite 儲存層。
+
+    - 整個行程共用一條 WAL 模式的連線，不再每次呼叫都重新 connect
+    - 每位使用者各自一把 asyncio.Lock，取代全域 MEMORY_LOCK
+    - 讀取走 LRU 快取；寫入先改快取，延遲 flush_interval 秒後把這段期間
+      所有變更（例如同一輪的多筆記憶與親密度）合併成一個 transaction 寫回
+    - 記憶存在 user_facts 表，一筆一列，以正規化文字的雜湊做唯一索引去重，
+      每位使用者的上限在 SQL 中裁切
+    - 親密度的增減直接在資料庫內以單一 upsert 完成（adjust_intimacy），不走 write-behind
+    - shared=True（多個 worker 行程共用資料庫）時，每次讀取都向資料庫確認親密度，
+      記憶的最大 id 有變動才重新載入
+    """
+
+    def __init__(self, db_file: str, cache_size: int = 1024, flush_interval: float = 0.05,
+                 max_facts: int = MAX_FACTS_PER_USER, shared: bool = False, busy_timeout: float = 30):
+        self.db_file = db_file
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.max_facts = max_facts
+        self.shared = shared
+        self.busy_timeout = busy_timeout
+        self._connection: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.RLock()
+        self._cache: "OrderedDict[str, _UserRecord]" = OrderedDict()
+        self._dirty: Dict[str, _Pending] = {}
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        self._flush_task: Optional[asyncio.Task] = None
+        # 同一時間只有一批寫入：較舊批次的 DELETE / 親密度覆蓋不會晚於較新的寫入
+        self._flush_lock = asyncio.Lock()
+
+    # ------------------ 連線 ------------------
+
+    def open(self) -> None:
+        """連線並建立資料表；可重複呼叫，只有第一次有作用。沒有事先呼叫時第一次查詢會自動開啟。"""
+        with self._db_lock:
+            if self._connection is None:
+                # 其他行程持有寫入鎖時最多等待 busy_timeout 秒
+                self._connection = sqlite3.connect(self.db_file, timeout=self.busy_timeout, check_same_thread=False)
+                self._init_db()
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self.open()
+        return self._connection
+
+    def _init_db(self) -> None:
+        with self._db_lock:
+            c = self._conn.cursor()
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=NORMAL")
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS user_memory (
+                user_id TEXT PRIMARY KEY,
+                facts TEXT,
+                intimacy INTEGER
+            )
+            """)
+            c.execute("""
+            CREATE TABLE IF NOT EXISTS user_facts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                fact TEXT NOT NULL,
+                fact_hash TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                embedding BLOB
+            )
+            """)
+            c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_user_facts_hash ON user_facts (user_id, fact_hash)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_user_facts_user ON user_facts (user_id, id)")
+            version = c.execute("PRAGMA user_version").fetchone()[0]
+            if version < 1:
+                self._migrate_facts_json(c)
+            columns = {row[1] for row in c.execute("PRAGMA table_info(user_facts)")}
+            if "embedding" not in columns:
+                c.execute("ALTER TABLE user_facts ADD COLUMN embedding BLOB")
+            c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self._conn.commit()
+
+    def _migrate_facts_json(self, c: sqlite3.Cursor) -> None:
+        """一次性把 user_memory.facts 的 JSON 陣列搬到 user_facts 表。"""
+        now = time.time()
+        migrated = 0
+        rows = self._conn.execute("SELECT user_id, facts FROM user_memory WHERE facts IS NOT NULL AND facts != ''")
+        for user_id, facts_json in rows:
+            try:
+                facts = json.loads(facts_json)
+            except ValueError:
+                logger.warning(f"使用者 {user_id} 的記憶 JSON 無法解析，略過搬移")
+                continue
+            for i, fact in enumerate(facts[-self.max_facts:]):
+                c.execute(
+                    "INSERT OR IGNORE INTO user_facts (user_id, fact, fact_hash, created_at) VALUES (?, ?, ?, ?)",
+                    (user_id, fact, fact_hash(fact), now + i * 1e-6),
+                )
+            migrated += 1
+        c.execute("UPDATE user_memory SET facts = NULL")
+        if migrated:
+            logger.info(f"已將 {migrated} 位使用者的記憶搬移到 user_facts")
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def lock(self, user_id: str) -> asyncio.Lock:
+        """同一位使用者的 read-modify-write 需持有這把鎖。"""
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[user_id] = lock
+        return lock
+
+    # ------------------ 快取 ------------------
+
+    def _remember(self, user_id: str, record: _UserRecord) -> None:
+        self._cache[user_id] = record
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.cache_size:
+            # 只淘汰已寫回的資料，尚未 flush 的留著
+            victim = next((k for k in self._cache if k not in self._dirty), None)
+            if victim is None:
+                break
+            del self._cache[victim]
+
+    def _pending(self, user_id: str) -> _Pending:
+        pending = self._dirty.get(user_id)
+        if pending is None:
+            pending = self._dirty[user_id] = _Pending()
+        return pending
+
+    # ------------------ 讀寫 ------------------
+
+    def _load(self, user_id: str) -> _UserRecord:
+        with self._db_lock:
+            row = self._conn.execute("SELECT intimacy FROM user_memory WHERE user_id = ?", (user_id,)).fetchone()
+            rows = self._conn.execute(
+                "SELECT id, fact FROM user_facts WHERE user_id = ? ORDER BY id", (user_id,)
+            ).fetchall()
+        intimacy = row[0] if row and row[0] is not None else DEFAULT_INTIMACY
+        return _UserRecord([f for _, f in rows], intimacy, rows[-1][0] if rows else 0)
+
+    def _state(self, user_id: str) -> Tuple[Optional[int], int]:
+        """目前的親密度與 user_facts 最大 id，兩者都走索引，成本很低。"""
+        with self._db_lock:
+            return self._conn.execute("""
+                SELECT (SELECT intimacy FROM user_memory WHERE user_id = ?),
+                       (SELECT coalesce(max(id), 0) FROM user_facts WHERE user_id = ?)
+            """, (user_id, user_id)).fetchone()
+
+    def _check(self, user_id: str, version: int) -> Tuple[Optional[int], Optional[_UserRecord]]:
+        """shared 模式：回傳最新親密度；記憶被其他行程改過時一併回傳重新載入的資料。"""
+        intimacy, latest = self._state(user_id)
+        if latest != version:
+            return intimacy, self._load(user_id)
+        return intimacy, None
+
+    async def _refresh(self, user_id: str, record: _UserRecord) -> _UserRecord:
+        intimacy, reloaded = await run_in_thread("sqlite_user_check", self._check, user_id, record.version)
+        if user_id in self._dirty or self._cache.get(user_id) is not record:
+            # 等待期間本行程已有新的寫入，以快取為準
+            return self._cache.get(user_id) or record
+        if reloaded is not None:
+            self._remember(user_id, reloaded)
+            return reloaded
+        record.intimacy = DEFAULT_INTIMACY if intimacy is None else intimacy
+        return record
+
+    async def _record(self, user_id: str) -> _UserRecord:
+        record = self._cache.get(user_id)
+        if record is not None:
+            self._cache.move_to_end(user_id)
+            if self.shared and user_id not in self._dirty:
+                return await self._refresh(user_id, record)
+            return record
+        loaded = await run_in_thread("sqlite_user_load", self._load, user_id)
+        # 等待讀取期間可能已有人寫入快取，以快取為準
+        record = self._cache.get(user_id)
+        if record is None:
+            record = loaded
+            self._remember(user_id, record)
+        return record
+
+    async def get(self, user_id: str) -> Dict[str, Any]:
+        try:
+            record = await self._record(user_id)
+        except Exception as e:
+            logger.error(f"get_user_data 資料庫異常: {e}")
+            return {"facts": [], "intimacy": DEFAULT_INTIMACY}
+        return {"facts": list(record.facts), "intimacy": record.intimacy}
+
+    async def set(self, user_id: str, data: Dict[str, Any]) -> None:
+        """整筆覆蓋使用者資料（記憶清單 + 親密度）。"""
+        facts = list(data.get("facts", []))[-self.max_facts:]
+        intimacy = data.get("intimacy", DEFAULT_INTIMACY)
+        self._remember(user_id, _UserRecord(facts, intimacy))
+        pending = self._pending(user_id)
+        pending.replace = True
+        pending.intimacy = intimacy
+        now = time.time()
+        pending.new_facts = [(f, fact_hash(f), now + i * 1e-6, None) for i, f in enumerate(facts)]
+        self._schedule_flush()
+
+    async def set_intimacy(self, user_id: str, value: int) -> None:
+        """直接寫入親密度（不經 write-behind）。"""
+        await self._flush_replace(user_id)
+
+        def _write():
+            with self._db_lock:
+                with self._conn:
+                    self._conn.execute("""
+                        INSERT INTO user_memory (user_id, intimacy) VALUES (?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET intimacy=excluded.intimacy
+                    """, (user_id, value))
+        await run_in_thread("sqlite_intimacy_write", _write)
+        record = self._cache.get(user_id)
+        if record is not None:
+            record.intimacy = value
+
+    async def adjust_intimacy(self, user_id: str, step: float, low: int, high: int) -> int:
+        """intimacy = clamp(round(intimacy + step), low, high)，在資料庫內原子完成並回傳新值。
+
+        多個 worker 同時調整同一位使用者也不會遺失更新，不需要持有 lock()。
+        """
+        await self._flush_replace(user_id)
+        params = {"user_id": user_id, "step": step, "low": low, "high": high, "default": DEFAULT_INTIMACY}
+
+        def _write():
+            with self._db_lock:
+                with self._conn:
+                    return self._conn.execute(ADJUST_INTIMACY_SQL, params).fetchone()[0]
+        value = await run_in_thread("sqlite_intimacy_adjust", _write)
+        record = self._cache.get(user_id)
+        if record is not None:
+            record.intimacy = value
+        return value
+
+    async def _flush_replace(self, user_id: str) -> None:
+        """尚未寫回（或正在寫回）的 set() 會覆蓋親密度，先等它寫完，避免之後把新值蓋掉。"""
+        pending = self._dirty.get(user_id)
+        if (pending is not None and pending.intimacy is not None) or self._flush_lock.locked():
+            await self.flush()
+
+    async def has_fact(self, user_id: str, fact: str) -> bool:
+        """正規化後相同的記憶是否已存在。"""
+        return fact_hash(fact) in (await self._record(user_id)).hashes
+
+    async def add_fact(self, user_id: str, fact: str, embedding: Optional[bytes] = None) -> bool:
+        """新增一筆記憶；已存在（正規化後相同）則回傳 False。"""
+        record = await self._record(user_id)
+        h = fact_hash(fact)
+        if h in record.hashes:
+            return False
+        record.facts.append(fact)
+        record.hashes.add(h)
+        while len(record.facts) > self.max_facts:
+            record.hashes.discard(fact_hash(record.facts.popleft()))
+        self._pending(user_id).new_facts.append((fact, h, time.time(), embedding))
+        self._schedule_flush()
+        return True
+
+    async def load_fact_vectors(self, user_id: str, after_id: int = 0) -> List[Tuple[int, str, Optional[bytes]]]:
+        """依時間順序讀出 id 大於 after_id 的 (id, 記憶, 向量 BLOB)；會先把尚未寫回的記憶 flush。"""
+        if user_id in self._dirty or self._flush_lock.locked():
+            await self.flush()
+
+        def _read():
+            with self._db_lock:
+                return self._conn.execute(
+                    "SELECT id, fact, embedding FROM user_facts WHERE user_id = ? AND id > ? ORDER BY id",
+                    (user_id, after_id),
+                ).fetchall()
+        return await run_in_thread("sqlite_vectors_read", _read)
+
+    async def fact_version(self, user_id: str) -> int:
+        """user_facts 中這位使用者的最大 id；其他行程新增或刪除記憶後會改變。"""
+        if user_id in self._dirty or self._flush_lock.locked():
+            await self.flush()
+        return (await run_in_thread("sqlite_user_check", self._state, user_id))[1]
+
+    async def set_fact_vectors(self, user_id: str, rows: List[Tuple[str, bytes]]) -> None:
+        def _write():
+            with self._db_lock:
+                with self._conn:
+                    self._conn.executemany(
+                        "UPDATE user_facts SET embedding = ? WHERE user_id = ? AND fact_hash = ?",
+                        [(blob, user_id, fact_hash(fact)) for fact, blob in rows],
+                    )
+        await run_in_thread("sqlite_vectors_write", _write)
+
+    async def delete(self, user_id: str) -> None:
+        def _delete():
+            with self._db_lock:
+                with self._conn:
+                    self._conn.execute("DELETE FROM user_facts WHERE user_id = ?", (user_id,))
+                    self._conn.execute("DELETE FROM user_memory WHERE user_id = ?", (user_id,))
+
+        # 等寫入中的批次結束（失敗時會放回 _dirty），再一起丟掉
+        async with self._flush_lock:
+            self._cache.pop(user_id, None)
+            self._dirty.pop(user_id, None)
+            await run_in_thread("sqlite_user_delete", _delete)
+
+    # ------------------ write-behind ------------------
+
+    def _schedule_flush(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """把所有尚未寫回的使用者資料合併成一個 transaction 寫入；正在寫入時先等前一批完成。"""
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if not self._dirty:
+            return
+        batch = list(self._dirty.items())
+        self._dirty = {}
+
+        def _write():
+            with self._db_lock:
+                with self._conn:
+                    # 親密度只在整筆覆蓋時寫入；增減由 adjust_intimacy 直接在資料庫完成
+                    self._conn.executemany("""
+                        INSERT INTO user_memory (user_id, intimacy)
+                        VALUES (?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET intimacy=excluded.intimacy
+                    """, [(user_id, p.intimacy) for user_id, p in batch if p.intimacy is not None])
+                    for user_id, pending in batch:
+                        if pending.replace:
+                            self._conn.execute("DELETE FROM user_facts WHERE user_id = ?", (user_id,))
+                        if not pending.new_facts:
+                            continue
+                        self._conn.executemany(
+                            "INSERT OR IGNORE INTO user_facts (user_id, fact, fact_hash, created_at, embedding) VALUES (?, ?, ?, ?, ?)",
+                            [(user_id, f, h, ts, emb) for f, h, ts, emb in pending.new_facts],
+                        )
+                        self._conn.execute(TRIM_FACTS_SQL, (user_id, user_id, self.max_facts))
+        try:
+            await run_in_thread("sqlite_flush", _write)
+        except Exception as e:
+            logger.error(f"set_user_data 資料庫異常: {e}")
+            for user_id, pending in batch:
+                newer = self._dirty.get(user_id)
+                if newer is not None:
+                    pending.absorb(newer)
+                self._dirty[user_id] = pending
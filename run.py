@@ -1,8 +1,19 @@
-import uvicorn
-import os
-import sys
-
+import uvicorn, os, sys, argparse
 sys.path.append(os.path.dirname(__file__))
 
+from config import HOST, PORT, WORKERS
+
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="127.0.0.1", port=5000, reload=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="啟動 Live2D 聊天伺服器")
+    parser.add_argument("--prod", action="store_true", help="正式模式：多個 worker 行程，不自動重新載入")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="--prod 時的 worker 數")
+    args = parser.parse_args()
+
+    if args.prod:
+        # worker 行程會重新 import config，透過環境變數讓它們知道資料庫由多個行程共用
+        os.environ["WORKERS"] = str(args.workers)
+        uvicorn.run("app:app", host=args.host, port=args.port, workers=args.workers, proxy_headers=True)
+    else:
+        uvicorn.run("app:app", host=args.host, port=args.port, reload=True)
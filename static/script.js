@@ -1,7 +1,10 @@
 let model = null;
 let isWaiting = false;
 let lastAudioUrl = null;
+let lastPlaylist = [];
 let currentAudio = null;
+let audioQueue = [];
+let audioQueuePlaying = false;
 let userHasInteracted = false;
 
 // 親密度
@@ -9,6 +12,8 @@ let intimacyLevel = Number(localStorage.getItem("intimacyLevel")) || 50; // 優
 
 window.addEventListener("DOMContentLoaded", () => {
   updateIntimacyDisplay();
+  // 先以 HTTP 取得 session（WebSocket 無法設定 cookie），再建立推送通道
+  refreshIntimacy().finally(connectSocket);
 });
 
 function updateIntimacyDisplay() {
@@ -177,18 +182,47 @@ function typeWriterEffect(element, text, delay = 30, callback) {
 }
 
 // 互動後才能播放音訊
-function safePlayAudio(url) {
+function safePlayAudio(url, onEnded) {
   if (!userHasInteracted) {
     console.warn("尚未有使用者互動，音訊播放被跳過");
     return;
   }
 
-  currentAudio = new Audio(url);
-  currentAudio.addEventListener("canplaythrough", () => {
-    currentAudio.play().catch(err => {
+  const audio = new Audio(url);
+  currentAudio = audio;
+  audio.addEventListener("canplaythrough", () => {
+    audio.play().catch(err => {
       console.warn("播放語音失敗：", err);
+      if (onEnded) onEnded();
     });
-  });
+  }, { once: true });
+  if (onEnded) {
+    audio.addEventListener("ended", onEnded, { once: true });
+    audio.addEventListener("error", onEnded, { once: true });
+  }
+}
+
+// 分句語音：依序排隊播放，第一句到了就先開始
+function enqueueAudio(url) {
+  audioQueue.push(url);
+  if (!audioQueuePlaying) playNextInQueue();
+}
+
+function playNextInQueue() {
+  const url = audioQueue.shift();
+  if (!url || !userHasInteracted) {
+    audioQueuePlaying = false;
+    audioQueue = [];
+    return;
+  }
+  audioQueuePlaying = true;
+  safePlayAudio(url, playNextInQueue);
+}
+
+function resetAudioQueue() {
+  audioQueue = [];
+  audioQueuePlaying = false;
+  if (currentAudio) currentAudio.pause();
 }
 
 function replayLastAudio() {
@@ -205,9 +239,64 @@ function replayLastAudio() {
     currentAudio.pause();
     currentAudio.currentTime = 0;
   }
+  if (lastPlaylist.length > 1) {
+    resetAudioQueue();
+    lastPlaylist.forEach(enqueueAudio);
+    return;
+  }
   safePlayAudio(lastAudioUrl);
 }
 
+function createStreamingBotMessage() {
+  const chatMessages = document.getElementById("chat-messages");
+  const messageElem = document.createElement("div");
+  messageElem.classList.add("chat-message", "bot");
+  const fullText = document.createElement("div");
+  fullText.className = "full-text";
+  messageElem.appendChild(fullText);
+  chatMessages.appendChild(messageElem);
+  chatMessages.scrollTop = chatMessages.scrollHeight;
+
+  messageElem.addEventListener("click", () => {
+    messageElem.classList.toggle("collapsed");
+  });
+  return fullText;
+}
+
+// 串流中可能只收到半個情緒標籤，例如 "[emo"，先隱藏起來
+function removePartialEmotionTag(text) {
+  return removeEmotionTag(text).replace(/\[[^\]]*$/, "");
+}
+
+function applyIntimacy(data) {
+  // 回傳親密度更新前端，並存於 localStorage
+  if (typeof data.intimacy === "number") {
+    intimacyLevel = data.intimacy;
+    updateIntimacyDisplay();
+    localStorage.setItem("intimacyLevel", intimacyLevel);
+  }
+}
+
+function refreshIntimacy() {
+  return fetch("/get_intimacy")
+    .then(res => res.json())
+    .then(applyIntimacy)
+    .catch(err => console.warn("取得親密度失敗：", err));
+}
+
+function applyAudio(url) {
+  if (url) {
+    lastAudioUrl = url;
+    lastPlaylist = [url];
+    safePlayAudio(lastAudioUrl);
+  }
+}
+
+function applyReply(reply) {
+  const motion = getMotionByEmotionTag(reply) || getMotionByText(reply);
+  playMotion(motion);
+}
+
 async function handleChat() {
   if (isWaiting) return;
   const input = document.getElementById("chatInput");
@@ -224,36 +313,17 @@ async function handleChat() {
   showThinking();
 
   try {
-    const res = await fetch("/chat", {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ message })
-    });
-    const data = await res.json();
-
-    if (data.reply) {
-      const cleanReply = removeEmotionTag(data.reply);
-      addMessage(cleanReply, "bot");
-      const motion = getMotionByEmotionTag(data.reply) || getMotionByText(data.reply);
-      playMotion(motion);
-
-      if (data.audio_url) {
-        lastAudioUrl = data.audio_url;
-        safePlayAudio(lastAudioUrl);
-      }
-
-      // 回傳親密度更新前端，並存於 localStorage
-      if (typeof data.intimacy === "number") {
-        intimacyLevel = data.intimacy;
-        updateIntimacyDisplay();
-        localStorage.setItem("intimacyLevel", intimacyLevel);
+    if (socketOpen()) {
+      try {
+        await chatOverSocket(message);
+        return;
+      } catch (err) {
+        if (!err.retryOverHttp) throw err;
+        // 連線在這輪途中斷掉：改用 HTTP 重送同一則訊息
+        console.warn("WebSocket 中斷，改走 HTTP：", err);
       }
-
-    } else {
-      addMessage("嗯嗯？月讀醬想不到要說什麼了～", "bot");
-      playMotion("Idle");
-      enableInput();
     }
+    await chatOverHttp(message);
   } catch (err) {
     console.error("發生錯誤:", err);
     addMessage("出錯了喔嗚嗚～ (>﹏<)", "bot");
@@ -264,8 +334,231 @@ async function handleChat() {
   }
 }
 
+async function chatOverHttp(message) {
+  const res = await fetch("/chat_stream", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ message })
+  });
+  if (!res.ok || !res.body || !window.TextDecoder) {
+    // 不支援串流時改走舊的 /chat
+    await handleChatJson(message);
+    return;
+  }
+  await readChatStream(res.body);
+}
+
+// 一輪對話的事件處理，/chat_stream 與 WebSocket 共用
+function createTurnHandler() {
+  const chatMessages = document.getElementById("chat-messages");
+  let rawReply = "";
+  let textElem = null;
+  let gotReply = false;
+
+  const handle = (event) => {
+    switch (event.type) {
+      case "token":
+        if (!textElem) {
+          hideThinking();
+          textElem = createStreamingBotMessage();
+        }
+        rawReply += event.content;
+        textElem.textContent = removePartialEmotionTag(rawReply);
+        chatMessages.scrollTop = chatMessages.scrollHeight;
+        break;
+      case "emotion":
+        // 回覆還在串流時就先切換表情
+        playMotion(getMotionByEmotionTag(`[emotion:${event.emotion}]`));
+        break;
+      case "reply":
+        gotReply = true;
+        if (!textElem) textElem = createStreamingBotMessage();
+        textElem.textContent = removeEmotionTag(event.reply);
+        if (!event.emotion) applyReply(event.reply);
+        enableInput();
+        break;
+      case "intimacy":
+        applyIntimacy(event);
+        break;
+      case "audio_chunk":
+        if (event.index === 0) {
+          resetAudioQueue();
+          lastAudioUrl = event.audio_url;
+          lastPlaylist = [];
+        }
+        lastPlaylist.push(event.audio_url);
+        enqueueAudio(event.audio_url);
+        break;
+      case "audio":
+        if (Array.isArray(event.audio_urls) && event.audio_urls.length) {
+          lastPlaylist = event.audio_urls;
+          lastAudioUrl = event.audio_urls[0];
+        }
+        break;
+    }
+  };
+
+  const finish = () => {
+    if (!gotReply) {
+      addMessage("嗯嗯？月讀醬想不到要說什麼了～", "bot");
+      playMotion("Idle");
+      enableInput();
+    }
+  };
+
+  // 收到完整回覆前中斷：移除串流到一半的訊息，讓同一則訊息可以重送
+  const discard = () => {
+    if (textElem) {
+      textElem.parentElement.remove();
+      textElem = null;
+      showThinking();
+    }
+    rawReply = "";
+  };
+  return { handle, finish, discard, replied: () => gotReply };
+}
+
+async function readChatStream(body) {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  const turn = createTurnHandler();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let newline;
+    while ((newline = buffer.indexOf("\n")) >= 0) {
+      const line = buffer.slice(0, newline).trim();
+      buffer = buffer.slice(newline + 1);
+      if (line) turn.handle(JSON.parse(line));
+    }
+  }
+  if (buffer.trim()) turn.handle(JSON.parse(buffer));
+  turn.finish();
+}
+
+// ------------------ WebSocket 推送通道 ------------------
+// 連線中時聊天、清除記憶與親密度都走同一條 WebSocket；沒有連線時改走原本的 HTTP 路由
+
+let socket = null;
+let socketRetries = 0;
+let turnSeq = 0;
+let socketTurn = null; // { id, handler, resolve, reject }
+
+function socketOpen() {
+  return socket !== null && socket.readyState === WebSocket.OPEN;
+}
+
+function connectSocket() {
+  if (!window.WebSocket || socket) return;
+  const protocol = location.protocol === "https:" ? "wss" : "ws";
+  const ws = new WebSocket(`${protocol}://${location.host}/ws`);
+  socket = ws;
+  ws.onopen = () => { socketRetries = 0; };
+  ws.onmessage = (e) => handleSocketMessage(JSON.parse(e.data));
+  ws.onclose = (e) => {
+    socket = null;
+    if (socketTurn) {
+      const turn = socketTurn;
+      socketTurn = null;
+      if (turn.handler.replied()) {
+        // 回覆已經顯示，只差語音或親密度：不重送，親密度改向 HTTP 取得
+        turn.handler.finish();
+        refreshIntimacy();
+        turn.resolve();
+      } else {
+        turn.handler.discard();
+        const err = new Error(`WebSocket closed (${e.code})`);
+        err.retryOverHttp = e.code !== 4401;
+        turn.reject(err);
+      }
+    }
+    if (e.code === 4401) {
+      // 還沒有 session：先以 HTTP 取得後再連
+      refreshIntimacy().finally(() => setTimeout(connectSocket, 1000));
+      return;
+    }
+    // 斷線後以指數退避重連，期間聊天走 HTTP
+    const delay = Math.min(30000, 1000 * 2 ** socketRetries++);
+    setTimeout(connectSocket, delay);
+  };
+}
+
+function sendSocket(message) {
+  if (!socketOpen()) return false;
+  socket.send(JSON.stringify(message));
+  return true;
+}
+
+function handleSocketMessage(event) {
+  switch (event.type) {
+    case "ping":
+      sendSocket({ type: "pong", t: event.t });
+      return;
+    case "pong":
+      return;
+    case "hello":
+      applyIntimacy(event);
+      return;
+    case "cleared":
+      alert(event.message);
+      return;
+  }
+  if (socketTurn && event.id === socketTurn.id) {
+    if (event.type === "error") {
+      socketTurn.reject(new Error(event.code));
+      socketTurn = null;
+      return;
+    }
+    socketTurn.handler.handle(event);
+    if (event.type === "done") {
+      socketTurn.handler.finish();
+      socketTurn.resolve();
+      socketTurn = null;
+    }
+  } else if (event.type === "intimacy") {
+    // 背景計算完的親密度可能在這輪結束後才到
+    applyIntimacy(event);
+  }
+}
+
+function chatOverSocket(message) {
+  return new Promise((resolve, reject) => {
+    const id = ++turnSeq;
+    socketTurn = { id, handler: createTurnHandler(), resolve, reject };
+    sendSocket({ type: "chat", id, message });
+  });
+}
+
+// 舊版一次回傳整包 JSON 的 /chat
+async function handleChatJson(message) {
+  const res = await fetch("/chat", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ message })
+  });
+  const data = await res.json();
+
+  if (data.reply) {
+    const cleanReply = removeEmotionTag(data.reply);
+    addMessage(cleanReply, "bot");
+    applyReply(data.reply);
+    applyAudio(data.audio_url);
+    applyIntimacy(data);
+    // 親密度在背景計算，稍後再向後端取一次
+    if (data.intimacy_pending) setTimeout(refreshIntimacy, 5000);
+  } else {
+    addMessage("嗯嗯？月讀醬想不到要說什麼了～", "bot");
+    playMotion("Idle");
+    enableInput();
+  }
+}
+
 function clearSession() {
   if (!confirm("確定要清除短期記憶嗎？這會讓她忘記剛剛聊的內容喔！")) return;
+  if (sendSocket({ type: "clear_session" })) return;
   fetch("/clear_session", { method: "POST" })
     .then(res => res.json())
     .then(data => alert(data.message))
@@ -274,6 +567,7 @@ function clearSession() {
 
 function clearAllMemory() {
   if (!confirm("確定要清除所有記憶嗎？她會忘記所有過去的事情喔！")) return;
+  if (sendSocket({ type: "clear_memory" })) return;
   fetch("/clear_memory", { method: "POST" })
     .then(res => res.json())
     .then(data => alert(data.message))
@@ -0,0 +1,347 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+
+# 可重現的效能基準：Ollama 與 VOICEVOX 都換成本地假服務，結果寫成 JSON，可與其他 commit 的結果比較
+parser = argparse.ArgumentParser(description="儲存、prompt 組裝、規則判斷、語音快取清理與 /chat 的效能基準")
+parser.add_argument("--only", default="", help="只跑指定的類別（逗號分隔）：storage,prompt,regex,audio,chat")
+parser.add_argument("--quick", action="store_true", help="縮小資料量與重複次數，適合 CI")
+parser.add_argument("--repeat", type=int, default=0, help="每個案例的量測次數（預設 quick 5、完整 15）")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--output", default=None, help="結果 JSON 路徑，預設 benchmark-<commit>.json")
+parser.add_argument("--compare", default=None, help="與先前的結果 JSON 比較 p50")
+parser.add_argument("--max-regression", type=float, default=0, help="任一案例 p50 變慢超過此倍數時以非 0 結束")
+args = parser.parse_args()
+
+REPEAT = args.repeat or (5 if args.quick else 15)
+SELECTED = {s.strip() for s in args.only.split(",") if s.strip()}
+
+os.environ["LLM_BACKEND"] = "fake"
+import config
+
+tmp = tempfile.TemporaryDirectory()
+config.DB_FILE = os.path.join(tmp.name, "bench.db")
+config.WARMUP = False
+config.FAST_PATH = False             # 一律走完整的 LLM 路徑
+config.FAKE_LLM_LATENCY = 0.0           # 只量伺服器本身的額外開銷
+config.FAKE_LLM_TOKENS_PER_SEC = 100000
+config.FAKE_LLM_PARALLEL = 64
+config.LLM_PARALLEL = 64
+
+import httpx
+import app as chat_app
+import tts.voicevox as voicevox
+import tts_pipeline_test
+from utils.regex import keyword_intimacy_fallback, extract_emotion_tag, extract_facts, emotion_weight
+from utils.text_analysis import analyze
+from utils.file_cleanup import DiskLRU
+from tts.cache import DiskAudioCache
+
+tts_pipeline_test.SYNTH_DELAY = 0.0
+server = ThreadingHTTPServer(("127.0.0.1", 0), tts_pipeline_test.FakeVoicevox)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+voicevox.tts.urls = [f"http://127.0.0.1:{server.server_port}"]
+
+rnd = random.Random(args.seed)
+results: Dict[str, Dict[str, Any]] = {}
+
+# ------------------ 量測工具 ------------------
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(samples: List[float], ops: int) -> Dict[str, float]:
+    """samples 為每次量測的秒數，每次包含 ops 個操作；時間欄位皆為每個操作的毫秒數。"""
+    per_op = [s / ops * 1000 for s in samples]
+    return {
+        "n": len(samples),
+        "ops": ops,
+        "mean_ms": round(sum(per_op) / len(per_op), 4),
+        "p50_ms": round(percentile(per_op, 0.5), 4),
+        "p95_ms": round(percentile(per_op, 0.95), 4),
+        "min_ms": round(min(per_op), 4),
+        "ops_per_sec": round(ops / percentile(samples, 0.5), 1) if percentile(samples, 0.5) else None,
+    }
+
+
+async def measure(name: str, run: Callable[[], Awaitable[Any]], ops: int = 1, warmup: int = 1,
+                  setup: Optional[Callable[[], Awaitable[Any]]] = None, **params) -> None:
+    """執行 warmup 次不計時，再量測 REPEAT 次；setup 在每次量測前執行且不計時。"""
+    for _ in range(warmup):
+        if setup:
+            await setup()
+        await run()
+    samples = []
+    for _ in range(REPEAT):
+        if setup:
+            await setup()
+        start = time.perf_counter()
+        await run()
+        samples.append(time.perf_counter() - start)
+    results[name] = {**summarize(samples, ops), "params": params}
+    r = results[name]
+    print(f"  {name:<46} p50 {r['p50_ms']:>10.3f}ms  p95 {r['p95_ms']:>10.3f}ms  {r['ops_per_sec'] or 0:>10.1f} ops/s")
+
+
+async def concurrently(n: int, job: Callable[[int], Awaitable[Any]]) -> None:
+    await asyncio.gather(*(job(i) for i in range(n)))
+
+
+# ------------------ 測試資料 ------------------
+
+CHAT = ["嗯嗯", "今天好累喔", "你在做什麼？", "我喜歡貓咪", "晚餐吃拉麵", "哈哈好好笑", "晚安～", "明天要上班QQ",
+        "我住在台北", "我是工程師", "你好可愛！", "討厭啦你好壞", "謝謝你一直陪我", "今天被主管罵了好難過"]
+PASTE = "以下是我今天寫的報告內容，幫我看看有沒有問題：" + "本季營收較上季成長，主要來自新產品線的貢獻。" * 20
+REPLIES = ["好的主人～我有在聽喔！[emotion:joy]", "嗚嗚不要難過嘛…[emotion:sad]", "哼！才不理你呢[emotion:angry]",
+           "欸嘿嘿，被誇獎了[emotion:shy]", "今天也辛苦了呢。"]
+
+
+def message_corpus(n: int) -> List[str]:
+    """依 seed 產生的訊息集合：閒聊、重複字、長文、表情符號混合，每則都不同以避開 analyze 的快取。"""
+    corpus = []
+    for i in range(n):
+        roll = rnd.random()
+        if roll < 0.05:
+            text = PASTE[: rnd.randint(60, len(PASTE))]
+        elif roll < 0.15:
+            text = rnd.choice(CHAT) + "😂" * rnd.randint(1, 3)
+        else:
+            text = "，".join(rnd.choice(CHAT) for _ in range(rnd.randint(1, 3)))
+        corpus.append(f"{text} #{i}")
+    return corpus
+
+
+def history(turns: int) -> List[Dict[str, str]]:
+    return [{"user": m, "bot": rnd.choice(REPLIES)} for m in message_corpus(turns)]
+
+
+# ------------------ 各類別 ------------------
+
+
+async def bench_storage() -> None:
+    """get_user_data / set_user_data / append_memory 在不同併發數下的表現（含 write-behind flush）。"""
+    users = [f"storage-{i}" for i in range(200 if args.quick else 1000)]
+    for user_id in users:
+        await chat_app.set_user_data(user_id, {"facts": [f"他喜歡第{i}號餐點" for i in range(20)], "intimacy": 50})
+    await chat_app.user_store.flush()
+
+    for concurrency in ((1, 16) if args.quick else (1, 16, 64)):
+        async def get_many():
+            await concurrently(concurrency, lambda i: chat_app.get_user_data(rnd.choice(users)))
+
+        async def cold():
+            chat_app.user_store._cache.clear()
+
+        async def set_many():
+            await concurrently(concurrency, lambda i: chat_app.set_user_data(
+                rnd.choice(users), {"facts": ["他喜歡貓", "他住在台北"], "intimacy": rnd.randint(0, 100)}))
+            await chat_app.user_store.flush()
+
+        async def append_many():
+            await concurrently(concurrency, lambda i: chat_app.append_memory(
+                rnd.choice(users), f"他最近在學第{rnd.randint(0, 10 ** 9)}首歌"))
+            await chat_app.user_store.flush()
+
+        await measure(f"storage.get_user_data[c={concurrency}]", get_many, ops=concurrency, concurrency=concurrency)
+        await measure(f"storage.get_user_data.cold[c={concurrency}]", get_many, ops=concurrency, setup=cold,
+                      concurrency=concurrency)
+        await measure(f"storage.set_user_data[c={concurrency}]", set_many, ops=concurrency, concurrency=concurrency)
+        await measure(f"storage.append_memory[c={concurrency}]", append_many, ops=concurrency, concurrency=concurrency)
+
+
+async def bench_prompt() -> None:
+    """generate_system_prompt + generate_context_prompt（含記憶檢索）+ build_chat_messages。"""
+    fact_sizes = (10, 500) if args.quick else (10, 200, 2000)
+    history_sizes = (8, 48) if args.quick else (8, 24, 96)
+    for facts in fact_sizes:
+        user_id = f"prompt-{facts}"
+        await chat_app.set_user_data(user_id, {"facts": [f"他喜歡的第{i}件事是{rnd.choice(CHAT)}" for i in range(facts)],
+                                               "intimacy": 70})
+        await chat_app.user_store.flush()
+        for turns in history_sizes:
+            past = history(turns)
+            message = rnd.choice(CHAT)
+
+            async def build():
+                system_prompt = await chat_app.generate_system_prompt(user_id, message)
+                context_prompt = await chat_app.generate_context_prompt(user_id, message)
+                chat_app.build_chat_messages(past, message, system_prompt, context_prompt=context_prompt)
+
+            # 第一次呼叫會建立記憶向量索引，算在 warmup 內
+            await measure(f"prompt.build[facts={facts},turns={turns}]", build, facts=facts, turns=turns)
+
+
+async def bench_regex() -> None:
+    """utils.regex 的規則判斷；analyze 有 LRU 快取，cold 每輪先清空。"""
+    corpus = message_corpus(500 if args.quick else 2000)
+    replies = [rnd.choice(REPLIES) + m for m in corpus]
+
+    async def heuristics():
+        for message, reply in zip(corpus, replies):
+            keyword_intimacy_fallback(message)
+            extract_facts(message)
+            emotion_weight(extract_emotion_tag(reply))
+
+    async def clear():
+        analyze.cache_clear()
+
+    await measure("regex.heuristics.cold", heuristics, ops=len(corpus), setup=clear, messages=len(corpus))
+    warm = corpus[:500]
+
+    async def cached():
+        for message in warm:
+            keyword_intimacy_fallback(message)
+            extract_facts(message)
+
+    await measure("regex.heuristics.warm", cached, ops=len(warm), messages=len(warm))
+
+
+async def bench_audio() -> None:
+    """語音快取目錄：啟動時掃描大目錄、一次淘汰一半、穩定狀態下每次寫入都淘汰一個。"""
+    payload = b"RIFF" + b"\0" * 2044
+    for files in ((2000,) if args.quick else (2000, 20000)):
+        directory = tempfile.mkdtemp(dir=tmp.name)
+        for i in range(files):
+            with open(os.path.join(directory, f"{i:08x}.wav"), "wb") as f:
+                f.write(payload)
+
+        async def scan():
+            DiskLRU(directory, max_bytes=1 << 40, max_files=files)
+
+        await measure(f"audio.scan[files={files}]", scan, files=files)
+
+        async def refill():
+            existing = set(os.listdir(directory))
+            for i in range(files):
+                name = f"{i:08x}.wav"
+                if name not in existing:
+                    with open(os.path.join(directory, name), "wb") as f:
+                        f.write(payload)
+
+        async def evict_half():
+            DiskLRU(directory, max_bytes=1 << 40, max_files=files // 2)
+
+        await measure(f"audio.evict_half[files={files}]", evict_half, setup=refill, files=files)
+
+        cache = DiskAudioCache(directory, max_bytes=1 << 40, max_files=files // 2)
+        writes = 200
+
+        async def store_with_eviction():
+            for _ in range(writes):
+                await cache.store(f"{rnd.getrandbits(64):016x}", payload)
+
+        await measure(f"audio.store_evict[files={files // 2}]", store_with_eviction, ops=writes, files=files // 2)
+
+
+async def bench_chat() -> None:
+    """經 ASGI 呼叫 /chat 與 /chat_stream：假模型無延遲、假 VOICEVOX 即時回應，量的是伺服器本身的開銷。"""
+    messages = [m for m in message_corpus(400) if len(m) < 60]
+    async with chat_app.app.router.lifespan_context(chat_app.app):
+        for concurrency in ((1, 8) if args.quick else (1, 8, 32)):
+            clients = [httpx.AsyncClient(transport=httpx.ASGITransport(app=chat_app.app), base_url="http://bench",
+                                         timeout=60) for _ in range(concurrency)]
+
+            async def post(path: str):
+                async def one(i):
+                    r = await clients[i].post(path, json={"message": rnd.choice(messages)})
+                    r.raise_for_status()
+                    await r.aread()
+                await concurrently(concurrency, one)
+
+            await measure(f"chat.chat[c={concurrency}]", lambda: post("/chat"), ops=concurrency, concurrency=concurrency)
+            await measure(f"chat.chat_stream[c={concurrency}]", lambda: post("/chat_stream"), ops=concurrency,
+                          concurrency=concurrency)
+            await chat_app.post_turn.join()
+            for client in clients:
+                await client.aclose()
+
+
+BENCHMARKS = {
+    "storage": bench_storage,
+    "prompt": bench_prompt,
+    "regex": bench_regex,
+    "audio": bench_audio,
+    "chat": bench_chat,
+}
+
+# ------------------ 輸出與比較 ------------------
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(baseline_path: str) -> List[str]:
+    """印出各案例 p50 與基準的比值，回傳變慢超過 --max-regression 的案例。"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n與 {baseline_path}（commit {baseline['meta'].get('commit')}）比較 p50：")
+    regressions = []
+    for name, current in results.items():
+        old = baseline["results"].get(name)
+        if not old or not old.get("p50_ms"):
+            continue
+        ratio = current["p50_ms"] / old["p50_ms"]
+        flag = ""
+        if args.max_regression and ratio > args.max_regression:
+            regressions.append(name)
+            flag = "  ← 變慢"
+        print(f"  {name:<46} {old['p50_ms']:>10.3f}ms → {current['p50_ms']:>10.3f}ms  ×{ratio:.2f}{flag}")
+    return regressions
+
+
+async def main() -> None:
+    for name, bench in BENCHMARKS.items():
+        if SELECTED and name not in SELECTED:
+            continue
+        print(f"[{name}]")
+        await bench()
+    await chat_app.user_store.flush()
+
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "quick": args.quick,
+            "repeat": REPEAT,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    output = args.output or f"benchmark-{commit or 'local'}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果已寫入 {output}")
+
+    if args.compare:
+        regressions = compare(args.compare)
+        if regressions:
+            sys.exit(f"{len(regressions)} 個案例變慢超過 {args.max_regression} 倍：{', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
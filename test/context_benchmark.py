@@ -0,0 +1,139 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+# 模擬長對話（閒聊夾雜偶爾貼上的長文），比較固定 8 輪與 token 預算兩種 prompt 組法
+parser = argparse.ArgumentParser(description="固定輪數 vs token 預算的 prompt 大小與 LLM 延遲")
+parser.add_argument("--conversations", type=int, default=20)
+parser.add_argument("--turns", type=int, default=40, help="每段對話的輪數")
+parser.add_argument("--paste-rate", type=float, default=0.1, help="使用者貼上長文的機率")
+parser.add_argument("--budget", type=int, default=0, help="覆寫 CONTEXT_TOKEN_BUDGET")
+parser.add_argument("--backend", choices=["fake", "ollama"], default="fake",
+                    help="fake：以 prefill 速度估算延遲；ollama：實際呼叫模型並讀 prompt_eval 統計")
+parser.add_argument("--prefill-tps", type=float, default=1500, help="fake 模式假設的 prompt-eval 速度（token/s）")
+parser.add_argument("--sample", type=int, default=20, help="ollama 模式實際送出的 prompt 數")
+args = parser.parse_args()
+
+os.environ["LLM_BACKEND"] = args.backend
+import app as chat_app
+from config import DEFAULT_INTIMACY
+from llm.context import estimate_tokens, message_tokens
+
+CHAT = ["嗯嗯", "今天好累喔", "你在做什麼？", "我喜歡貓咪", "晚餐吃拉麵", "哈哈好好笑", "晚安～", "明天要上班QQ"]
+PASTE = "以下是我今天寫的報告內容，幫我看看有沒有問題：" + "本季營收較上季成長，主要來自新產品線的貢獻，但成本也同步上升。" * 30
+REPLY = "好的主人～我有在聽喔！今天也辛苦了，要記得早點休息，不然我會擔心的。[emotion:cute]"
+
+
+def conversation(seed: int):
+    rnd = random.Random(seed)
+    turns = []
+    for _ in range(args.turns):
+        if rnd.random() < args.paste_rate:
+            user = PASTE[: rnd.randint(len(PASTE) // 2, len(PASTE))]
+        else:
+            user = rnd.choice(CHAT) * rnd.randint(1, 3)
+        turns.append({"user": user, "bot": REPLY[: rnd.randint(20, len(REPLY))]})
+    return turns
+
+
+def legacy_messages(history, user_message, system_prompt, context_prompt):
+    """原本的作法：固定放最後 8 輪。"""
+    texts = [system_prompt]
+    for m in history[-8:]:
+        texts += [m["user"], m["bot"]]
+    return texts + [context_prompt, user_message]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def prompts():
+    """每段對話的每一輪都組一次 prompt，歷史對話為伺服器保留的 MAX_MEMORY 輪。"""
+    system_prompt = chat_app.render_system_prompt(chat_app.build_intimacy_tier_prompt(DEFAULT_INTIMACY))
+    context_prompt = chat_app.render_context_prompt(DEFAULT_INTIMACY, "")
+    for c in range(args.conversations):
+        turns = conversation(c)
+        for t in range(1, len(turns)):
+            history = turns[max(0, t - chat_app.MAX_MEMORY):t]
+            user_message = turns[t]["user"]
+            legacy = legacy_messages(history, user_message, system_prompt, context_prompt)
+            budget = chat_app.build_chat_messages(history, user_message, system_prompt, context_prompt=context_prompt)
+            yield legacy, budget
+
+
+async def ollama_latency(messages_list):
+    from langchain_core.messages import HumanMessage
+    model = chat_app._base_model
+    tokens, latencies, ratios = [], [], []
+    for messages in messages_list:
+        if isinstance(messages[0], str):
+            messages = [HumanMessage(content=m) for m in messages]
+        start = time.perf_counter()
+        result = await model.ainvoke(messages)
+        meta = result.response_metadata or {}
+        latencies.append((meta.get("prompt_eval_duration") or 0) * 1e-9 or time.perf_counter() - start)
+        actual = meta.get("prompt_eval_count") or 0
+        tokens.append(actual)
+        estimated = sum(message_tokens(m.content) for m in messages)
+        if actual:
+            ratios.append(estimated / actual)
+    return tokens, latencies, ratios
+
+
+def report(name, tokens, latencies, kept):
+    print(f"{name:<10}tokens p50 {percentile(tokens, 0.5):>6}  p95 {percentile(tokens, 0.95):>6}  max {max(tokens):>6}  "
+          f"prefill p50 {percentile(latencies, 0.5) * 1000:>7.1f}ms  p95 {percentile(latencies, 0.95) * 1000:>7.1f}ms  "
+          f"平均保留 {sum(kept) / len(kept):.1f} 輪")
+
+
+def main():
+    if args.budget:
+        chat_app.context_budget.total = args.budget
+    print(f"token 預算 {chat_app.context_budget.total}，{args.conversations} 段對話 × {args.turns} 輪，長文機率 {args.paste_rate}")
+
+    start = time.perf_counter()
+    pairs = list(prompts())
+    elapsed = time.perf_counter() - start
+    print(f"組 {len(pairs)} 次 prompt：{elapsed * 1000:.1f}ms（每次 {elapsed / len(pairs) * 1e6:.1f}µs）")
+
+    legacy_tokens = [sum(message_tokens(t) for t in legacy) for legacy, _ in pairs]
+    budget_tokens = [sum(message_tokens(m.content) for m in budget) for _, budget in pairs]
+    legacy_kept = [(len(legacy) - 3) // 2 for legacy, _ in pairs]
+    budget_kept = [sum(1 for m in budget if m.type == "ai") for _, budget in pairs]
+
+    if args.backend == "fake":
+        report("固定 8 輪", legacy_tokens, [t / args.prefill_tps for t in legacy_tokens], legacy_kept)
+        report("token 預算", budget_tokens, [t / args.prefill_tps for t in budget_tokens], budget_kept)
+    else:
+        sample = random.Random(0).sample(pairs, min(args.sample, len(pairs)))
+        for name, index, kept in (("固定 8 輪", 0, legacy_kept), ("token 預算", 1, budget_kept)):
+            tokens, latencies, ratios = asyncio.run(ollama_latency([p[index] for p in sample]))
+            report(name, tokens, latencies, kept)
+            if ratios:
+                print(f"{'':<10}估計 / 實際 token 比：平均 {sum(ratios) / len(ratios):.2f}")
+
+    over = sum(1 for t in budget_tokens if t > chat_app.context_budget.total)
+    print(f"超出預算的 prompt：{over} 次（只發生在單則訊息本身就超過預算時）")
+
+    texts = [PASTE + str(i) for i in range(2000)]
+    estimate_tokens.cache_clear()
+    start = time.perf_counter()
+    for text in texts:
+        estimate_tokens(text)
+    cold = time.perf_counter() - start
+    start = time.perf_counter()
+    for text in texts:
+        estimate_tokens(text)
+    warm = time.perf_counter() - start
+    print(f"token 估算（{len(PASTE)} 字）：未快取 {cold / len(texts) * 1e6:.2f}µs，快取 {warm / len(texts) * 1e6:.2f}µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+# 比較低資訊訊息（「嗯」「謝謝」）走快速路徑與一般路徑的延遲，並確認快速路徑不呼叫判斷模型
+# 參數解析與載入 app 都在 __main__ 內，pytest 收集這個檔案時不會執行
+
+judge_calls = 0
+
+
+async def counting_judge(*a, **kw):
+    global judge_calls
+    judge_calls += 1
+    return await _judge_turn(*a, **kw)
+
+
+async def burst(message):
+    async def one(i):
+        # 每位使用者各自一個 client（各自的 session cookie）
+        transport = httpx.ASGITransport(app=chat_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+            start = time.perf_counter()
+            r = await client.post("/chat", json={"message": message})
+            r.raise_for_status()
+            return time.perf_counter() - start
+    return sorted(await asyncio.gather(*(one(i) for i in range(args.users))))
+
+
+async def main():
+    global judge_calls
+    async with chat_app.app.router.lifespan_context(chat_app.app):
+        await chat_app.warmup.wait()
+        # 從冷的回覆池開始（清掉暖機預先產生的回覆），才看得到請求合併
+        pool = chat_app.reply_pool
+        pool._pools.clear()
+        pool.hits = pool.misses = pool.coalesced = 0
+        for name, message in (("快速（冷）", "嗯嗯"), ("快速（熱）", "嗯嗯"), ("一般", "我今天在公司被主管罵了")):
+            judge_calls = 0
+            times = await burst(message)
+            await chat_app.post_turn.join()
+            print(f"{name:<8}p50 {times[len(times) // 2] * 1000:7.1f}ms  max {times[-1] * 1000:7.1f}ms  "
+                  f"判斷模型呼叫 {judge_calls} 次")
+            if message == "嗯嗯":
+                assert judge_calls == 0, "快速路徑不應呼叫判斷模型"
+        stats = pool.stats()
+        print(f"回覆池：{stats}")
+        assert stats["misses"] == 1, "同時進來的相同訊息應只產生一次回覆"
+        assert stats["hits"] == args.users, "回覆池有回覆後應直接命中"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="低資訊訊息快速路徑的延遲與命中率")
+    parser.add_argument("--users", type=int, default=8, help="同時送出相同訊息的使用者數")
+    parser.add_argument("--latency", type=float, default=0.2, help="假模型首字延遲（秒）")
+    args = parser.parse_args()
+
+    os.environ["LLM_BACKEND"] = "fake"
+    import config
+
+    tmp = tempfile.TemporaryDirectory()
+    config.DB_FILE = os.path.join(tmp.name, "fast.db")
+    config.FAKE_LLM_LATENCY = args.latency
+
+    import httpx
+    import app as chat_app
+    import tts.voicevox as voicevox
+    from tts_pipeline_test import FakeVoicevox
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeVoicevox)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    voicevox.tts.urls = [f"http://127.0.0.1:{server.server_port}"]
+
+    _judge_turn = chat_app.judge_turn
+    chat_app.judge_turn = counting_judge
+
+    asyncio.run(main())
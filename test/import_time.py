@@ -0,0 +1,61 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# 量測 import app 的時間，並確認 import 本身沒有連線資料庫、建立目錄或載入 langchain_ollama
+parser = argparse.ArgumentParser(description="量測 import app 的時間")
+parser.add_argument("--runs", type=int, default=3)
+parser.add_argument("--max-seconds", type=float, default=0, help="最快的一次超過此秒數時以非 0 結束")
+parser.add_argument("--top", type=int, default=10, help="列出自身耗時最多的幾個模組")
+
+PROBE = """
+import os, sys, json, time
+existed = {p: os.path.exists(p) for p in ("memory.db", "static/audio")}
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+created = [p for p, e in existed.items() if not e and os.path.exists(p)]
+print(json.dumps({"seconds": elapsed, "created": created, "ollama": "langchain_ollama" in sys.modules}))
+"""
+
+
+def probe() -> dict:
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_modules(top: int):
+    """-X importtime 的輸出中，自身耗時最多的模組。"""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                         cwd=ROOT, capture_output=True, text=True, check=True)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us), int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    args = parser.parse_args()
+    results = [probe() for _ in range(args.runs)]
+    best = min(r["seconds"] for r in results)
+    runs = ", ".join(f"{r['seconds']:.3f}" for r in results)
+    print(f"import app：最快 {best:.3f}s（{args.runs} 次：{runs}）")
+    for self_us, cumulative, name in slowest_modules(args.top):
+        print(f"  {self_us / 1000:8.1f}ms 自身  {cumulative / 1000:8.1f}ms 累計  {name}")
+
+    last = results[-1]
+    assert not last["created"], f"import 時建立了檔案或目錄：{last['created']}"
+    assert not last["ollama"], "import 時載入了 langchain_ollama，模型應延後到第一次使用才建立"
+    if args.max_seconds and best > args.max_seconds:
+        sys.exit(f"import app 超過 {args.max_seconds}s")
+
+
+if __name__ == "__main__":
+    main()
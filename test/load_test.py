@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+from http.server import ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+# 以假模型 + 假 VOICEVOX 對 /chat 施壓，不需要 GPU，可放在 CI 抓效能退步
+# 參數解析與載入 app 都在 __main__ 內，pytest 收集這個檔案時不會執行
+
+# ------------------ 各階段計時 ------------------
+
+STAGES = {
+    "build_turn_messages": "prompt",
+    "call_llm": "llm",
+    "judge_turn": "judge",
+    "store_facts": "memory",
+    "update_memory": "memory",
+    "apply_intimacy_change": "intimacy",
+    "update_intimacy": "intimacy",
+    "generate_tts": "tts",
+}
+stage_times = defaultdict(list)
+
+
+def timed(stage, func):
+    async def wrapper(*a, **kw):
+        start = time.perf_counter()
+        try:
+            return await func(*a, **kw)
+        finally:
+            stage_times[stage].append(time.perf_counter() - start)
+    return wrapper
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def user(n: int, latencies: list, errors: list):
+    transport = httpx.ASGITransport(app=chat_app.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        for t in range(args.turns):
+            start = time.perf_counter()
+            resp = await client.post("/chat", json={"message": f"我是第{n}位使用者，這是第{t}句話"})
+            latencies.append(time.perf_counter() - start)
+            if resp.status_code != 200 or not resp.json().get("reply"):
+                errors.append(resp.status_code)
+
+
+async def main():
+    latencies, errors = [], []
+    async with chat_app.app.router.lifespan_context(chat_app.app):
+        start = time.perf_counter()
+        await asyncio.gather(*(user(n, latencies, errors) for n in range(args.users)))
+        total = time.perf_counter() - start
+        await chat_app.post_turn.join()
+
+    requests = len(latencies)
+    print(f"{args.users} 位使用者 × {args.turns} 輪 = {requests} 次 /chat，錯誤 {len(errors)} 次")
+    print(f"延遲 p50 {percentile(latencies, 0.5):.3f}s  p95 {percentile(latencies, 0.95):.3f}s  "
+          f"p99 {percentile(latencies, 0.99):.3f}s")
+    print(f"吞吐 {requests / total:.2f} req/s（總時間 {total:.2f}s）")
+    print(f"{'階段':<10}{'次數':>6}{'平均':>10}{'p95':>10}{'合計':>10}")
+    for stage in ["prompt", "llm", "judge", "memory", "intimacy", "tts"]:
+        values = stage_times.get(stage)
+        if values:
+            print(f"{stage:<10}{len(values):>6}{sum(values) / len(values):>9.3f}s"
+                  f"{percentile(values, 0.95):>9.3f}s{sum(values):>9.2f}s")
+
+    server.shutdown()
+    if errors or (args.max_p95 and percentile(latencies, 0.95) > args.max_p95):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="模擬 N 位使用者同時對 /chat 對話")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=5, help="每位使用者的對話輪數")
+    parser.add_argument("--latency", type=float, default=0.2, help="假模型首字延遲（秒）")
+    parser.add_argument("--tps", type=float, default=50, help="假模型每秒 token 數")
+    parser.add_argument("--parallel", type=int, default=1, help="假模型同時處理的請求數")
+    parser.add_argument("--max-p95", type=float, default=0, help="p95 超過此秒數時以非 0 結束")
+    args = parser.parse_args()
+
+    os.environ["LLM_BACKEND"] = "fake"
+    import config
+
+    tmp = tempfile.TemporaryDirectory()
+    config.DB_FILE = os.path.join(tmp.name, "load.db")
+    config.FAKE_LLM_LATENCY = args.latency
+    config.FAKE_LLM_TOKENS_PER_SEC = args.tps
+    config.FAKE_LLM_PARALLEL = args.parallel
+
+    import httpx
+    import app as chat_app
+    import tts.voicevox as voicevox
+    from tts_pipeline_test import FakeVoicevox
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeVoicevox)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    voicevox.tts.urls = [f"http://127.0.0.1:{server.server_port}"]  # 引擎在第一次請求時才建立
+
+    for name, stage in STAGES.items():
+        setattr(chat_app, name, timed(stage, getattr(chat_app, name)))
+
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import multiprocessing as mp
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from config import DEFAULT_INTIMACY
+from memory.store import UserStore
+
+# 模擬多個 worker 行程同時更新同一位使用者，確認親密度與記憶都沒有遺失
+parser = argparse.ArgumentParser(description="多行程同時寫入 UserStore 的壓力測試")
+parser.add_argument("--procs", type=int, default=4)
+parser.add_argument("--updates", type=int, default=200, help="每個行程的親密度調整次數")
+parser.add_argument("--facts", type=int, default=50, help="每個行程新增的記憶筆數")
+
+USER = "shared-user"
+CLAMPED = "clamped-user"
+COMMON_FACTS = [f"他喜歡第{i}種貓" for i in range(10)]  # 每個行程都會寫入，應該只留一份
+
+
+async def worker(db_file: str, n: int, updates: int, facts: int, legacy: bool) -> None:
+    store = UserStore(db_file, flush_interval=0.001, max_facts=100000, shared=True)
+    for i in range(updates):
+        if legacy:
+            # 舊版 adjust_intimacy：讀出、計算、寫回，跨行程時會互相覆蓋
+            value = (await store.get(USER))["intimacy"]
+            await store.set_intimacy(USER, value + 1)
+        else:
+            await store.adjust_intimacy(USER, 1, -10**9, 10**9)
+            await store.adjust_intimacy(CLAMPED, 1, 0, 100)
+        if i < facts:
+            await store.add_fact(USER, f"第{n}個行程的第{i}件事")
+        if i < len(COMMON_FACTS):
+            await store.add_fact(USER, COMMON_FACTS[i])
+    await store.flush()
+    store.close()
+
+
+def run_worker(db_file: str, n: int, updates: int, facts: int, legacy: bool, start) -> None:
+    start.wait()  # 所有行程一起開始，製造最多的衝突
+    asyncio.run(worker(db_file, n, updates, facts, legacy))
+
+
+def run(db_file: str, args, legacy: bool) -> float:
+    ctx = mp.get_context("spawn")
+    start = ctx.Event()
+    procs = [
+        ctx.Process(target=run_worker, args=(db_file, n, args.updates, args.facts, legacy, start))
+        for n in range(args.procs)
+    ]
+    for p in procs:
+        p.start()
+    begin = time.perf_counter()
+    start.set()
+    for p in procs:
+        p.join()
+        assert p.exitcode == 0, f"worker 異常結束：{p.exitcode}"
+    return time.perf_counter() - begin
+
+
+async def check(db_file: str, cached: UserStore, args) -> None:
+    expected = DEFAULT_INTIMACY + args.procs * args.updates
+    expected_facts = args.procs * min(args.facts, args.updates) + min(len(COMMON_FACTS), args.updates)
+
+    fresh = UserStore(db_file, max_facts=100000, shared=True)
+    data = await fresh.get(USER)
+    assert data["intimacy"] == expected, f"親密度遺失更新：{data['intimacy']} != {expected}"
+    assert len(data["facts"]) == expected_facts, f"記憶數量不符：{len(data['facts'])} != {expected_facts}"
+    assert (await fresh.get(CLAMPED))["intimacy"] == 100, "親密度超出上限"
+    fresh.close()
+
+    # 測試開始前就快取了舊資料的行程，也要讀到其他行程寫入的結果
+    data = await cached.get(USER)
+    assert data["intimacy"] == expected and len(data["facts"]) == expected_facts, "shared 模式讀到過期快取"
+    print(f"親密度 {expected}、記憶 {expected_facts} 筆，沒有遺失任何更新")
+
+
+async def legacy_lost(db_file: str, args) -> int:
+    store = UserStore(db_file, shared=True)
+    value = (await store.get(USER))["intimacy"]
+    store.close()
+    return DEFAULT_INTIMACY + args.procs * args.updates - value
+
+
+def main():
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "stress.db")
+        cached = UserStore(db_file, max_facts=100000, shared=True)
+        asyncio.run(cached.get(USER))
+
+        elapsed = run(db_file, args, legacy=False)
+        total = args.procs * args.updates * 2
+        print(f"{args.procs} 個行程 × {args.updates} 次：{elapsed:.2f}s，{total / elapsed:,.0f} 次親密度更新/s")
+        asyncio.run(check(db_file, cached, args))
+        cached.close()
+
+        legacy_db = os.path.join(tmp, "legacy.db")
+        UserStore(legacy_db).close()
+        run(legacy_db, args, legacy=True)
+        lost = asyncio.run(legacy_lost(legacy_db, args))
+        print(f"對照：讀出再寫回的舊作法遺失 {lost} 次更新")
+
+
+if __name__ == "__main__":
+    main()
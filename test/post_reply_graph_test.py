@@ -0,0 +1,133 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+# 以假模型 + 假 VOICEVOX 確認回覆後的分支同時執行：總耗時接近最長的分支，而不是全部相加
+# 參數解析與載入 app 都在 __main__ 內，pytest 收集這個檔案時不會執行
+
+USER = "graph-test"
+MESSAGE = "我喜歡吃拉麵，今天好開心"
+REPLY = "好棒喔！主人開心我也開心～[emotion:joy]"
+
+
+def check(name, wall, branches, before=0.0):
+    """before 為分支開始前必經的耗時（例如 /chat 的 LLM 回覆）。"""
+    longest, total = before + max(branches.values()), before + sum(branches.values())
+    detail = "  ".join(f"{k} {v:.2f}s" for k, v in branches.items())
+    prefix = f"前置 {before:.2f}s + " if before else ""
+    print(f"{name:<22}總耗時 {wall:.2f}s  最長路徑 {longest:.2f}s  相加 {total:.2f}s  （{prefix}{detail}）")
+    assert wall < longest + args.tolerance, f"{name} 的總耗時應接近最長路徑"
+
+
+async def timed_call(coro):
+    start = time.perf_counter()
+    result = await coro
+    return result, time.perf_counter() - start
+
+
+async def graph_only():
+    """純依賴圖：a → c 與 b 兩條路徑。"""
+    async def sleep(seconds, value=None):
+        await asyncio.sleep(seconds)
+        return value
+
+    start = time.perf_counter()
+    results = await run_graph([
+        Node("a", lambda _: sleep(0.3, 1)),
+        Node("b", lambda _: sleep(0.6, 2)),
+        Node("c", lambda r: sleep(0.2, r["a"] + 10), deps=("a",)),
+        Node("slow", lambda _: sleep(5), timeout=0.1, fallback=lambda _: "fallback"),
+    ])
+    assert results == {"a": 1, "b": 2, "c": 11, "slow": "fallback"}, results
+    check("依賴圖（sleep）", time.perf_counter() - start, {"a→c": 0.5, "b": 0.6, "slow（逾時）": 0.1})
+
+
+async def separate_branches():
+    """separate 模式：記憶與親密度各一次 LLM 呼叫，同時進行。"""
+    chat_app.JUDGE_MODE = "separate"
+    _, memory = await timed_call(chat_app.update_memory(USER, MESSAGE))
+    _, intimacy = await timed_call(chat_app.update_intimacy(USER, MESSAGE, REPLY))
+    _, wall = await timed_call(chat_app.post_process_turn(USER, MESSAGE, REPLY))
+    check("記憶 ‖ 親密度", wall, {"memory": memory, "intimacy": intimacy})
+
+
+async def slow_judge():
+    """裁判很慢時：/chat 的語音不受影響，親密度最多等 POSTPROCESS_CHAT_TIMEOUT；裁判逾時則改用規則判斷。"""
+    chat_app.JUDGE_MODE = "combined"
+    judge_turn = chat_app.judge_turn
+    chat_timeout = chat_app.POSTPROCESS_CHAT_TIMEOUT
+    chat_app.POSTPROCESS_CHAT_TIMEOUT = wait = 0.3
+
+    async def slow(*a, **kw):
+        await asyncio.sleep(args.judge_delay)
+        return await judge_turn(*a, **kw)
+    chat_app.judge_turn = slow
+
+    _, tts = await timed_call(chat_app.generate_tts(REPLY + "。"))
+    _, record = await timed_call(chat_app.record_turn(USER, MESSAGE, REPLY))
+    async with chat_app.app.router.lifespan_context(chat_app.app):
+        transport = httpx.ASGITransport(app=chat_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+            start = time.perf_counter()
+            r = await client.post("/chat", json={"message": "今天好冷，想吃火鍋"})
+            wall = time.perf_counter() - start
+            assert r.json()["audio_url"], "應附上語音"
+            assert r.json()["intimacy_pending"], "裁判超過等待時間時應標示 intimacy_pending"
+            _, llm = await timed_call(chat_app.call_llm([chat_app.HumanMessage(content="你好")]))
+            # 裁判在背景佇列執行，/chat 只多等有上限的親密度結果
+            check("/chat（慢裁判在背景）", wall, {"tts": tts, "record→等親密度": record + wait}, before=llm)
+    chat_app.POSTPROCESS_CHAT_TIMEOUT = chat_timeout
+
+    saved = dict(chat_app.POST_REPLY_TIMEOUTS)
+    chat_app.POST_REPLY_TIMEOUTS["judge"] = 0.3
+    try:
+        result, wall = await timed_call(chat_app.post_process_turn(USER, MESSAGE, REPLY))
+    finally:
+        chat_app.POST_REPLY_TIMEOUTS.update(saved)
+        chat_app.judge_turn = judge_turn
+    print(f"裁判逾時（0.3s）       總耗時 {wall:.2f}s，改用規則判斷：親密度 {result[0]}，變化 {result[1]:+d}")
+    assert wall < args.judge_delay, "裁判逾時後不應再等它"
+
+
+async def main():
+    await graph_only()
+    await separate_branches()
+    await slow_judge()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="回覆後依賴圖的總耗時")
+    parser.add_argument("--judge-delay", type=float, default=1.5, help="假裁判的耗時（秒）")
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="假模型首字延遲（秒）")
+    parser.add_argument("--tolerance", type=float, default=0.35, help="允許比最長分支多出的秒數")
+    args = parser.parse_args()
+
+    os.environ["LLM_BACKEND"] = "fake"
+    import config
+
+    tmp = tempfile.TemporaryDirectory()
+    config.DB_FILE = os.path.join(tmp.name, "graph.db")
+    config.WARMUP = False
+    config.FAST_PATH = False
+    config.FAKE_LLM_LATENCY = args.llm_latency
+    config.FAKE_LLM_PARALLEL = 2
+    config.LLM_PARALLEL = 2  # 記憶與親密度兩條 LLM 分支要能同時送出
+
+    import httpx
+    import app as chat_app
+    import tts.voicevox as voicevox
+    from utils.taskgraph import Node, run_graph
+    from tts_pipeline_test import FakeVoicevox
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeVoicevox)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    voicevox.tts.urls = [f"http://127.0.0.1:{server.server_port}"]
+
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from memory.store import UserStore
+from memory.retrieval import MemoryRetriever, HashingEmbedder
+
+# 單一使用者 10k 筆記憶時，每輪取 top-k 的延遲
+FACTS = int(os.environ.get("BENCH_FACTS", 10000))
+QUERIES = 200
+TOP_K = 8
+
+SUBJECTS = ["貓", "狗", "咖啡", "拉麵", "爬山", "鋼琴", "程式", "電影", "台北", "東京", "動漫", "游泳"]
+VERBS = ["喜歡", "討厭", "常常想到", "最近在學", "小時候很愛", "想去"]
+
+
+def make_fact(i: int) -> str:
+    rnd = random.Random(i)
+    return f"他{rnd.choice(VERBS)}{rnd.choice(SUBJECTS)}（第{i}件事）"
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = UserStore(os.path.join(tmp, "bench.db"), max_facts=FACTS)
+        retriever = MemoryRetriever(store, HashingEmbedder())
+
+        start = time.perf_counter()
+        for i in range(FACTS):
+            await retriever.add_fact("bench", make_fact(i))
+        await store.flush()
+        retriever.forget("bench")
+        print(f"寫入 {FACTS} 筆記憶：{time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        await retriever.top_k("bench", "我喜歡貓", TOP_K)
+        print(f"首次載入索引：{(time.perf_counter() - start) * 1000:.1f}ms")
+
+        latencies = []
+        for q in range(QUERIES):
+            query = f"你{VERBS[q % len(VERBS)]}{SUBJECTS[q % len(SUBJECTS)]}嗎"
+            start = time.perf_counter()
+            await retriever.top_k("bench", query, TOP_K)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+        print(f"top-{TOP_K} 查詢（{QUERIES} 次）：p50 {p50:.2f}ms，p99 {p99:.2f}ms")
+        print(await retriever.top_k("bench", "我喜歡貓", TOP_K))
+        store.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import sqlite3
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from memory.store import UserStore
+
+# 模擬一輪對話對資料庫的存取：
+# generate_system_prompt 讀 2 次、3 筆記憶 append、update_intimacy 讀 1 次 + adjust_intimacy
+USERS = int(os.environ.get("BENCH_USERS", 50))
+TURNS = int(os.environ.get("BENCH_TURNS", 10))
+FACTS_PER_TURN = 3
+
+
+# ------------------ 舊版：每次呼叫重新 connect + 全域鎖 ------------------
+
+class LegacyStore:
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.lock = asyncio.Lock()
+        conn = sqlite3.connect(db_file)
+        conn.execute("CREATE TABLE IF NOT EXISTS user_memory (user_id TEXT PRIMARY KEY, facts TEXT, intimacy INTEGER)")
+        conn.commit()
+        conn.close()
+
+    async def get(self, user_id):
+        async with self.lock:
+            def _get():
+                conn = sqlite3.connect(self.db_file)
+                row = conn.execute("SELECT facts, intimacy FROM user_memory WHERE user_id = ?", (user_id,)).fetchone()
+                conn.close()
+                if row:
+                    return {"facts": json.loads(row[0]) if row[0] else [], "intimacy": row[1]}
+                return {"facts": [], "intimacy": 50}
+            return await asyncio.to_thread(_get)
+
+    async def set(self, user_id, data):
+        async with self.lock:
+            def _set():
+                conn = sqlite3.connect(self.db_file)
+                conn.execute("""
+                    INSERT INTO user_memory (user_id, facts, intimacy) VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET facts=excluded.facts, intimacy=excluded.intimacy
+                """, (user_id, json.dumps(data["facts"], ensure_ascii=False), data["intimacy"]))
+                conn.commit()
+                conn.close()
+            await asyncio.to_thread(_set)
+
+    async def add_fact(self, user_id, fact):
+        data = await self.get(user_id)
+        if fact not in data["facts"]:
+            data["facts"].append(fact)
+            await self.set(user_id, data)
+
+    async def set_intimacy(self, user_id, value):
+        data = await self.get(user_id)
+        data["intimacy"] = value
+        await self.set(user_id, data)
+
+    def lock_for(self, user_id):
+        return _NullLock()
+
+    async def flush(self):
+        pass
+
+
+class _NullLock:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class NewStore:
+    def __init__(self, db_file):
+        self.store = UserStore(db_file)
+
+    async def get(self, user_id):
+        return await self.store.get(user_id)
+
+    async def add_fact(self, user_id, fact):
+        await self.store.add_fact(user_id, fact)
+
+    async def set_intimacy(self, user_id, value):
+        await self.store.set_intimacy(user_id, value)
+
+    def lock_for(self, user_id):
+        return self.store.lock(user_id)
+
+    async def flush(self):
+        await self.store.flush()
+
+
+async def one_turn(store, user_id, turn):
+    await store.get(user_id)
+    await store.get(user_id)
+    for i in range(FACTS_PER_TURN):
+        await store.add_fact(user_id, f"第{turn}輪的記憶{i}")
+    await store.get(user_id)
+    async with store.lock_for(user_id):
+        data = await store.get(user_id)
+        await store.set_intimacy(user_id, min(100, data["intimacy"] + 1))
+
+
+async def run(store):
+    async def user(u):
+        for t in range(TURNS):
+            await one_turn(store, f"user-{u}", t)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(u) for u in range(USERS)))
+    await store.flush()
+    return time.perf_counter() - start
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = await run(LegacyStore(os.path.join(tmp, "legacy.db")))
+        new = await run(NewStore(os.path.join(tmp, "new.db")))
+    turns = USERS * TURNS
+    print(f"{USERS} 位使用者 x {TURNS} 輪")
+    print(f"舊版（connect + 全域鎖）：{legacy:.3f}s，{turns / legacy:.1f} 輪/秒")
+    print(f"UserStore（WAL + 快取）：{new:.3f}s，{turns / new:.1f} 輪/秒")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,103 @@
+import os
+import re
+import sys
+import time
+import random
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.text_analysis import analyzer
+
+# LLM 裁判被降級時每則訊息都會走規則判斷，目標是單核 10k 則/秒以上
+MESSAGES = int(os.environ.get("BENCH_MESSAGES", 10000))
+TARGET_PER_SEC = 10000
+
+SAMPLES = [
+    "我叫小明，我今天好累喔",
+    "我喜歡貓咪，也喜歡你！謝謝你一直陪我",
+    "我今年25歲，我住在台北，我是工程師",
+    "嗯",
+    "你好煩喔，走開啦",
+    "我覺得今天的拉麵很好吃",
+    "今天天氣不錯，想出去走走，但是又有點懶得動，你覺得呢？",
+    "好棒！抱抱～[emotion:cute]",
+    "主人今天也辛苦了～要記得休息喔。[emotion:joy]",
+]
+
+# 一般聊天紀錄：多數訊息不含任何規則關鍵字，短句和日常對話居多
+CHAT = [
+    "早安",
+    "嗯嗯",
+    "哈哈哈哈",
+    "剛下班，捷運超擠的",
+    "晚餐吃了咖哩飯",
+    "明天要開會，有點緊張",
+    "你在做什麼？",
+    "週末想去看電影",
+    "這首歌好好聽",
+    "等一下要去洗澡",
+    "下雨了，忘記帶傘",
+    "我喜歡你",
+    "今天加班到十點",
+    "晚安～",
+]
+
+
+def legacy(text: str):
+    """舊版 utils/regex.py：每條規則各自 re.search / in 掃描一次。"""
+    facts = []
+    for pattern, template in [
+        (r"(我叫|我的名字是)(\w+)", "他的名字是{}"), (r"我喜歡(\w+)", "他喜歡{}"),
+        (r"我討厭(\w+)", "他討厭{}"), (r"我.*?(\d{1,3})\s*歲", "他{}歲"),
+        (r"我住在(\w+)", "他住在{}"),
+    ]:
+        m = re.search(pattern, text)
+        if m:
+            facts.append(template.format(m.group(m.lastindex)))
+    if "我是" in text:
+        facts += [f"他是{job}" for job in ["老師", "學生", "工程師", "設計師"] if job in text]
+    m = re.search(r"我覺得(\w+)", text)
+    if m:
+        facts.append(f"他覺得{m.group(1)}")
+    if "我今天" in text:
+        facts += [f"他今天{emo}" for emo in ["開心", "難過", "累", "生氣", "放鬆"] if emo in text]
+    change = 1 if re.search(r"(謝謝|喜歡你|愛你|太棒|好棒|可愛|真貼心|抱抱|想你)", text) else (
+        -1 if re.search(r"(不喜歡你|討厭你|爛|閉嘴|走開|煩|生氣|滾)", text) else 0)
+    tags = re.findall(r"\[emotion:(\w+)\]", text, flags=re.I)
+    clean = re.sub(r"\[emotion:\w+\]", "", text).strip()
+    return facts, change, tags[-1].lower() if tags else None, clean
+
+
+def bench(name: str, func, messages) -> float:
+    start = time.perf_counter()
+    for text in messages:
+        func(text)
+    elapsed = time.perf_counter() - start
+    rate = len(messages) / elapsed
+    print(f"{name:<8} {len(messages)} 則：{elapsed * 1000:.1f}ms，每則 {elapsed / len(messages) * 1e6:.2f}µs，{rate:,.0f} 則/s")
+    return rate
+
+
+def main():
+    rnd = random.Random(0)
+    for text in SAMPLES + CHAT:
+        a = analyzer.analyze(text)
+        facts, change, emotion, clean = legacy(text)
+        assert (list(a.facts), a.intimacy_change, a.emotion, a.clean_text) == (facts, change, emotion, clean), text
+
+    for title, corpus in [("規則密集的樣本", SAMPLES), ("一般聊天紀錄", CHAT)]:
+        # 加上編號避免結果全部被 lru_cache 命中，量的是實際掃描成本
+        messages = [f"{rnd.choice(corpus)}（{i}）" for i in range(MESSAGES)]
+        print(f"== {title} ==")
+        # 兩邊交錯各跑三次取最快的一次，減少機器負載忽高忽低的影響
+        old = new = 0.0
+        for _ in range(3):
+            old = max(old, bench("逐條規則", legacy, messages))
+            new = max(new, bench("一次掃描", analyzer.analyze, messages))
+        print(f"一次掃描 / 逐條規則 吞吐比：{new / old:.2f}x（新版同時輸出去標籤文字與命中關鍵字）")
+        assert new >= TARGET_PER_SEC, f"低於 {TARGET_PER_SEC} 則/s"
+        assert new > old, "一次掃描沒有比逐條規則快"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import asyncio
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from tts.cache import TranslationCache
+from tts.translation import LLMTranslator, ITEM
+
+# 假 LLM：每次呼叫固定 BASE_DELAY 秒（prompt 處理與載入），每多翻一句再加 PER_ITEM_DELAY 秒
+BASE_DELAY = 0.15
+PER_ITEM_DELAY = 0.02
+SENTENCES = 32
+
+
+class FakeResult:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class FakeLLM:
+    def __init__(self):
+        self.calls = 0
+        self.busy = asyncio.Lock()  # 模擬單一 GPU：同一時間只處理一個請求
+
+    async def ainvoke(self, messages):
+        prompt = messages[-1].content
+        items = ITEM.findall(prompt)
+        async with self.busy:
+            self.calls += 1
+            await asyncio.sleep(BASE_DELAY + PER_ITEM_DELAY * max(1, len(items)))
+        if items:
+            return FakeResult("\n".join(f"<{i}> JA:{t}" for i, t in items))
+        text = prompt.split("「", 1)[1].rsplit("」", 1)[0]
+        return FakeResult(f"JA:{text}")
+
+
+async def run(translator: LLMTranslator, texts):
+    latencies = []
+
+    async def _one(text):
+        start = time.perf_counter()
+        result = await translator.translate(text)
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(_one(t) for t in texts))
+    total = time.perf_counter() - start
+    latencies.sort()
+    return results, total, latencies[len(latencies) // 2], latencies[-1]
+
+
+def report(name: str, llm: FakeLLM, total: float, p50: float, worst: float):
+    print(f"{name:<10} LLM 呼叫 {llm.calls:>2} 次，總時間 {total:.2f}s，"
+          f"吞吐 {SENTENCES / total:5.1f} 句/s，延遲 p50 {p50 * 1000:.0f}ms / max {worst * 1000:.0f}ms")
+
+
+async def main():
+    texts = [f"主人今天也辛苦了，這是第{i}句話" for i in range(SENTENCES)]
+    expected = [f"JA:{t}" for t in texts]
+
+    llm = FakeLLM()
+    single = LLMTranslator(llm, TranslationCache(), window=0, max_batch=1, passthrough_ratio=0)
+    results, total, p50, worst = await run(single, texts)
+    assert results == expected
+    report("逐句", llm, total, p50, worst)
+
+    llm = FakeLLM()
+    batched = LLMTranslator(llm, TranslationCache(), window=0.03, max_batch=8)
+    results, total, p50, worst = await run(batched, texts)
+    assert results == expected, "批次輸出與輸入對不上"
+    report("批次", llm, total, p50, worst)
+
+    calls = llm.calls
+    results, total, p50, worst = await run(batched, texts)
+    assert results == expected and llm.calls == calls, "快取未命中"
+    report("快取", llm, total, p50, worst)
+
+    japanese = ["ご主人様、今日もお疲れさまでした！", "ずっとそばにいるからね～"]
+    assert [await batched.translate(t) for t in japanese] == japanese and llm.calls == calls
+    print(f"統計：{batched.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
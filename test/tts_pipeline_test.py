@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+# 本地假 VOICEVOX：每次 synthesis 花 SYNTH_DELAY 秒，回傳內容帶上原文方便檢查順序
+SYNTH_DELAY = 0.3
+
+
+class FakeVoicevox(BaseHTTPRequestHandler):
+    synth_calls = 0
+
+    def do_GET(self):
+        payload = json.dumps("fake-0.0.1").encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if url.path == "/audio_query":
+            text = parse_qs(url.query)["text"][0]
+            payload = json.dumps({"kana": text}).encode("utf-8")
+            content_type = "application/json"
+        elif url.path == "/synthesis":
+            FakeVoicevox.synth_calls += 1
+            time.sleep(SYNTH_DELAY)
+            payload = b"RIFF" + json.loads(body)["kana"].encode("utf-8")
+            content_type = "audio/wav"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+async def main():
+    import tts.voicevox as voicevox
+    from tts.cache import DiskAudioCache
+    from tts.voicevox_client import VoicevoxClient
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeVoicevox)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        voicevox.tts = VoicevoxClient([f"http://127.0.0.1:{server.server_port}"])
+        voicevox.audio_cache = DiskAudioCache(tmp, max_bytes=1 << 20, max_files=100)
+        voicevox.TRANSLATE = False
+
+        text = "好欸～主人今天也很努力呢！要不要休息一下？我會一直陪著你的喔～[emotion:cute]"
+        sentences = voicevox.split_sentences(voicevox.strip_emotion_tags(text))
+        # 第一個 HTTP 請求會載入 httpcore / anyio（約 0.3 秒），伺服器啟動時由暖機處理，這裡先排除
+        await voicevox.get_engine_version()
+
+        start = time.perf_counter()
+        first = None
+        urls = []
+        async for url in voicevox.synthesize_chunks(text, parallel=2):
+            if first is None:
+                first = time.perf_counter() - start
+            urls.append(url)
+        total = time.perf_counter() - start
+
+        spoken = []
+        for url in urls:
+            with open(os.path.join(tmp, os.path.basename(url)), "rb") as f:
+                spoken.append(f.read()[4:].decode("utf-8"))
+
+        # 同一段回覆第二次應該全部命中快取，不再呼叫 VOICEVOX
+        calls = FakeVoicevox.synth_calls
+        cached = await voicevox.synthesize_playlist(text)
+        assert cached == urls and FakeVoicevox.synth_calls == calls, "快取未命中"
+
+        await voicevox.tts.aclose()
+
+    server.shutdown()
+    assert spoken == sentences, (spoken, sentences)
+    assert first < SYNTH_DELAY * 2, f"第一句等太久：{first:.2f}s"
+    assert total < SYNTH_DELAY * len(sentences), f"沒有並行合成：{total:.2f}s"
+    print(f"{len(sentences)} 句，第一句 {first:.2f}s 可播放，全部 {total:.2f}s（逐句序列約 {SYNTH_DELAY * len(sentences):.2f}s）")
+    print(f"快取：{voicevox.audio_cache.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
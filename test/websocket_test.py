@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+# 以假模型 + 假 VOICEVOX 走一輪 /ws，確認事件順序，並比較親密度在 /chat_stream 與 /ws 送達的時間
+# 參數解析與載入 app 都在 __main__ 內，pytest 收集這個檔案時不會執行
+
+MESSAGE = "我今天在公司被主管罵了，好難過"
+
+
+def stream_turn(client):
+    """回傳 (事件種類, 親密度送達秒數, 整輪秒數)。"""
+    start = time.perf_counter()
+    kinds, intimacy_at = [], None
+    with client.stream("POST", "/chat_stream", json={"message": MESSAGE}) as r:
+        for line in r.iter_lines():
+            if not line:
+                continue
+            kinds.append(json.loads(line)["type"])
+            if kinds[-1] == "intimacy":
+                intimacy_at = time.perf_counter() - start
+    return kinds, intimacy_at, time.perf_counter() - start
+
+
+def socket_turn(ws, turn_id):
+    start = time.perf_counter()
+    ws.send_json({"type": "chat", "id": turn_id, "message": MESSAGE})
+    kinds, intimacy_at, done_at = [], None, None
+    while intimacy_at is None or done_at is None:
+        event = ws.receive_json()
+        assert event.get("id") == turn_id, event
+        kinds.append(event["type"])
+        if event["type"] == "intimacy":
+            intimacy_at = time.perf_counter() - start
+        elif event["type"] == "done":
+            done_at = time.perf_counter() - start
+    return kinds, intimacy_at, done_at
+
+
+def compact(kinds):
+    return [k for i, k in enumerate(kinds) if i == 0 or kinds[i - 1] != k]
+
+
+def main():
+    with TestClient(chat_app.app) as client:
+        try:
+            with client.websocket_connect("/ws") as ws:
+                ws.receive_json()
+            raise AssertionError("沒有 session 時應拒絕連線")
+        except WebSocketDisconnect as e:
+            assert e.code == CLOSE_NO_SESSION, e.code
+
+        client.get("/get_intimacy")  # 取得 session cookie
+        http = [stream_turn(client) for _ in range(args.turns)]
+        with client.websocket_connect("/ws") as ws:
+            assert ws.receive_json()["type"] == "hello"
+            ws.send_json({"type": "chat", "id": 0, "message": MESSAGE})
+            ws.send_json({"type": "chat", "id": -1, "message": MESSAGE})
+            busy = ws.receive_json()
+            assert busy == {"type": "error", "code": "busy", "id": -1}, busy
+            while ws.receive_json().get("type") != "done":
+                pass
+            while ws.receive_json().get("type") != "intimacy":
+                pass
+            sockets = [socket_turn(ws, i + 1) for i in range(args.turns)]
+
+    print(f"/chat_stream 事件：{compact(http[0][0])}")
+    print(f"/ws 事件：        {compact(sockets[0][0])}")
+    for name, runs in (("/chat_stream", http), ("/ws", sockets)):
+        intimacy = sorted(r[1] for r in runs)[len(runs) // 2]
+        total = sorted(r[2] for r in runs)[len(runs) // 2]
+        print(f"{name:<13}親密度送達 p50 {intimacy * 1000:7.1f}ms  整輪 p50 {total * 1000:7.1f}ms")
+    assert "emotion" in sockets[0][0], "應推送情緒事件"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WebSocket 推送通道的事件與延遲")
+    parser.add_argument("--turns", type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ["LLM_BACKEND"] = "fake"
+    import config
+
+    tmp = tempfile.TemporaryDirectory()
+    config.DB_FILE = os.path.join(tmp.name, "ws.db")
+    config.WARMUP = False
+
+    import app as chat_app
+    import tts.voicevox as voicevox
+    from starlette.testclient import TestClient
+    from starlette.websockets import WebSocketDisconnect
+    from utils.push import CLOSE_NO_SESSION
+    from tts_pipeline_test import FakeVoicevox
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeVoicevox)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    voicevox.tts.urls = [f"http://127.0.0.1:{server.server_port}"]
+
+    main()
@@ -0,0 +1,247 @@
+import os
+import re
+import tempfile
+import threading
+import time
+import asyncio
+import hashlib
+import logging
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from utils.file_cleanup import DiskLRU
+
+logger = logging.getLogger("app")
+
+
+def normalize_tts_text(text: str) -> str:
+    """去掉情緒標籤、全半形與多餘空白，讓相同台詞得到相同的快取鍵。"""
+    text = re.sub(r"\[emotion:\w+\]", "", text, flags=re.I)
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split())
+
+
+MEDIA_TYPES = {"wav": "audio/wav", "ogg": "audio/ogg"}
+
+
+class AudioCache:
+    """以 (正規化文字, speaker, 是否翻譯, 引擎版本, 輸出格式) 為鍵的語音快取。
+
+    命中時直接回傳既有音檔的網址，同時略過翻譯與 VOICEVOX。
+    lookup / store 為 coroutine：磁碟上的淘汰與跨行程的檔案鎖都在執行緒中進行，不會卡住 event loop。
+    實際存放位置由子類別決定：DiskAudioCache 或 MemoryAudioCache。
+    轉檔失敗時音檔會以實際格式（WAV）存放，鍵、副檔名與 media type 都跟著實際格式。
+    """
+
+    def __init__(self, fmt: str = "wav"):
+        self.format = fmt
+        self.media_type = MEDIA_TYPES.get(fmt, "application/octet-stream")
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text: str, speaker_id: int, translate: bool, engine_version: str,
+            fmt: Optional[str] = None) -> str:
+        raw = "\x1f".join([
+            normalize_tts_text(text), str(speaker_id), "1" if translate else "0", engine_version, fmt or self.format,
+        ])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+    def filename(self, key: str, fmt: Optional[str] = None) -> str:
+        return f"{key}.{fmt or self.format}"
+
+    async def lookup(self, key: str) -> Optional[str]:
+        if await self._touch(key):
+            self.hits += 1
+            return self.url(key)
+        self.misses += 1
+        return None
+
+    def url(self, key: str, fmt: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+    async def _touch(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def store(self, key: str, data: bytes, fmt: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+class DiskAudioCache(AudioCache):
+    """音檔寫在 static/audio，檔名就是快取鍵，容量由 DiskLRU 以 LRU 淘汰。
+
+    多個 worker 共用目錄時設 shared=True：淘汰在行程間協調，且 grace 秒內用過的音檔不會被刪。
+    """
+
+    def __init__(self, audio_dir: str, max_bytes: int, max_files: int, fmt: str = "wav",
+                 url_prefix: str = "/static/audio", shared: bool = False, grace: float = 0.0):
+        super().__init__(fmt)
+        self.audio_dir = audio_dir
+        self.url_prefix = url_prefix.rstrip("/")
+        # 轉檔失敗時存成 .wav，也要納入同一個 LRU
+        self._lru_args = dict(max_bytes=max_bytes, max_files=max_files, suffix=(f".{fmt}", ".wav"),
+                             shared=shared, grace=grace)
+        self._lru: Optional[DiskLRU] = None
+        self._lru_lock = threading.Lock()
+
+    @property
+    def lru(self) -> DiskLRU:
+        """第一次使用時才掃描目錄，import 時不碰檔案系統。"""
+        if self._lru is None:
+            with self._lru_lock:
+                if self._lru is None:
+                    self._lru = DiskLRU(self.audio_dir, **self._lru_args)
+        return self._lru
+
+    async def _ready_lru(self) -> DiskLRU:
+        # 掃描目錄是阻塞的檔案系統操作，第一次使用時放到執行緒
+        return self._lru if self._lru is not None else await asyncio.to_thread(lambda: self.lru)
+
+    def url(self, key: str, fmt: Optional[str] = None) -> str:
+        return f"{self.url_prefix}/{self.filename(key, fmt)}"
+
+    async def _touch(self, key: str) -> bool:
+        lru = await self._ready_lru()
+        if lru.shared:
+            # shared 模式會 os.utime 更新磁碟上的 mtime
+            return await asyncio.to_thread(lru.touch, self.filename(key))
+        return lru.touch(self.filename(key))
+
+    async def store(self, key: str, data: bytes, fmt: Optional[str] = None) -> str:
+        lru = await self._ready_lru()  # 確保目錄已建立
+        name = self.filename(key, fmt)
+        filepath = os.path.join(self.audio_dir, name)
+
+        # 先寫暫存檔再改名，避免前端讀到寫到一半的檔案；暫存檔名每次不同，多個 worker 同時寫同一個鍵也不會互相覆蓋
+        def _write():
+            fd, tmp = tempfile.mkstemp(dir=self.audio_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, filepath)
+            except BaseException:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+            # 淘汰會刪檔，shared 模式還要取得目錄鎖並重新掃描，和寫檔一起留在執行緒裡
+            lru.add(name, len(data))
+        await asyncio.to_thread(_write)
+        return self.url(key, fmt)
+
+    def stats(self) -> Dict[str, float]:
+        return {**super().stats(), **self.lru.stats()}
+
+
+class MemoryAudioCache(AudioCache):
+    """音檔只放在記憶體，由 /audio/<key> 直接回傳，每輪不寫磁碟也不掃目錄。
+
+    總容量超過 max_bytes 時淘汰最久未用的音檔，超過 ttl 秒未使用的也會被移除。
+    注意：多個 worker 行程之間不共用，僅適合單一行程或有 sticky session 的部署。
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, fmt: str = "wav", url_prefix: str = "/audio"):
+        super().__init__(fmt)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.url_prefix = url_prefix.rstrip("/")
+        self._clips: "OrderedDict[str, Tuple[bytes, float, str]]" = OrderedDict()  # 音檔, 最後使用時間, media type
+        self._bytes = 0
+        self.evictions = 0
+
+    def url(self, key: str, fmt: Optional[str] = None) -> str:
+        return f"{self.url_prefix}/{key}"
+
+    async def _touch(self, key: str) -> bool:
+        return self._use(key)
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self._clips:
+            key, (data, last_used, _) = next(iter(self._clips.items()))
+            if now - last_used <= self.ttl and self._bytes <= self.max_bytes:
+                break
+            del self._clips[key]
+            self._bytes -= len(data)
+            self.evictions += 1
+
+    def _use(self, key: str) -> bool:
+        self._expire()
+        clip = self._clips.get(key)
+        if clip is None:
+            return False
+        self._clips[key] = (clip[0], time.monotonic(), clip[2])
+        self._clips.move_to_end(key)
+        return True
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """回傳 (音檔, media type)，不存在時回傳 None。"""
+        if not self._use(key):
+            return None
+        data, _, media_type = self._clips[key]
+        return data, media_type
+
+    async def store(self, key: str, data: bytes, fmt: Optional[str] = None) -> str:
+        old = self._clips.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old[0])
+        self._clips[key] = (data, time.monotonic(), MEDIA_TYPES.get(fmt or self.format, self.media_type))
+        self._bytes += len(data)
+        self._expire()
+        return self.url(key)
+
+    def stats(self) -> Dict[str, float]:
+        return {**super().stats(), "files": len(self._clips), "bytes": self._bytes, "evictions": self.evictions}
+
+
+def build_audio_cache(backend: str, audio_dir: str, max_bytes: int, max_files: int,
+                      memory_max_bytes: int, ttl: float, fmt: str,
+                      shared: bool = False, grace: float = 0.0) -> AudioCache:
+    if backend == "memory":
+        return MemoryAudioCache(memory_max_bytes, ttl, fmt)
+    return DiskAudioCache(audio_dir, max_bytes, max_files, fmt, shared=shared, grace=grace)
+
+
+class TranslationCache:
+    """翻譯結果的記憶體 LRU，鍵為正規化後的原文與語氣設定。"""
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[str, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(text: str, role_style: str) -> str:
+        return f"{role_style}\x1f{normalize_tts_text(text)}"
+
+    def get(self, text: str, role_style: str) -> Optional[str]:
+        key = self._key(text, role_style)
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, text: str, role_style: str, translated: str) -> None:
+        key = self._key(text, role_style)
+        self._data[key] = translated
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._data),
+        }
@@ -0,0 +1,35 @@
+import shutil
+import asyncio
+import logging
+from typing import Tuple
+
+from utils.metrics import span
+
+logger = logging.getLogger("app")
+
+
+def resolve_audio_format(fmt: str) -> str:
+    """輸出 ogg（Opus）需要系統上有 ffmpeg，沒有就退回 wav。"""
+    if fmt == "ogg" and shutil.which("ffmpeg") is None:
+        logger.warning("找不到 ffmpeg，語音改以 WAV 輸出")
+        return "wav"
+    return fmt if fmt in ("wav", "ogg") else "wav"
+
+
+async def encode_audio(wav: bytes, fmt: str, bitrate: str = "32k") -> Tuple[bytes, str]:
+    """把 VOICEVOX 的 WAV 轉成 fmt（目前只有 "ogg"），回傳 (音檔, 實際格式)；轉檔失敗時原樣回傳 WAV。"""
+    ffmpeg = shutil.which("ffmpeg")
+    if fmt != "ogg" or ffmpeg is None:
+        return wav, "wav"
+    with span("audio_encode"):
+        proc = await asyncio.create_subprocess_exec(
+            ffmpeg, "-hide_banner", "-loglevel", "error",
+            "-f", "wav", "-i", "pipe:0",
+            "-c:a", "libopus", "-b:a", bitrate, "-f", "ogg", "pipe:1",
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        )
+        out, err = await proc.communicate(wav)
+    if proc.returncode != 0 or not out:
+        logger.error(f"Opus 轉檔失敗，改存 WAV：{err.decode('utf-8', 'ignore')[:200]}")
+        return wav, "wav"
+    return out, "ogg"
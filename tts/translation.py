@@ -1,20 +1,176 @@
-import re, asyncio
-from langchain_ollama import ChatOllama
-from langchain.schema import HumanMessage
-chat_model = ChatOllama(model="gemma3")
-
-async def translate_to_japanese(text: str, role_style: str = "可愛、撒嬌語氣") -> str:
-    if not text.strip():
-        return ""
-    
-    prompt = f"""
+import re
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.messages import HumanMessage
+from tts.cache import TranslationCache
+from utils.metrics import span, record_llm_tokens
+
+logger = logging.getLogger("app")
+
+KANA = re.compile(r"[\u3040-\u30ff]")
+LETTERS = re.compile(r"[\u3040-\u30ff\u4e00-\u9fff\w]")
+ITEM = re.compile(r"^\s*<(\d+)>\s*(.*?)\s*$", re.M)
+
+
+def kana_ratio(text: str) -> float:
+    """平假名/片假名佔所有文字的比例，中文回覆接近 0，日文通常 > 0.3。"""
+    letters = LETTERS.findall(text)
+    if not letters:
+        return 0.0
+    return len(KANA.findall(text)) / len(letters)
+
+
+def single_prompt(text: str, role_style: str) -> str:
+    return f"""
 請將以下中文翻譯成日文，並保持角色語氣：{role_style}。
 中文：
 「{text}」
 請只輸出日文翻譯，不要加入任何解釋
 """
-    def _invoke():
-        return chat_model.invoke([HumanMessage(content=prompt)])
-    
-    result = await asyncio.to_thread(_invoke)
-    return re.sub(r"^\s+|\s+$", "", result.content)
\ No newline at end of file
+
+
+def batch_prompt(texts: List[str], role_style: str) -> str:
+    lines = "\n".join(f"<{i}> {t}" for i, t in enumerate(texts, 1))
+    return f"""
+請將以下每一行中文分別翻譯成日文，並保持角色語氣：{role_style}。
+每行開頭的 <編號> 必須原樣保留，一行對應一行，共 {len(texts)} 行。
+{lines}
+請只輸出翻譯後的 {len(texts)} 行，不要加入任何解釋
+"""
+
+
+def parse_batch(content: str, count: int) -> Dict[int, str]:
+    """取出 <編號> 開頭的各行；缺漏的編號由呼叫端個別補翻。"""
+    results: Dict[int, str] = {}
+    for m in ITEM.finditer(content):
+        idx = int(m.group(1))
+        if 1 <= idx <= count and m.group(2) and idx not in results:
+            results[idx] = m.group(2)
+    return results
+
+
+class Translator:
+    """中翻日介面，TTS 只依賴 translate()。"""
+
+    async def translate(self, text: str, role_style: str = "可愛、撒嬌語氣") -> str:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, float]:
+        return {}
+
+
+class LLMTranslator(Translator):
+    """以 LLM 翻譯，並做三件事減少模型呼叫：
+
+    - 已經是日文（假名比例 >= passthrough_ratio）的句子直接沿用
+    - 正規化後的原文查 LRU 快取
+    - window 秒內同語氣的請求合併成一個 prompt（最多 max_batch 句），以 <編號> 分隔輸出
+
+    llm 只需要提供 `await llm.ainvoke(messages)` 並回傳帶 `.content` 的物件，
+    ChatOllama 或測試用的假模型都可以。
+    """
+
+    def __init__(self, llm, cache: Optional[TranslationCache] = None, window: float = 0.03,
+                 max_batch: int = 8, passthrough_ratio: float = 0.3):
+        self.llm = llm
+        self.cache = cache or TranslationCache()
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.passthrough_ratio = passthrough_ratio
+        self._pending: Dict[str, List[Tuple[str, asyncio.Future]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks = set()
+        self.requests = 0
+        self.passthrough = 0
+        self.batches = 0
+        self.llm_calls = 0
+
+    async def translate(self, text: str, role_style: str = "可愛、撒嬌語氣") -> str:
+        text = " ".join(text.split())
+        if not text:
+            return ""
+        self.requests += 1
+        if self.passthrough_ratio and kana_ratio(text) >= self.passthrough_ratio:
+            self.passthrough += 1
+            return text
+        cached = self.cache.get(text, role_style)
+        if cached is not None:
+            return cached
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        bucket = self._pending.setdefault(role_style, [])
+        bucket.append((text, future))
+        if len(bucket) >= self.max_batch or self.window <= 0:
+            self._flush(role_style)
+        elif role_style not in self._timers:
+            self._timers[role_style] = loop.call_later(self.window, self._flush, role_style)
+        return await future
+
+    # ------------------ 批次 ------------------
+
+    def _flush(self, role_style: str) -> None:
+        timer = self._timers.pop(role_style, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(role_style, None)
+        if batch:
+            task = asyncio.create_task(self._run(batch, role_style))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _invoke(self, prompt: str) -> str:
+        self.llm_calls += 1
+        with span("translate"):
+            result = await self.llm.ainvoke([HumanMessage(content=prompt)])
+        record_llm_tokens(getattr(self.llm, "model", "translate"), getattr(result, "response_metadata", {}))
+        return result.content.strip()
+
+    async def _translate_many(self, texts: List[str], role_style: str) -> Dict[str, str]:
+        if len(texts) == 1:
+            return {texts[0]: await self._invoke(single_prompt(texts[0], role_style))}
+        parsed = parse_batch(await self._invoke(batch_prompt(texts, role_style)), len(texts))
+        results = {texts[i - 1]: t for i, t in parsed.items()}
+        missing = [t for t in texts if t not in results]
+        if missing:
+            logger.warning(f"批次翻譯缺少 {len(missing)}/{len(texts)} 句，改為逐句翻譯")
+            translated = await asyncio.gather(
+                *(self._invoke(single_prompt(t, role_style)) for t in missing)
+            )
+            results.update(zip(missing, translated))
+        return results
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]], role_style: str) -> None:
+        self.batches += 1
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            results = await self._translate_many(texts, role_style)
+        except Exception as e:
+            logger.error(f"翻譯失敗：{e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for text, translated in results.items():
+            if translated:
+                self.cache.put(text, role_style, translated)
+        for text, future in batch:
+            if not future.done():
+                future.set_result(results.get(text, ""))
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "requests": self.requests,
+            "passthrough": self.passthrough,
+            "batches": self.batches,
+            "llm_calls": self.llm_calls,
+            "cache": self.cache.stats(),
+        }
+
+
+def build_translator(llm, cache_size: int, window: float, max_batch: int,
+                     passthrough_ratio: float) -> Translator:
+    return LLMTranslator(llm, TranslationCache(cache_size), window=window,
+                         max_batch=max_batch, passthrough_ratio=passthrough_ratio)
@@ -1,29 +1,145 @@
 import re, asyncio, logging
-from typing import Optional
-from tts_voicevox import TTS
-from utils.file_cleanup import clean_old_audio_files
-from tts.translation import translate_to_japanese
-from config import TRANSLATE
+from typing import AsyncIterator, List, Optional
+from tts.voicevox_client import VoicevoxClient
+from tts.cache import build_audio_cache
+from tts.encode import encode_audio, resolve_audio_format
+from utils.text_analysis import analyze
+from tts.translation import build_translator
+from llm.backend import lazy_chat_model
+from llm.scheduler import scheduler, ScheduledModel
+from config import TRANSLATE, TTS_SPEAKER_ID, TTS_PARALLEL, AUDIO_DIR
+from config import AUDIO_CACHE_MAX_BYTES, AUDIO_CACHE_MAX_FILES, AUDIO_CACHE_SHARED, AUDIO_CACHE_GRACE, TRANSLATION_CACHE_SIZE
+from config import TRANSLATE_MODEL, TRANSLATE_KEEP_ALIVE, TRANSLATE_NUM_CTX
+from config import LLM_BACKEND, FAKE_LLM_LATENCY, FAKE_LLM_TOKENS_PER_SEC, FAKE_LLM_PARALLEL
+from config import TRANSLATE_BATCH_WINDOW, TRANSLATE_MAX_BATCH, TRANSLATE_PASSTHROUGH_RATIO
+from config import AUDIO_BACKEND, AUDIO_MEMORY_MAX_BYTES, AUDIO_MEMORY_TTL, AUDIO_FORMAT
+from config import VOICEVOX_URLS, VOICEVOX_TIMEOUT, VOICEVOX_CONNECT_TIMEOUT, VOICEVOX_RETRIES, VOICEVOX_ENGINE_CONCURRENCY
 
 logger = logging.getLogger("app")
-tts = TTS(speaker_id=58)
+tts = VoicevoxClient(
+    VOICEVOX_URLS,
+    speaker_id=TTS_SPEAKER_ID,
+    timeout=VOICEVOX_TIMEOUT,
+    connect_timeout=VOICEVOX_CONNECT_TIMEOUT,
+    concurrency=VOICEVOX_ENGINE_CONCURRENCY,
+    retries=VOICEVOX_RETRIES,
+)
+audio_cache = build_audio_cache(
+    AUDIO_BACKEND, AUDIO_DIR,
+    max_bytes=AUDIO_CACHE_MAX_BYTES,
+    max_files=AUDIO_CACHE_MAX_FILES,
+    memory_max_bytes=AUDIO_MEMORY_MAX_BYTES,
+    ttl=AUDIO_MEMORY_TTL,
+    fmt=resolve_audio_format(AUDIO_FORMAT),
+    shared=AUDIO_CACHE_SHARED,
+    grace=AUDIO_CACHE_GRACE,
+)
+translator = build_translator(
+    ScheduledModel(lazy_chat_model(
+        LLM_BACKEND, TRANSLATE_MODEL, TRANSLATE_KEEP_ALIVE, TRANSLATE_NUM_CTX,
+        fake_latency=FAKE_LLM_LATENCY, fake_tokens_per_sec=FAKE_LLM_TOKENS_PER_SEC, fake_parallel=FAKE_LLM_PARALLEL,
+    ), scheduler, "translate"),
+    cache_size=TRANSLATION_CACHE_SIZE,
+    window=TRANSLATE_BATCH_WINDOW,
+    max_batch=TRANSLATE_MAX_BATCH,
+    passthrough_ratio=TRANSLATE_PASSTHROUGH_RATIO,
+)
+_engine_version: Optional[str] = None
+
+SENTENCE_END = re.compile(r"(?<=[。！？!?…\n])|(?<=[～~](?![～~]))")
+
+def strip_emotion_tags(text: str) -> str:
+    return analyze(text).clean_text
+
+def split_sentences(text: str, min_len: int = 6) -> List[str]:
+    """依句尾標點切句；太短的片段併入下一句，避免產生大量零碎音檔。"""
+    pieces = [p.strip() for p in SENTENCE_END.split(text) if p.strip()]
+    sentences: List[str] = []
+    buf = ""
+    for p in pieces:
+        buf += p
+        if len(buf) >= min_len:
+            sentences.append(buf)
+            buf = ""
+    if buf:
+        if sentences:
+            sentences[-1] += buf
+        else:
+            sentences.append(buf)
+    return sentences
+
+async def get_engine_version() -> str:
+    """VOICEVOX 版本是快取鍵的一部分，升級引擎後舊音檔自然失效。"""
+    global _engine_version
+    if _engine_version is None:
+        try:
+            _engine_version = await tts.engine_version()
+        except Exception as e:
+            logger.warning(f"取得 VOICEVOX 版本失敗：{e}")
+            return "unknown"
+    return _engine_version
+
+async def synthesize_cached(clean_text: str, engine: Optional[asyncio.Semaphore] = None) -> Optional[str]:
+    """快取命中直接回傳音檔網址，未命中才翻譯並呼叫 VOICEVOX。"""
+    engine_version = await get_engine_version()
+    key = audio_cache.key(clean_text, tts.speaker_id, TRANSLATE, engine_version)
+    url = await audio_cache.lookup(key)
+    if url:
+        return url
+    spoken = clean_text
+    if TRANSLATE:
+        spoken = await translator.translate(clean_text, "可愛、撒嬌語氣")
+        logger.info(f"翻譯後文字: {spoken}")
+    if not spoken.strip():
+        return None
+
+    if engine is None:
+        audio = await tts.synthesize(spoken)
+    else:
+        async with engine:
+            audio = await tts.synthesize(spoken)
+    audio, fmt = await encode_audio(audio, audio_cache.format)
+    if fmt != audio_cache.format:
+        # 轉檔失敗：以實際格式存放，下次仍會先嘗試設定的格式
+        key = audio_cache.key(clean_text, tts.speaker_id, TRANSLATE, engine_version, fmt)
+    return await audio_cache.store(key, audio, fmt)
 
 async def synthesize_with_translation(text: str) -> Optional[str]:
     # 去掉 emotion tag
-    clean_text = re.sub(r"\[emotion:\w+\]", "", text).strip()
+    clean_text = strip_emotion_tags(text)
     if not clean_text:
         logger.warning("TTS文字為空，略過生成")
         return None
     logger.info(f"TTS 文字: {clean_text}")
-    if TRANSLATE:
-        clean_text = await translate_to_japanese(clean_text, "可愛、撒嬌語氣")
-        logger.info(f"翻譯後文字: {clean_text}")
+    return await synthesize_cached(clean_text)
+
+async def synthesize_chunks(text: str, parallel: int = TTS_PARALLEL) -> AsyncIterator[Optional[str]]:
+    """分句翻譯與合成，依原本順序逐句 yield 音檔網址（失敗的句子為 None）。
+
+    所有句子同時開始翻譯，送往 VOICEVOX 的合成最多 parallel 個並行；
+    第一句一完成就能先播放，不必等整段回覆合成完。已快取的句子不會重新合成。
+    """
+    clean_text = strip_emotion_tags(text)
+    if not clean_text:
+        logger.warning("TTS文字為空，略過生成")
+        return
+    sentences = split_sentences(clean_text)
+    engine = asyncio.Semaphore(max(1, parallel))
+
+    async def _one(sentence: str) -> Optional[str]:
+        try:
+            return await synthesize_cached(sentence, engine)
+        except Exception as e:
+            logger.error(f"分句 TTS 失敗：{e}")
+            return None
 
-    # 呼叫同步 TTS 放到 thread pool
-    def _synth():
-        return tts.synthesize_to_file(clean_text)
-    
-    url = await asyncio.to_thread(_synth)
-    asyncio.create_task(asyncio.to_thread(clean_old_audio_files, max_files=20)) # 背景清理舊語音檔
+    tasks = [asyncio.create_task(_one(s)) for s in sentences]
+    try:
+        for task in tasks:
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
 
-    return url
\ No newline at end of file
+async def synthesize_playlist(text: str, parallel: int = TTS_PARALLEL) -> List[str]:
+    return [url async for url in synthesize_chunks(text, parallel) if url]
@@ -0,0 +1,132 @@
+import random
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+
+import httpx
+
+from utils.metrics import span
+
+logger = logging.getLogger("app")
+
+
+class VoicevoxError(RuntimeError):
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class _Engine:
+    __slots__ = ("url", "semaphore", "in_flight", "down_until")
+
+    def __init__(self, url: str, concurrency: int):
+        self.url = url.rstrip("/")
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.down_until = 0.0
+
+
+class VoicevoxClient:
+    """非同步 VOICEVOX 用戶端。
+
+    - 共用一個 httpx.AsyncClient（keep-alive 連線池），連線與讀取都有逾時
+    - 每個引擎有自己的併發上限；多個引擎時挑目前進行中請求最少的一台
+    - 連線失敗、逾時或 5xx 會換引擎重試，重試間隔為指數退避加隨機抖動，
+      失敗的引擎會暫停分派 cooldown 秒
+    """
+
+    def __init__(self, urls: Sequence[str], speaker_id: int = 58, timeout: float = 30.0,
+                 connect_timeout: float = 3.0, concurrency: int = 2,
+                 retries: int = 2, backoff: float = 0.2, cooldown: float = 5.0):
+        if not urls:
+            raise ValueError("至少需要一個 VOICEVOX 引擎網址")
+        self.urls = list(urls)
+        self.speaker_id = speaker_id
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self._engines: Optional[List[_Engine]] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._rr = 0
+
+    # ------------------ 連線池 ------------------
+
+    def _ensure(self) -> None:
+        # Semaphore 與 AsyncClient 都要在 event loop 內建立
+        if self._client is None:
+            limits = httpx.Limits(
+                max_connections=self.concurrency * len(self.urls) * 2,
+                max_keepalive_connections=self.concurrency * len(self.urls),
+            )
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=limits)
+            self._engines = [_Engine(url, self.concurrency) for url in self.urls]
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._engines = None
+
+    def _pick(self, exclude: Optional[_Engine] = None) -> _Engine:
+        now = asyncio.get_running_loop().time()
+        candidates = [e for e in self._engines if e.down_until <= now and e is not exclude]
+        if not candidates:
+            candidates = [e for e in self._engines if e is not exclude] or self._engines
+        least = min(e.in_flight for e in candidates)
+        least_busy = [e for e in candidates if e.in_flight == least]
+        self._rr += 1
+        return least_busy[self._rr % len(least_busy)]
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [{"url": e.url, "in_flight": e.in_flight} for e in (self._engines or [])]
+
+    # ------------------ API ------------------
+
+    async def _run(self, engine: _Engine, text: str) -> bytes:
+        with span("voicevox_audio_query"):
+            resp = await self._client.post(
+                f"{engine.url}/audio_query", params={"text": text, "speaker": self.speaker_id}
+            )
+        if resp.status_code != 200:
+            raise VoicevoxError(f"audio_query failed: {resp.text[:200]}", resp.status_code)
+        with span("voicevox_synthesis"):
+            synth = await self._client.post(
+                f"{engine.url}/synthesis", params={"speaker": self.speaker_id}, json=resp.json()
+            )
+        if synth.status_code != 200:
+            raise VoicevoxError(f"synthesis failed: {synth.text[:200]}", synth.status_code)
+        return synth.content
+
+    async def synthesize(self, text: str) -> bytes:
+        """audio_query + synthesis，回傳 wav 位元組。"""
+        self._ensure()
+        last_error: Optional[Exception] = None
+        engine = None
+        for attempt in range(self.retries + 1):
+            engine = self._pick(exclude=engine if len(self._engines) > 1 else None)
+            engine.in_flight += 1
+            try:
+                async with engine.semaphore:
+                    return await self._run(engine, text)
+            except (httpx.TransportError, VoicevoxError) as e:
+                last_error = e
+                retryable = isinstance(e, httpx.TransportError) or (e.status or 0) >= 500
+                if not retryable:
+                    raise
+                engine.down_until = asyncio.get_running_loop().time() + self.cooldown
+                logger.warning(f"VOICEVOX {engine.url} 失敗（第 {attempt + 1} 次）：{e}")
+            finally:
+                engine.in_flight -= 1
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+        raise VoicevoxError(f"VOICEVOX 合成失敗：{last_error}")
+
+    async def engine_version(self) -> str:
+        self._ensure()
+        engine = self._pick()
+        resp = await self._client.get(f"{engine.url}/version")
+        if resp.status_code != 200:
+            raise VoicevoxError("version failed", resp.status_code)
+        return str(resp.json())
@@ -1,19 +1,171 @@
 import os
+import time
 import logging
-from config import AUDIO_DIR
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
-logger = logging.getLogger("app")  
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 flock，shared 模式退回只有行程內的鎖
+    fcntl = None
 
-def clean_old_audio_files(max_files: int = 20) -> None:
-    try:
-        if not os.path.exists(AUDIO_DIR):
+logger = logging.getLogger("app")
+
+LOCK_FILE = ".lru.lock"
+
+
+class DiskLRU:
+    """以檔案大小與數量為上限的目錄 LRU。
+
+    啟動時掃描一次目錄（依 mtime 排序當作初始 LRU 順序），之後新增/讀取
+    都只更新記憶體中的索引，不必每輪重新 list + stat + sort 整個目錄。
+
+    shared=True 時（多個 worker 共用同一個目錄）：讀取會更新檔案 mtime 讓其他行程看得到；
+    本行程的索引超出上限、或距離上次同步超過 sync_interval 秒時，先取得目錄上的檔案鎖
+    並重新掃描，以磁碟上的 mtime 決定淘汰順序，且不刪除 grace 秒內寫入或讀取過的檔案
+    （可能剛交給用戶端，還沒播放）。
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_files: int,
+                 suffix: Union[str, Tuple[str, ...]] = ".wav", shared: bool = False, grace: float = 0.0,
+                 sync_interval: float = 30.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.suffix = suffix
+        self.shared = shared
+        self.grace = grace
+        self.sync_interval = sync_interval
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self._retry_at = 0.0  # shared 模式：超出上限但都在 grace 內時，到這個時間前不再重掃
+        self._synced_at = time.time()
+        self._scan()
+
+    def _read_dir(self) -> List[Tuple[float, str, int]]:
+        """回傳 (mtime, 檔名, 大小)，由舊到新排序。"""
+        found = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith(self.suffix):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue  # 掃描途中被其他行程刪除
+                    found.append((st.st_mtime, entry.name, st.st_size))
+        found.sort()
+        return found
+
+    def _load(self, found: List[Tuple[float, str, int]]) -> None:
+        with self._lock:
+            self._entries = OrderedDict((name, size) for _, name, size in found)
+            self._bytes = sum(self._entries.values())
+
+    def _scan(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self._load(self._read_dir())
+        self.evict()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    def touch(self, name: str) -> bool:
+        """標記為最近使用；檔案已不在索引中（或已被其他行程刪除）回傳 False。"""
+        with self._lock:
+            if name not in self._entries:
+                return False
+            self._entries.move_to_end(name)
+        if self.shared:
+            try:
+                os.utime(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                with self._lock:
+                    self._bytes -= self._entries.pop(name, 0)
+                return False
+        return True
+
+    def add(self, name: str, size: Optional[int] = None) -> None:
+        if size is None:
+            size = os.path.getsize(os.path.join(self.directory, name))
+        with self._lock:
+            self._bytes -= self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._bytes += size
+        self.evict()
+
+    def _over_limit(self) -> bool:
+        return len(self._entries) > self.max_files or self._bytes > self.max_bytes
+
+    @contextmanager
+    def _dir_lock(self) -> Iterator[None]:
+        """跨行程的目錄鎖（flock）；不支援時只是空的 context。"""
+        if fcntl is None:
+            yield
             return
-        files = sorted(
-            [f for f in os.listdir(AUDIO_DIR) if f.endswith(".wav")],
-            key=lambda x: os.path.getmtime(os.path.join(AUDIO_DIR, x)),
-        )
-        for f in files[:-max_files]:
-            os.remove(os.path.join(AUDIO_DIR, f))
-        logger.info(f"只保留最新 {max_files} 個檔案")
-    except Exception as e:
-        logger.error(f"清理語音快取失敗：{e}")
\ No newline at end of file
+        with open(os.path.join(self.directory, LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def evict(self) -> None:
+        if self.shared:
+            now = time.time()
+            due = self._over_limit() or now - self._synced_at >= self.sync_interval
+            if due and now >= self._retry_at:
+                with self._dir_lock():
+                    self._evict_shared()
+            return
+        removed = []
+        with self._lock:
+            while self._entries and self._over_limit():
+                name, size = self._entries.popitem(last=False)
+                self._bytes -= size
+                removed.append(name)
+        self._remove(removed)
+
+    def _evict_shared(self) -> None:
+        # 本行程的索引看不到其他 worker 新寫入或刪除的檔案，以磁碟上的狀態為準
+        found = self._read_dir()
+        self._synced_at = time.time()
+        files, total = len(found), sum(size for _, _, size in found)
+        cutoff = time.time() - self.grace
+        removed = []
+        self._retry_at = 0.0
+        for mtime, name, size in found:
+            if files <= self.max_files and total <= self.max_bytes:
+                break
+            if mtime > cutoff:
+                self._retry_at = mtime + self.grace  # 剩下的都在 grace 內，寧可暫時超出上限
+                break
+            removed.append(name)
+            files -= 1
+            total -= size
+        self._remove(removed)
+        self._load(found[len(removed):])
+
+    def _remove(self, removed: List[str]) -> None:
+        for name in removed:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"清理語音快取失敗：{e}")
+        self.evictions += len(removed)
+
+    def stats(self) -> Dict[str, int]:
+        return {"files": len(self._entries), "bytes": self._bytes, "evictions": self.evictions}
+
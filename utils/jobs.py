@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import zlib
+from typing import Any, Awaitable, Callable, List
+
+logger = logging.getLogger("app")
+
+Job = Callable[[], Awaitable[Any]]
+
+DROP_POLICIES = ("drop_oldest", "drop_newest", "block")
+
+
+class PostTurnPipeline:
+    """回覆送出後才執行的背景工作佇列（記憶抽取、親密度評估）。
+
+    每個 worker 有自己的有界佇列，同一個 user_id 永遠分到同一個 worker，
+    所以同一位使用者的工作會依序執行，adjust_intimacy 的平滑結果不受併發影響。
+    """
+
+    def __init__(self, workers: int = 4, maxsize: int = 100, drop_policy: str = "drop_oldest"):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"未知的 drop_policy: {drop_policy}")
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self._accepting = False
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def _shard(self, user_id: str) -> asyncio.Queue:
+        return self._queues[zlib.crc32(user_id.encode("utf-8")) % self.workers]
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._queues = [asyncio.Queue(maxsize=self.maxsize) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+        self._accepting = True
+        logger.info(f"背景工作佇列啟動：{self.workers} 個 worker，佇列上限 {self.maxsize}")
+
+    async def stop(self, drain_timeout: float = 0) -> None:
+        """停止接受新工作，最多等 drain_timeout 秒讓已排入的工作做完，剩下的才取消。"""
+        self._accepting = False
+        if self._tasks and drain_timeout > 0:
+            try:
+                await asyncio.wait_for(self.join(), drain_timeout)
+            except asyncio.TimeoutError:
+                pending = sum(q.qsize() for q in self._queues)
+                logger.warning(f"背景工作 {drain_timeout}s 內未做完，取消執行中的工作與排隊中的 {pending} 個")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for q in self._queues:
+            while not q.empty():
+                _, fut = q.get_nowait()
+                fut.cancel()
+        self._tasks = []
+        self._queues = []
+
+    async def submit(self, user_id: str, job: Job) -> "asyncio.Future[Any]":
+        """排入一個工作，回傳可等待結果的 future；被丟棄的工作其 future 會被取消。"""
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        if not self.running:
+            # 尚未啟動（例如測試環境）時直接執行
+            try:
+                fut.set_result(await job())
+            except Exception as e:
+                logger.error(f"背景工作失敗：{e}")
+                fut.set_result(None)
+            return fut
+        if not self._accepting:
+            logger.warning(f"背景工作佇列正在關閉，不再接受使用者 {user_id} 的新工作")
+            fut.cancel()
+            return fut
+
+        q = self._shard(user_id)
+        if self.drop_policy == "block":
+            await q.put((job, fut))
+            return fut
+        if q.full():
+            self.dropped += 1
+            if self.drop_policy == "drop_newest":
+                logger.warning(f"背景工作佇列已滿，丟棄使用者 {user_id} 的新工作")
+                fut.cancel()
+                return fut
+            _, old_fut = q.get_nowait()
+            q.task_done()
+            old_fut.cancel()
+            logger.warning("背景工作佇列已滿，丟棄最舊的工作")
+        q.put_nowait((job, fut))
+        return fut
+
+    async def join(self) -> None:
+        """等待目前所有排入的工作完成。"""
+        await asyncio.gather(*(q.join() for q in self._queues))
+
+    async def _worker(self, q: asyncio.Queue) -> None:
+        while True:
+            job, fut = await q.get()
+            try:
+                if not fut.cancelled():
+                    result = await job()
+                    if not fut.done():
+                        fut.set_result(result)
+            except asyncio.CancelledError:
+                fut.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"背景工作失敗：{e}")
+                if not fut.done():
+                    fut.set_result(None)
+            finally:
+                q.task_done()
@@ -0,0 +1,85 @@
+import json
+from typing import Optional
+
+
+class IncrementalJSONParser:
+    """逐段餵入 LLM 輸出，找出第一個完整的 JSON 物件。
+
+    取代貪婪的 re.search(r"\\{.*\\}")：會略過物件前後的說明文字、
+    正確處理字串中的大括號，輸出被截斷時也能嘗試補齊後解析。
+    """
+
+    def __init__(self):
+        self._buf: list = []
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._stack: list = []
+        self.result: Optional[dict] = None
+
+    def feed(self, chunk: str) -> Optional[dict]:
+        if self.result is not None:
+            return self.result
+        for ch in chunk:
+            if not self._started:
+                if ch != "{":
+                    continue
+                self._started = True
+            self._buf.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append("}" if ch == "{" else "]")
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if not self._stack:
+                    self.result = self._loads("".join(self._buf))
+                    if self.result is None:
+                        self._reset()
+                    else:
+                        return self.result
+        return None
+
+    def close(self) -> Optional[dict]:
+        """輸入結束；若物件未閉合，補上缺少的引號與括號後再解析一次。"""
+        if self.result is not None or not self._started:
+            return self.result
+        text = "".join(self._buf)
+        if self._in_string:
+            text += '"'
+        text = text.rstrip().rstrip(",")
+        if text.endswith(":"):
+            text += "null"
+        text += "".join(reversed(self._stack))
+        self.result = self._loads(text)
+        return self.result
+
+    def _reset(self) -> None:
+        self._buf = []
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        self._stack = []
+
+    @staticmethod
+    def _loads(text: str) -> Optional[dict]:
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+
+def parse_json_object(text: str) -> Optional[dict]:
+    """從整段文字中取出第一個 JSON 物件，失敗回傳 None。"""
+    parser = IncrementalJSONParser()
+    return parser.feed(text) or parser.close()
@@ -0,0 +1,219 @@
+import time
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 不依賴 prometheus_client，直接輸出 Prometheus 文字格式（text/plain; version=0.0.4）
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_labels(self.label_names, k)} {v}" for k, v in sorted(self._values.items())
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # 各 bucket 計數 + [sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, series in sorted(self._series.items()):
+            for bound, count in zip(self.buckets, series):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {int(count)}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {int(series[-1])}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {int(series[-1])}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect: Callable[[], None]) -> None:
+        """collect 會在每次輸出前被呼叫，用來把快取命中率之類的狀態寫進 Gauge。"""
+        self._collectors.append(collect)
+
+    def render(self) -> str:
+        for collect in self._collectors:
+            collect()
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("chat_stage_seconds", "各階段耗時（秒）", ("stage",))
+STAGE_IN_FLIGHT = REGISTRY.gauge("chat_stage_in_flight", "各階段進行中的數量", ("stage",))
+STAGE_ERRORS = REGISTRY.counter("chat_stage_errors_total", "各階段拋出例外的次數", ("stage",))
+LLM_TOKENS = REGISTRY.counter("llm_tokens_total", "LLM token 數（prompt / completion）", ("model", "kind"))
+CACHE_HIT_RATE = REGISTRY.gauge("cache_hit_rate", "各快取命中率", ("cache",))
+CACHE_ENTRIES = REGISTRY.gauge("cache_entries", "各快取目前筆數", ("cache",))
+
+# ------------------ span ------------------
+
+# 目前請求累積的 (階段, 秒數)，由 ServerTimingMiddleware 建立
+_request_spans: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "request_spans", default=None
+)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """量測一個階段：寫入直方圖、進行中數量，並記到目前請求的 Server-Timing。"""
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        if not isinstance(e, (GeneratorExit, asyncio.CancelledError)):
+            STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_IN_FLIGHT.dec(stage=stage)
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def timed(stage: str):
+    """async 函式的 span 裝飾器。"""
+    def decorator(func):
+        async def wrapper(*args, **kwargs):
+            with span(stage):
+                return await func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+
+async def run_in_thread(stage: str, func, *args):
+    """asyncio.to_thread 加上 span，SQLite 等阻塞呼叫都經過這裡。"""
+    with span(stage):
+        return await asyncio.to_thread(func, *args)
+
+
+def record_llm_tokens(model: str, metadata: dict) -> None:
+    LLM_TOKENS.inc(metadata.get("prompt_eval_count") or 0, model=model, kind="prompt")
+    LLM_TOKENS.inc(metadata.get("eval_count") or 0, model=model, kind="completion")
+
+
+def server_timing(spans: List[Tuple[str, float]]) -> str:
+    totals: Dict[str, float] = {}
+    for stage, elapsed in spans:
+        totals[stage] = totals.get(stage, 0.0) + elapsed
+    return ", ".join(f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in totals.items())
+
+
+class ServerTimingMiddleware:
+    """把請求期間的 span 以 Server-Timing 標頭回傳，瀏覽器 DevTools 與前端都能讀到。
+
+    串流回應的標頭在第一個位元組前就送出，只會包含送出前已完成的階段。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        spans: List[Tuple[str, float]] = []
+        token = _request_spans.set(spans)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start" and spans:
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(spans).encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_spans.reset(token)
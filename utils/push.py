@@ -0,0 +1,118 @@
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger("app")
+
+WS_CONNECTIONS = REGISTRY.gauge("ws_connections", "目前的 WebSocket 連線數")
+WS_MESSAGES = REGISTRY.counter("ws_messages_total", "WebSocket 收送的訊息數", ("direction", "type"))
+WS_CLOSED = REGISTRY.counter("ws_closed_total", "伺服器主動關閉的 WebSocket 連線數", ("reason",))
+
+# 自訂關閉代碼（4000~4999 保留給應用程式）
+CLOSE_NO_SESSION = 4401          # 尚未取得 session，請先呼叫任一 HTTP 路由
+CLOSE_HEARTBEAT_TIMEOUT = 4408   # 太久沒收到用戶端的訊息
+CLOSE_SLOW_CONSUMER = 1013       # 用戶端讀取太慢，送出佇列一直是滿的
+CLOSE_GOING_AWAY = 1001          # 伺服器關機
+
+
+class PushClosed(Exception):
+    """連線已關閉，無法再推送。"""
+
+
+class PushConnection:
+    """單一 WebSocket 連線的推送通道。
+
+    - 要送出的訊息先進有界佇列，由一個 sender task 依序送出；佇列滿時 send() 會等待（背壓），
+      等待超過 send_timeout 秒表示用戶端讀取太慢，直接關閉連線
+    - 每 heartbeat_interval 秒送一次 ping；超過 heartbeat_timeout 秒沒收到用戶端任何訊息就關閉
+    """
+
+    def __init__(self, websocket: WebSocket, queue_size: int = 256, send_timeout: float = 10,
+                 heartbeat_interval: float = 20, heartbeat_timeout: float = 60):
+        self.websocket = websocket
+        self.send_timeout = send_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.closed = False
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+        self._last_seen = time.monotonic()
+
+    async def start(self) -> None:
+        WS_CONNECTIONS.inc()
+        self._tasks = [asyncio.create_task(self._sender()), asyncio.create_task(self._heartbeat())]
+
+    async def send(self, message: Dict[str, Any]) -> None:
+        if self.closed:
+            raise PushClosed()
+        try:
+            await asyncio.wait_for(self._queue.put(message), self.send_timeout)
+        except asyncio.TimeoutError:
+            await self.close(CLOSE_SLOW_CONSUMER, "slow consumer")
+            raise PushClosed()
+
+    async def receive(self) -> Dict[str, Any]:
+        """等待用戶端的下一則訊息；無法解析的訊息回傳空 dict。斷線時丟出 WebSocketDisconnect。"""
+        text = await self.websocket.receive_text()
+        self._last_seen = time.monotonic()
+        try:
+            message = json.loads(text)
+        except ValueError:
+            message = None
+        if not isinstance(message, dict):
+            return {}
+        WS_MESSAGES.inc(direction="in", type=str(message.get("type")))
+        return message
+
+    async def close(self, code: int = 1000, reason: str = "") -> None:
+        if self.closed:
+            return
+        self.closed = True
+        WS_CONNECTIONS.dec()
+        if code != 1000:
+            WS_CLOSED.inc(reason=reason or str(code))
+        current = asyncio.current_task()
+        for task in self._tasks:
+            if task is not current:
+                task.cancel()
+        try:
+            await self.websocket.close(code, reason)
+        except Exception:
+            pass  # 用戶端已先斷線
+
+    async def _sender(self) -> None:
+        try:
+            while True:
+                message = await self._queue.get()
+                await self.websocket.send_text(json.dumps(message, ensure_ascii=False))
+                WS_MESSAGES.inc(direction="out", type=str(message.get("type")))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"WebSocket 送出失敗，關閉連線：{e}")
+            await self.close(1011, "send failed")
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            if time.monotonic() - self._last_seen > self.heartbeat_timeout:
+                await self.close(CLOSE_HEARTBEAT_TIMEOUT, "heartbeat timeout")
+                return
+            if not self._queue.full():
+                self._queue.put_nowait({"type": "ping", "t": time.time()})
+
+
+async def receive_or_disconnect(connection: PushConnection) -> Optional[Dict[str, Any]]:
+    """receive() 的包裝：用戶端斷線或連線已關閉時回傳 None。"""
+    if connection.closed:
+        return None
+    try:
+        return await connection.receive()
+    except (WebSocketDisconnect, RuntimeError):
+        return None
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger("app")
+
+FAST_PATH = REGISTRY.counter("fast_path_requests_total", "低資訊訊息快速路徑的請求數", ("result",))
+
+# generate(background) 產生一則新回覆；background=True 表示是補充回覆池，沒有使用者在等
+Generate = Callable[[bool], Awaitable[Optional[str]]]
+
+
+class ReplyPool:
+    """低資訊訊息（「嗯」「好」「謝謝」）的回覆池，依 key 分組。
+
+    - 池中已有回覆就輪流回傳（hit）；未滿 size 種時在背景再產生一則，慢慢增加變化
+    - 池是空的才讓請求等待產生（miss）；同一個 key 同時進來的請求共用同一次產生（coalesced）
+    - 以 LRU 保留 max_keys 組
+    """
+
+    def __init__(self, size: int = 3, max_keys: int = 256):
+        self.size = max(1, size)
+        self.max_keys = max_keys
+        self._pools: "OrderedDict[Hashable, List[str]]" = OrderedDict()
+        self._next: Dict[Hashable, int] = {}
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._pools)
+
+    async def get(self, key: Hashable, generate: Generate) -> Optional[str]:
+        pool = self._pools.get(key)
+        if pool:
+            self.hits += 1
+            FAST_PATH.inc(result="hit")
+            self._pools.move_to_end(key)
+            i = self._next.get(key, 0)
+            self._next[key] = i + 1
+            if len(pool) < self.size and key not in self._inflight:
+                self._start(key, generate, background=True)
+            return pool[i % len(pool)]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            FAST_PATH.inc(result="coalesced")
+        else:
+            self.misses += 1
+            FAST_PATH.inc(result="miss")
+            task = self._start(key, generate, background=False)
+        # shield：等待中的請求被取消時，不影響其他共用這次產生的請求
+        return await asyncio.shield(task)
+
+    def _start(self, key: Hashable, generate: Generate, background: bool) -> asyncio.Task:
+        task = asyncio.create_task(self._fill(key, generate, background))
+        self._inflight[key] = task
+        return task
+
+    async def _fill(self, key: Hashable, generate: Generate, background: bool) -> Optional[str]:
+        try:
+            reply = await generate(background)
+        except Exception as e:
+            logger.error(f"產生快速回覆失敗：{e}")
+            reply = None
+        finally:
+            self._inflight.pop(key, None)
+        if reply:
+            pool = self._pools.setdefault(key, [])
+            if reply not in pool and len(pool) < self.size:
+                pool.append(reply)
+            self._pools.move_to_end(key)
+            while len(self._pools) > self.max_keys:
+                old, _ = self._pools.popitem(last=False)
+                self._next.pop(old, None)
+        return reply
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / total, 4) if total else 0.0,
+            "entries": sum(len(p) for p in self._pools.values()),
+        }
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Sequence
+
+from utils.metrics import REGISTRY
+
+logger = logging.getLogger("app")
+
+BRANCH_DEGRADED = REGISTRY.counter("task_graph_degraded_total", "逾時或失敗而改走降級路徑的節點數", ("node", "reason"))
+
+Results = Dict[str, Any]
+
+
+class Node(NamedTuple):
+    """依賴圖中的一個節點。
+
+    run 收到所依賴節點的結果（dict）並回傳自己的結果；超過 timeout 秒或拋出例外時，
+    改用 fallback(依賴結果) 的回傳值（沒有 fallback 則為 None），不影響其他分支。
+    """
+    name: str
+    run: Callable[[Results], Awaitable[Any]]
+    deps: Sequence[str] = ()
+    timeout: Optional[float] = None
+    fallback: Optional[Callable[[Results], Any]] = None
+
+
+async def _run_node(node: Node, deps: Dict[str, "asyncio.Task"]) -> Any:
+    inputs = {name: await task for name, task in deps.items()}
+    try:
+        return await asyncio.wait_for(node.run(inputs), node.timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f"{node.name} 超過 {node.timeout}s，改走降級路徑")
+        BRANCH_DEGRADED.inc(node=node.name, reason="timeout")
+    except Exception as e:
+        logger.error(f"{node.name} 失敗，改走降級路徑：{e}")
+        BRANCH_DEGRADED.inc(node=node.name, reason="error")
+    if node.fallback is None:
+        return None
+    result = node.fallback(inputs)
+    return await result if asyncio.iscoroutine(result) else result
+
+
+async def run_graph(nodes: Sequence[Node]) -> Results:
+    """以 asyncio.TaskGroup 執行依賴圖：每個節點等依賴完成後立即開始，彼此獨立的分支同時進行。
+
+    總耗時等於最長的一條路徑，而不是所有節點相加。nodes 需依相依順序排列（依賴在前）。
+    """
+    tasks: Dict[str, asyncio.Task] = {}
+    async with asyncio.TaskGroup() as group:
+        for node in nodes:
+            missing = [d for d in node.deps if d not in tasks]
+            if missing:
+                raise ValueError(f"節點 {node.name} 的依賴 {missing} 未定義或排在它之後")
+            tasks[node.name] = group.create_task(_run_node(node, {d: tasks[d] for d in node.deps}))
+    return {name: task.result() for name, task in tasks.items()}
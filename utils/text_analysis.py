@@ -0,0 +1,163 @@
+import re
+import json
+import logging
+import unicodedata
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from config import TEXT_RULES_FILE
+
+logger = logging.getLogger("app")
+
+TAG = re.compile(r"\[(?i:emotion):(\w+)\]")
+REPEATED = re.compile(r"(.)\1{2,}")  # 三個以上的重複字縮成兩個：「嗯嗯嗯」→「嗯嗯」，「88」「謝謝」不變
+TRAILING = " \t\r\n!！。.，,~～?？…ー-"
+
+
+class Analysis(NamedTuple):
+    facts: Tuple[str, ...]      # 依規則順序抽出的記憶
+    intimacy_change: int        # 關鍵字判斷的親密度變化（-1 / 0 / +1）
+    emotion: Optional[str]      # 最後一個 [emotion:xxx] 標籤（小寫）
+    clean_text: str             # 去掉情緒標籤後的文字
+    keywords: Tuple[str, ...]   # 命中的關鍵字（依第一次出現的位置）
+
+
+class TextAnalyzer:
+    """一次分析同時取得記憶、親密度關鍵字與情緒標籤，取代 utils/regex.py 的多次 re.search。
+
+    關鍵字都是固定字串：先用「訊息中出現的字元 ∩ 關鍵字首字」挑出可能命中的關鍵字，
+    再以 str.find 確認，大部分訊息只需檢查少數幾個；命中的關鍵字對應回會用到它的規則，
+    只有這些規則才執行（需要擷取的規則各自有預先編譯的 pattern），情緒標籤也只在
+    訊息含有「[」時才用 re 找。規則表見 utils/text_rules.json：
+
+    - facts：capture 為 word（關鍵字後接的詞）、keyword（關鍵字本身）、
+      number（關鍵字前的 1~3 位數字，可用 after 要求同一行前面出現某字）；
+      requires 表示訊息中需同時出現的字
+    - intimacy：依序檢查，第一組有命中的決定親密度變化
+    - emotion_weights：情緒標籤對親密度的加減
+    - low_info：整句只有「嗯」「好」「謝謝」這類低資訊內容時的類別（忽略句尾標點、三個以上的重複字與大小寫）
+    """
+
+    def __init__(self, rules: Dict):
+        self.fact_rules: List[Dict] = rules.get("facts", [])
+        self.intimacy_rules: List[Dict] = rules.get("intimacy", [])
+        self.emotion_weights: Dict[str, int] = rules.get("emotion_weights", {})
+        self.low_info_rules: Dict[str, List[str]] = rules.get("low_info", {})
+        self.low_info: Dict[str, str] = {
+            self._normalize_short(message): cls
+            for cls, messages in self.low_info_rules.items() for message in messages
+        }
+
+        keywords = set()
+        for rule in self.fact_rules + self.intimacy_rules:
+            keywords.update(rule["keywords"])
+            if rule.get("requires"):
+                keywords.add(rule["requires"])
+        # 依首字分組，組內長的在前：同一位置命中多個關鍵字時，keywords 依「位置、長度由長到短」排列
+        self._by_first: Dict[str, Tuple[str, ...]] = {}
+        for k in sorted(keywords, key=len, reverse=True):
+            self._by_first[k[0]] = self._by_first.get(k[0], ()) + (k,)
+        self._first_chars = frozenset(self._by_first)
+        self._facts = [
+            (rule.get("requires"), tuple(rule["keywords"]), rule["template"], self._capture_pattern(rule))
+            for rule in self.fact_rules
+        ]
+        # 關鍵字 → (會用到它的記憶規則編號, 最前面的親密度規則編號)；
+        # 親密度規則依序檢查，第一組有命中的決定變化，所以每個關鍵字只記最前面的那組
+        self._lookup: Dict[str, Tuple[List[int], Optional[int]]] = {}
+        for k in keywords:
+            fact_rules = [i for i, rule in enumerate(self.fact_rules) if k in rule["keywords"]]
+            intimacy = next((i for i, rule in enumerate(self.intimacy_rules) if k in rule["keywords"]), None)
+            self._lookup[k] = (fact_rules, intimacy)
+        self._intimacy_changes = [rule["change"] for rule in self.intimacy_rules]
+
+    @staticmethod
+    def _capture_pattern(rule: Dict) -> Optional["re.Pattern"]:
+        """word / number 規則的擷取 pattern；keyword 規則直接用命中的關鍵字，不需要 pattern。"""
+        capture = rule.get("capture", "keyword")
+        if capture == "keyword":
+            return None
+        alternatives = "|".join(re.escape(k) for k in sorted(rule["keywords"], key=len, reverse=True))
+        if capture == "word":
+            return re.compile(f"(?:{alternatives})(\\w+)")
+        if capture == "number":
+            after = f"{re.escape(rule['after'])}.*?" if rule.get("after") else ""
+            return re.compile(f"{after}(\\d{{1,3}})\\s*(?:{alternatives})")
+        raise ValueError(f"未知的 capture: {capture}")
+
+    @classmethod
+    def from_file(cls, path: str) -> "TextAnalyzer":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def analyze(self, text: str) -> Analysis:
+        found: Dict[str, int] = {}  # 命中的關鍵字 → 第一次出現的位置
+        find = text.find
+        for c in self._first_chars.intersection(text):
+            for k in self._by_first[c]:
+                pos = find(k)
+                if pos >= 0:
+                    found[k] = pos
+        tags = TAG.findall(text) if "[" in text else ()
+
+        facts: List[str] = []
+        change = 0
+        if found:
+            rules, first = self._rule_lookup(found)
+            for i in rules:
+                requires, keywords, template, pattern = self._facts[i]
+                if requires and requires not in found:
+                    continue
+                if pattern is None:
+                    facts.extend(template.format(k) for k in keywords if k in found)
+                else:
+                    m = pattern.search(text)
+                    if m:
+                        facts.append(template.format(m.group(1)))
+            if first is not None:
+                change = self._intimacy_changes[first]
+            if len(found) > 1:
+                # 同一位置的關鍵字首字相同、在同一組內已是長的在前，穩定排序會保留這個順序
+                found = dict.fromkeys(sorted(found, key=found.__getitem__))
+
+        clean = TAG.sub("", text).strip() if tags else text.strip()
+        return Analysis(tuple(facts), change, tags[-1].lower() if tags else None, clean, tuple(found))
+
+    def _rule_lookup(self, found: Dict[str, int]) -> Tuple[List[int], Optional[int]]:
+        """命中的關鍵字會用到的記憶規則（依規則順序）與最前面的親密度規則。"""
+        if len(found) == 1:
+            return self._lookup[next(iter(found))]
+        rules: set = set()
+        first = None
+        lookup = self._lookup
+        for k in found:
+            fact_rules, intimacy = lookup[k]
+            rules.update(fact_rules)
+            if intimacy is not None and (first is None or intimacy < first):
+                first = intimacy
+        return sorted(rules), first
+
+    @staticmethod
+    def _normalize_short(text: str) -> str:
+        text = unicodedata.normalize("NFKC", text).lower().strip(TRAILING)
+        return REPEATED.sub(r"\1\1", " ".join(text.split()))
+
+    def classify(self, text: str) -> Optional[str]:
+        """低資訊訊息的類別（ack / thanks / ...）；一般訊息回傳 None。"""
+        if len(text) > 24:
+            return None
+        return self.low_info.get(self._normalize_short(text))
+
+
+analyzer = TextAnalyzer.from_file(TEXT_RULES_FILE)
+
+
+@lru_cache(maxsize=1024)
+def analyze(text: str) -> Analysis:
+    """同一則訊息在回覆流程中會被多處使用，結果快取起來。"""
+    return analyzer.analyze(text)
+
+
+@lru_cache(maxsize=1024)
+def low_info_class(text: str) -> Optional[str]:
+    return analyzer.classify(text)
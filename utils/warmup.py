@@ -0,0 +1,82 @@
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger("app")
+
+
+class Warmup:
+    """啟動後在背景同時執行各個暖機步驟（載入模型、試合成一句等），全部結束後才算 ready。
+
+    單一步驟失敗只記錄下來，不影響其他步驟；超過 timeout 秒則放棄剩下的步驟。
+    """
+
+    def __init__(self, steps: Dict[str, Callable[[], Awaitable]], timeout: float = 120):
+        self.steps = steps
+        self.timeout = timeout
+        self.results: Dict[str, Dict] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._done = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def start(self) -> None:
+        """開始背景暖機；可重複呼叫，只有第一次有作用。沒有步驟時直接視為完成。"""
+        if self._task is not None or self.done:
+            return
+        self.started_at = time.perf_counter()
+        if not self.steps:
+            self._finish()
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def wait(self) -> None:
+        await self._done.wait()
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def _finish(self) -> None:
+        self.finished_at = time.perf_counter()
+        self._done.set()
+
+    async def _step(self, name: str, step: Callable[[], Awaitable]) -> None:
+        start = time.perf_counter()
+        try:
+            await step()
+            self.results[name] = {"ok": True, "seconds": round(time.perf_counter() - start, 3)}
+        except Exception as e:
+            logger.warning(f"暖機步驟 {name} 失敗：{e}")
+            self.results[name] = {"ok": False, "seconds": round(time.perf_counter() - start, 3), "error": str(e)}
+
+    async def _run(self) -> None:
+        tasks = {asyncio.create_task(self._step(name, step)): name for name, step in self.steps.items()}
+        try:
+            _, pending = await asyncio.wait(tasks, timeout=self.timeout)
+            if pending:
+                logger.warning(f"暖機超過 {self.timeout}s，略過未完成的步驟")
+                for task in pending:
+                    self.results[tasks[task]] = {"ok": False, "error": "timeout"}
+        finally:
+            # 逾時或關機時停止還在進行的步驟
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._finish()
+        logger.info(f"暖機完成：{self.finished_at - self.started_at:.2f}s，{self.results}")
+
+    def status(self) -> Dict:
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = round((self.finished_at or time.perf_counter()) - self.started_at, 3)
+        return {"done": self.done, "seconds": elapsed, "steps": self.results}